@@ -0,0 +1,199 @@
+import os
+import threading
+from bisect import bisect_left
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import text
+
+from app import calendario
+from app.models import Appointment
+
+# Motor de agenda: horario de la clínica, duración de las citas e índice de
+# intervalos por día. El índice de un día se arma una vez con las citas de ese
+# día y se reutiliza mientras su versión en calendariodia no cambie, así que
+# "¿se empalma?" y "siguientes N huecos" no recorren la tabla de citas.
+#
+# AGENDA_HORARIO: bloques "HH:MM-HH:MM" separados por coma
+# AGENDA_DIAS: días hábiles (0 = lunes ... 6 = domingo)
+HORARIO = os.getenv("AGENDA_HORARIO", "09:00-14:00,16:00-20:00")
+DIAS_HABILES = {int(d) for d in os.getenv("AGENDA_DIAS", "0,1,2,3,4,5").split(",") if d.strip()}
+DURACION_MIN = int(os.getenv("AGENDA_DURACION_MIN", "30"))
+PASO_MIN = int(os.getenv("AGENDA_PASO_MIN", str(DURACION_MIN)))
+MAX_DIAS_BUSQUEDA = int(os.getenv("AGENDA_MAX_DIAS_BUSQUEDA", "60"))
+MAX_INDICES = 2000
+MAX_DURACION_MIN = 24 * 60
+
+
+def _minutos(hhmm: str) -> int:
+    h, m = hhmm.strip().split(":")
+    return int(h) * 60 + int(m)
+
+
+def _bloques(spec: str):
+    out = []
+    for parte in spec.split(","):
+        if parte.strip():
+            a, b = parte.split("-")
+            out.append((_minutos(a), _minutos(b)))
+    return sorted(out)
+
+
+BLOQUES = _bloques(HORARIO)
+
+
+class IndiceDia:
+    # Intervalos [ini, fin) en minutos desde las 00:00, ordenados por inicio.
+    # max_fin[k] = mayor fin entre los k+1 primeros: hay empalme con [a, b)
+    # si alguno que empieza antes de b termina después de a.
+    __slots__ = ("inis", "fines", "ids", "max_fin")
+
+    def __init__(self, intervalos):
+        intervalos = sorted(intervalos)
+        self.inis = [i[0] for i in intervalos]
+        self.fines = [i[1] for i in intervalos]
+        self.ids = [i[2] for i in intervalos]
+        self.max_fin = []
+        mx = -1
+        for f in self.fines:
+            mx = max(mx, f)
+            self.max_fin.append(mx)
+
+    def empalma(self, a: int, b: int) -> bool:
+        k = bisect_left(self.inis, b)
+        return k > 0 and self.max_fin[k - 1] > a
+
+    def conflictos(self, a: int, b: int):
+        k = bisect_left(self.inis, b)
+        return [(self.ids[i], self.inis[i], self.fines[i]) for i in range(k) if self.fines[i] > a]
+
+    def libre_desde(self, a: int, b: int) -> int:
+        # Primer minuto >= a en que ya terminó todo lo que se empalma con [a, b)
+        k = bisect_left(self.inis, b)
+        return max(a, self.max_fin[k - 1]) if k else a
+
+
+CITAS_DEL_DIA_SQL = "SELECT id, fecha, duracion_min FROM appointment WHERE fecha >= :a AND fecha < :b"
+
+# (url, día) -> (versión, IndiceDia)
+_indices = {}
+_lock = threading.Lock()
+
+
+def _cargar(session, dia: str) -> IndiceDia:
+    siguiente = (date.fromisoformat(dia) + timedelta(days=1)).isoformat()
+    rows = session.execute(text(CITAS_DEL_DIA_SQL), {"a": dia, "b": siguiente}).all()
+    intervalos = []
+    for aid, fecha, dur in rows:
+        if isinstance(fecha, str):
+            fecha = datetime.fromisoformat(fecha)
+        ini = fecha.hour * 60 + fecha.minute
+        intervalos.append((ini, ini + (dur or DURACION_MIN), aid))
+    return IndiceDia(intervalos)
+
+
+def indices(session, d1: date, d2: date):
+    # {día: IndiceDia} del rango; sólo se recargan los días cuya versión cambió
+    url = str(session.get_bind().url)
+    vers = calendario.versiones(session, d1, d2)
+    out = {}
+    for dia, (version, _) in vers.items():
+        with _lock:
+            st = _indices.get((url, dia))
+        if st and st[0] == version:
+            out[dia] = st[1]
+            continue
+        idx = _cargar(session, dia)
+        with _lock:
+            if len(_indices) >= MAX_INDICES:
+                _indices.clear()
+            _indices[(url, dia)] = (version, idx)
+        out[dia] = idx
+    return out
+
+
+def indice(session, d: date) -> IndiceDia:
+    return indices(session, d, d)[d.isoformat()]
+
+
+def duracion_de(duracion: int | None) -> int:
+    # Duración en minutos (None -> AGENDA_DURACION_MIN); ValueError fuera de 1..MAX_DURACION_MIN
+    if duracion is None:
+        return DURACION_MIN
+    if not 1 <= duracion <= MAX_DURACION_MIN:
+        raise ValueError(f"duracion_min debe estar entre 1 y {MAX_DURACION_MIN}")
+    return duracion
+
+
+def _hhmm(minutos: int) -> str:
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+
+def en_horario(inicio: datetime, duracion: int) -> bool:
+    if inicio.weekday() not in DIAS_HABILES:
+        return False
+    a = inicio.hour * 60 + inicio.minute
+    return any(b0 <= a and a + duracion <= b1 for b0, b1 in BLOQUES)
+
+
+def conflictos(session, inicio: datetime, duracion: int | None = None):
+    # [{id, inicio, fin}] de las citas que se empalman con [inicio, inicio + duración)
+    duracion = duracion_de(duracion)
+    a = inicio.hour * 60 + inicio.minute
+    dia = inicio.date()
+    return [
+        {"id": cid, "inicio": f"{dia.isoformat()}T{_hhmm(i)}", "fin": f"{dia.isoformat()}T{_hhmm(f)}"}
+        for cid, i, f in indice(session, dia).conflictos(a, a + duracion)
+    ]
+
+
+def _redondear(m: int, base: int) -> int:
+    # Sube m al siguiente múltiplo del paso contado desde el inicio del bloque
+    return base + -(-(m - base) // PASO_MIN) * PASO_MIN
+
+
+def libres(session, desde: datetime, n: int = 5, duracion: int | None = None, max_dias: int = MAX_DIAS_BUSQUEDA):
+    # Siguientes n huecos (datetime) de la duración dada a partir de `desde`
+    duracion = duracion_de(duracion)
+    out = []
+    d = desde.date()
+    fin_busqueda = d + timedelta(days=max_dias)
+    while d < fin_busqueda and len(out) < n:
+        tramo = min(fin_busqueda, d + timedelta(days=14))
+        idxs = indices(session, d, tramo - timedelta(days=1))
+        while d < tramo and len(out) < n:
+            if d.weekday() in DIAS_HABILES:
+                idx = idxs[d.isoformat()]
+                minimo = desde.hour * 60 + desde.minute + (1 if desde.second or desde.microsecond else 0) \
+                    if d == desde.date() else 0
+                for b0, b1 in BLOQUES:
+                    m = _redondear(max(b0, minimo), b0)
+                    while m + duracion <= b1 and len(out) < n:
+                        if idx.empalma(m, m + duracion):
+                            m = _redondear(idx.libre_desde(m, m + duracion), b0)
+                            continue
+                        out.append(datetime.combine(d, time(m // 60, m % 60)))
+                        m += PASO_MIN
+            d += timedelta(days=1)
+    return out
+
+
+def agendar(session, patient_id: int, inicio: datetime, duracion: int | None = None, notas: str = "", forzar: bool = False):
+    # Revisa empalmes e inserta en la misma transacción del escritor (BEGIN
+    # IMMEDIATE): entre la revisión y el commit nadie más puede agendar.
+    # Devuelve (cita o None si se rechazó, conflictos). No hace commit.
+    duracion = duracion_de(duracion)
+    choques = conflictos(session, inicio, duracion)
+    if choques and not forzar:
+        return None, choques
+    ap = Appointment(patient_id=patient_id, fecha=inicio, duracion_min=duracion, notas=notas or "")
+    session.add(ap)
+    calendario.tocar(session, [inicio])
+    return ap, choques
+
+
+def respuesta_empalme(session, inicio: datetime, duracion: int | None, choques):
+    return {
+        "ok": False,
+        "error": "La cita se empalma con otra; usa forzar=1 para agendarla de todos modos",
+        "conflictos": choques,
+        "sugerencias": [s.isoformat(timespec="minutes") for s in libres(session, inicio, 3, duracion)],
+    }
@@ -0,0 +1,58 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Reporte del arranque: cuánto tarda cada fase desde que se empieza a importar
+# app.main hasta que la app acepta peticiones, más las tareas que siguen en
+# segundo plano (p. ej. precargar ReportLab). GET /api/arranque y /metrics.
+T0 = time.perf_counter()
+log = logging.getLogger("app.arranque")
+
+fases = {}          # fase -> ms (en orden)
+segundo_plano = {}  # tarea -> ms
+_lock = threading.Lock()
+listo_ms = None
+
+
+def registrar(fase: str, ms: float, fondo: bool = False):
+    with _lock:
+        (segundo_plano if fondo else fases)[fase] = round(ms, 1)
+
+
+@contextmanager
+def fase(nombre: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar(nombre, (time.perf_counter() - t0) * 1000)
+
+
+def importacion_terminada():
+    registrar("importacion", (time.perf_counter() - T0) * 1000)
+
+
+def listo():
+    global listo_ms
+    listo_ms = round((time.perf_counter() - T0) * 1000, 1)
+    log.info("arranque en %.0f ms: %s", listo_ms, ", ".join(f"{k} {v:.0f} ms" for k, v in fases.items()))
+
+
+def en_segundo_plano(nombre: str, fn):
+    # Corre fn en un hilo daemon y registra su duración como tarea de fondo
+    def _correr():
+        t0 = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            log.exception("falló la tarea de arranque %s", nombre)
+        finally:
+            registrar(nombre, (time.perf_counter() - t0) * 1000, fondo=True)
+
+    threading.Thread(target=_correr, name=f"arranque-{nombre}", daemon=True).start()
+
+
+def reporte():
+    with _lock:
+        return {"listo_ms": listo_ms, "fases_ms": dict(fases), "segundo_plano_ms": dict(segundo_plano)}
@@ -0,0 +1,209 @@
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import shutil
+import stat
+import sys
+import tempfile
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles
+
+# Estáticos con huella: cada archivo de app/static se copia a ASSETS_DIR como
+# nombre.<hash>.ext, con variantes .gz (y .br si está instalado brotli) ya
+# comprimidas y PNG optimizados (si está Pillow). Como el nombre cambia con el
+# contenido, se sirven en /assets con caché inmutable de un año. Se genera en
+# el build (python -m app.assets); al arrancar se lee el manifiesto y sólo se
+# regenera si falta o si app/static cambió (tamaño y mtime de cada archivo).
+STATIC_DIR = "app/static"
+ASSETS_DIR = os.getenv("ASSETS_DIR", "./.assets")
+URL_PREFIX = "/assets"
+COMPRIMIBLES = {".js", ".css", ".svg", ".ico", ".json", ".txt", ".html", ".map"}
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+# Respuestas dinámicas que ya van comprimidas (p. ej. /api/exportar?gzip=1)
+YA_COMPRIMIDOS = {"application/gzip", "application/x-gzip", "application/zip", "application/pdf"}
+
+try:
+    import brotli
+except ImportError:  # opcional
+    brotli = None
+
+_manifiesto = {}
+
+
+def _firma_fuentes():
+    # Cambia si se agrega, borra o edita algún archivo de app/static (sólo stat, sin leerlos)
+    h = hashlib.sha256()
+    for nombre in sorted(os.listdir(STATIC_DIR)):
+        ruta = os.path.join(STATIC_DIR, nombre)
+        if os.path.isfile(ruta):
+            st = os.stat(ruta)
+            h.update(f"{nombre}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def _optimizar_png(data: bytes) -> bytes:
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    try:
+        buf = io.BytesIO()
+        Image.open(io.BytesIO(data)).save(buf, format="PNG", optimize=True)
+        out = buf.getvalue()
+        return out if len(out) < len(data) else data
+    except Exception:
+        return data
+
+
+def _reescribir_css(data: bytes, manifiesto) -> bytes:
+    texto = data.decode("utf-8")
+    for logico, final in manifiesto.items():
+        texto = texto.replace(f"/static/{logico}", f"{URL_PREFIX}/{final}")
+    return texto.encode("utf-8")
+
+
+def _escribir(ruta: str, data: bytes):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, ruta)
+
+
+def construir(destino: str = ASSETS_DIR) -> dict:
+    # Genera los archivos con huella y el manifiesto {nombre lógico: nombre con hash}
+    os.makedirs(destino, exist_ok=True)
+    manifiesto = {}
+    nombres = [n for n in os.listdir(STATIC_DIR) if os.path.isfile(os.path.join(STATIC_DIR, n))]
+    # Los CSS al final: sus url('/static/...') se reescriben a los nombres con huella
+    for nombre in sorted(nombres, key=lambda n: (n.endswith(".css"), n)):
+        with open(os.path.join(STATIC_DIR, nombre), "rb") as f:
+            data = f.read()
+        base, ext = os.path.splitext(nombre)
+        if ext.lower() == ".png":
+            data = _optimizar_png(data)
+        elif ext.lower() == ".css":
+            data = _reescribir_css(data, manifiesto)
+        huella = hashlib.sha256(data).hexdigest()[:12]
+        final = f"{base}.{huella}{ext}".replace(" ", "_")
+        manifiesto[nombre] = final
+        salida = os.path.join(destino, final)
+        if os.path.exists(salida):
+            continue
+        _escribir(salida, data)
+        if ext.lower() in COMPRIMIBLES:
+            _escribir(salida + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _escribir(salida + ".br", brotli.compress(data, quality=11))
+    vigentes = set(manifiesto.values())
+    for nombre in os.listdir(destino):
+        # Borra versiones viejas (las variantes .gz/.br siguen al original)
+        raiz = nombre.removesuffix(".gz").removesuffix(".br")
+        if raiz not in vigentes and nombre != "manifest.json":
+            try:
+                os.remove(os.path.join(destino, nombre))
+            except OSError:
+                pass
+    _escribir(os.path.join(destino, "manifest.json"),
+              json.dumps({"firma": _firma_fuentes(), "archivos": manifiesto}, indent=2).encode())
+    return manifiesto
+
+
+def preparar(destino: str = ASSETS_DIR) -> dict:
+    # Carga el manifiesto del build; lo regenera si falta, está dañado o app/static cambió
+    global _manifiesto
+    try:
+        with open(os.path.join(destino, "manifest.json"), encoding="utf-8") as f:
+            doc = json.load(f)
+        if doc.get("firma") != _firma_fuentes():
+            raise ValueError("app/static cambió")
+        _manifiesto = doc["archivos"]
+    except (OSError, ValueError, KeyError):
+        try:
+            _manifiesto = construir(destino)
+        except OSError:
+            _manifiesto = {}
+    return _manifiesto
+
+
+def asset_url(nombre: str) -> str:
+    # Global de Jinja: {{ asset_url('styles.css') }}; sin manifiesto cae a /static
+    final = _manifiesto.get(nombre)
+    return f"{URL_PREFIX}/{final}" if final else f"/static/{nombre}"
+
+
+def _acepta(scope, codificacion: str) -> bool:
+    # Accept-Encoding con valores q: "gzip;q=0" o "*;q=0" sin gzip explícito la rechazan
+    pesos = {}
+    for parte in Headers(scope=scope).get("accept-encoding", "").split(","):
+        nombre, _, params = parte.partition(";")
+        q = 1.0
+        for p in params.split(";"):
+            k, _, v = p.partition("=")
+            if k.strip().lower() == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        if nombre.strip():
+            pesos[nombre.strip().lower()] = q
+    return pesos.get(codificacion, pesos.get("*", 0.0)) > 0
+
+
+class StaticPrecomprimidos(StaticFiles):
+    # Sirve nombre.ext.br / .gz si el cliente los acepta, siempre con caché inmutable
+    async def get_response(self, path, scope):
+        for ext, codificacion in ((".br", "br"), (".gz", "gzip")):
+            if not _acepta(scope, codificacion):
+                continue
+            ruta, st = self.lookup_path(path + ext)
+            if st is None or not stat.S_ISREG(st.st_mode):
+                continue
+            return FileResponse(ruta, stat_result=st, media_type=mimetypes.guess_type(path)[0] or "application/octet-stream",
+                                headers={"Content-Encoding": codificacion, "Vary": "Accept-Encoding",
+                                         "Cache-Control": CACHE_INMUTABLE})
+        resp = await super().get_response(path, scope)
+        if resp.status_code in (200, 304):
+            resp.headers["Cache-Control"] = CACHE_INMUTABLE
+            if os.path.splitext(path)[1].lower() in COMPRIMIBLES:
+                resp.headers["Vary"] = "Accept-Encoding"
+        return resp
+
+
+class _GZipResponder(GZipResponder):
+    # Deja pasar tal cual las respuestas que ya traen Content-Encoding (lo hace
+    # Starlette) o cuyo tipo ya va comprimido
+    async def send_with_gzip(self, message):
+        if message["type"] == "http.response.start":
+            tipo = Headers(raw=message["headers"]).get("content-type", "").split(";")[0].strip().lower()
+            await super().send_with_gzip(message)
+            self.content_encoding_set = self.content_encoding_set or tipo in YA_COMPRIMIDOS
+            return
+        await super().send_with_gzip(message)
+
+
+class GZipDinamico(GZipMiddleware):
+    # gzip para HTML/JSON generados; los estáticos ya van comprimidos y los PDF no ganan
+    EXCLUIR = (URL_PREFIX + "/", "/static/")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            path = scope.get("path", "")
+            if not path.startswith(self.EXCLUIR) and not path.endswith(("pdf", ".pdf")) and _acepta(scope, "gzip"):
+                responder = _GZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+                return await responder(scope, receive, send)
+        return await self.app(scope, receive, send)
+
+
+if __name__ == "__main__":
+    # Paso de build: python -m app.assets
+    if len(sys.argv) > 1 and sys.argv[1] == "--limpiar":
+        shutil.rmtree(ASSETS_DIR, ignore_errors=True)
+    for logico, final in construir().items():
+        print(f"{logico} -> {final}")
+    sys.exit(0)
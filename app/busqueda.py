@@ -0,0 +1,135 @@
+import re
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app import sentencias
+from app.texto import fold, solo_digitos
+
+# Índice FTS5 de pacientes: rowid = patient.id. El tokenizer unicode61 con
+# remove_diacritics pliega mayúsculas y acentos tanto al indexar como al buscar.
+FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS patient_fts USING fts5("
+    "nombre, telefono, alergias, app, tokenize='unicode61 remove_diacritics 2')"
+)
+
+# Pesos bm25 por columna (nombre > teléfono > alergias > antecedentes)
+_PESOS = "10.0, 5.0, 2.0, 1.0"
+
+_REINDEX_SQL = """
+INSERT INTO patient_fts(rowid, nombre, telefono, alergias, app)
+SELECT p.id, coalesce(p.nombre, ''),
+       coalesce(p.telefono, '') || ' ' || {digitos},
+       coalesce(p.alergias, ''),
+       coalesce((SELECT group_concat(e.app, ' ') FROM patientextra e WHERE e.patient_id = p.id), '')
+FROM patient p
+"""
+# El teléfono se indexa también sólo con dígitos ("834-177-9965" -> "8341779965")
+_DIGITOS = "replace(replace(replace(replace(replace(coalesce(p.telefono, ''), '-', ''), ' ', ''), '(', ''), ')', ''), '.', '')"
+
+_tokens = re.compile(r"\w+", re.UNICODE)
+_telefono = re.compile(r"^[\d\s\-\(\)\+\.]+$")
+
+
+def ensure_index(conn):
+    conn.execute(text(FTS_DDL))
+    n_fts = conn.execute(text("SELECT count(*) FROM patient_fts")).scalar()
+    n_pac = conn.execute(text("SELECT count(*) FROM patient")).scalar()
+    if n_fts != n_pac:
+        rebuild(conn)
+
+
+def rebuild(conn):
+    conn.execute(text("DELETE FROM patient_fts"))
+    conn.execute(text(_REINDEX_SQL.format(digitos=_DIGITOS)))
+
+
+def reindex(session: Session, patient_ids):
+    # Sincroniza las filas del índice para los pacientes dados (alta, edición, fusión, borrado)
+    ids = [int(i) for i in patient_ids if i]
+    if not ids:
+        return
+    marcas = ", ".join(str(i) for i in ids)
+    session.execute(text(f"DELETE FROM patient_fts WHERE rowid IN ({marcas})"))
+    session.execute(text(_REINDEX_SQL.format(digitos=_DIGITOS) + f" WHERE p.id IN ({marcas})"))
+
+
+def match_expr(q: str) -> str:
+    # Cada término se busca por prefijo y todos deben aparecer (AND implícito)
+    if _telefono.match(q) and len(solo_digitos(q)) >= 3:
+        return f'"{solo_digitos(q)}"*'
+    terms = _tokens.findall(fold(q))
+    return " ".join(f'"{t}"*' for t in terms)
+
+
+BUSCAR_SQL = (f"SELECT rowid FROM patient_fts WHERE patient_fts MATCH :m "
+              f"ORDER BY bm25(patient_fts, {_PESOS}), rowid DESC LIMIT :lim OFFSET :off")
+
+
+def buscar(session: Session, q: str, page: int = 1, per_page: int = 50):
+    # Devuelve (pacientes ordenados por relevancia, total de coincidencias)
+    expr = match_expr(q or "")
+    if not expr:
+        return [], 0
+    page = max(1, page)
+    total = session.execute(
+        text("SELECT count(*) FROM patient_fts WHERE patient_fts MATCH :m"), {"m": expr}
+    ).scalar() or 0
+    if not total:
+        return [], 0
+    ids = [r[0] for r in session.execute(
+        text(BUSCAR_SQL), {"m": expr, "lim": per_page, "off": (page - 1) * per_page},
+    )]
+    if not ids:
+        return [], total
+    por_id = {p.id: p for p in session.exec(sentencias.pacientes_por_id(ids)).all()}
+    return [por_id[i] for i in ids if i in por_id], total
+
+
+# --------- Diagnósticos ---------
+# Índice FTS5 sobre Consulta.dx (rowid = consulta.id) para buscar diagnósticos
+# sin abrir el JSON de notas de cada consulta.
+DX_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS consulta_dx_fts USING fts5("
+    "dx, tokenize='unicode61 remove_diacritics 2')"
+)
+
+
+def reindex_dx(session, consulta_ids):
+    ids = [int(i) for i in consulta_ids if i]
+    if not ids:
+        return
+    marcas = ", ".join(str(i) for i in ids)
+    session.execute(text(f"DELETE FROM consulta_dx_fts WHERE rowid IN ({marcas})"))
+    session.execute(text(
+        f"INSERT INTO consulta_dx_fts(rowid, dx) SELECT id, dx FROM consulta "
+        f"WHERE id IN ({marcas}) AND coalesce(dx, '') <> ''"
+    ))
+
+
+def rebuild_dx(conn):
+    conn.execute(text(DX_FTS_DDL))
+    conn.execute(text("DELETE FROM consulta_dx_fts"))
+    conn.execute(text("INSERT INTO consulta_dx_fts(rowid, dx) SELECT id, dx FROM consulta WHERE coalesce(dx, '') <> ''"))
+
+
+def dx_sql(filtros: str = "") -> str:
+    # filtros: condiciones extra sobre c (" AND c.fecha >= :desde")
+    return ("SELECT c.id, c.fecha, c.patient_id, p.nombre, c.dx FROM consulta_dx_fts f "
+            "JOIN consulta c ON c.id = f.rowid LEFT JOIN patient p ON p.id = c.patient_id "
+            f"WHERE consulta_dx_fts MATCH :m{filtros} ORDER BY c.fecha DESC LIMIT :lim OFFSET :off")
+
+
+def buscar_dx(session, q: str, desde=None, hasta=None, page: int = 1, per_page: int = 50):
+    # [(consulta_id, fecha, patient_id, nombre, dx)] ordenado por fecha desc
+    terms = _tokens.findall(fold(q or ""))
+    if not terms:
+        return []
+    expr = " ".join(f'"{t}"*' for t in terms)
+    filtros, params = "", {"m": expr, "lim": per_page, "off": (max(page, 1) - 1) * per_page}
+    if desde:
+        filtros += " AND c.fecha >= :desde"
+        params["desde"] = desde
+    if hasta:
+        filtros += " AND c.fecha < :hasta"
+        params["hasta"] = hasta
+    return session.execute(text(dx_sql(filtros)), params).all()
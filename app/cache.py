@@ -0,0 +1,59 @@
+import os
+import time
+from sqlalchemy import text
+
+# Cachés en memoria por worker. Cada valor lleva la versión de su clave en la
+# tabla cacheversion; quien modifica los datos llama bump() en la misma
+# transacción y los demás workers lo notan al revisar el sello (una lectura de
+# un entero por llave primaria, como mucho cada CACHE_CHECK_SECONDS).
+CHECK_SECONDS = float(os.getenv("CACHE_CHECK_SECONDS", "2"))
+
+
+LEER_VERSION_SQL = "SELECT version FROM cacheversion WHERE clave = :c"
+
+
+def leer_version(session, clave: str) -> int:
+    return session.execute(text(LEER_VERSION_SQL), {"c": clave}).scalar() or 0
+
+
+def bump(session, clave: str):
+    session.execute(
+        text("INSERT INTO cacheversion (clave, version) VALUES (:c, 1) "
+             "ON CONFLICT(clave) DO UPDATE SET version = version + 1"),
+        {"c": clave},
+    )
+
+
+class VersionedCache:
+    def __init__(self, clave: str, loader, max_edad: float | None = None):
+        # max_edad (s): recarga aunque el sello no cambie, para datos que se
+        # actualizan en sitio sin subir la versión (ver app/catalogo.py)
+        self.clave = clave
+        self.loader = loader
+        self.max_edad = max_edad
+        # una entrada por base de datos: url -> (valor, version, revisado_en, cargado_en)
+        self._estado = {}
+
+    def get(self, session):
+        url = str(session.get_bind().url)
+        ahora = time.monotonic()
+        st = self._estado.get(url)
+        if st and self.max_edad is not None and ahora - st[3] >= self.max_edad:
+            st = None
+        if st and ahora - st[2] < CHECK_SECONDS:
+            return st[0]
+        version = leer_version(session, self.clave)
+        if st and st[1] == version:
+            self._estado[url] = (st[0], version, ahora, st[3])
+            return st[0]
+        valor = self.loader(session)
+        self._estado[url] = (valor, version, ahora, ahora)
+        return valor
+
+    def actual(self, session):
+        # Valor ya cargado para esta base (o None), sin revisar el sello
+        st = self._estado.get(str(session.get_bind().url))
+        return st[0] if st else None
+
+    def invalidate(self):
+        self._estado.clear()
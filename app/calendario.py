@@ -0,0 +1,58 @@
+import hashlib
+from datetime import date, datetime, timedelta, timezone
+from email.utils import format_datetime
+from sqlalchemy import text
+
+from app import sentencias
+
+# Versión por día de la agenda. Cada alta/cambio de cita sube el contador de su
+# día; de ahí salen ETag y Last-Modified, así que un día sin cambios responde
+# 304 sin volver a consultar ni serializar sus citas.
+
+
+def dia_de(dt) -> str:
+    return (dt.date() if isinstance(dt, datetime) else dt).isoformat()
+
+
+def tocar(session, fechas):
+    # Sube la versión de los días de las fechas dadas (no hace commit)
+    dias = sorted({dia_de(f) for f in fechas if f})
+    if not dias:
+        return
+    ahora = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+    session.execute(text(
+        "INSERT INTO calendariodia (dia, version, modificado) VALUES (:d, 1, :m) "
+        "ON CONFLICT(dia) DO UPDATE SET version = version + 1, modificado = excluded.modificado"),
+        [{"d": d, "m": ahora} for d in dias])
+
+
+def dias_entre(d1: date, d2: date):
+    return [(d1 + timedelta(days=i)).isoformat() for i in range((d2 - d1).days + 1)]
+
+
+def versiones(session, d1: date, d2: date):
+    # {dia: (version, modificado)} para el rango (días sin cambios -> (0, None))
+    rows = session.exec(sentencias.dias_calendario(d1.isoformat(), d2.isoformat())).all()
+    por_dia = {r.dia: (r.version, r.modificado) for r in rows}
+    return {d: por_dia.get(d, (0, None)) for d in dias_entre(d1, d2)}
+
+
+def etag_dia(dia: str, version: int) -> str:
+    return f'W/"cal-{dia}-{version}"'
+
+
+def etag_rango(vers) -> str:
+    h = hashlib.sha1("|".join(f"{d}:{v[0]}" for d, v in sorted(vers.items())).encode()).hexdigest()[:20]
+    return f'W/"calr-{h}"'
+
+
+def last_modified(vers) -> str | None:
+    fechas = [m for _, m in vers.values() if m]
+    if not fechas:
+        return None
+    return format_datetime(max(fechas).replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def sin_cambios(request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match")
+    return bool(inm) and (etag in [x.strip() for x in inm.split(",")] or inm.strip() == "*")
@@ -0,0 +1,178 @@
+import difflib
+import heapq
+import os
+from bisect import bisect_left
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.cache import VersionedCache, bump
+from app.models import Medicine, Dosificacion
+from app.texto import fold
+
+# Aprendizaje de catálogos (medicamentos y dosificaciones) a partir de los
+# renglones de una receta. Todo se resuelve con un INSERT ... ON CONFLICT por
+# tabla, sin importar cuántos renglones traiga la receta; el índice único sobre
+# el texto normalizado evita duplicados aunque dos peticiones lleguen a la vez.
+#
+# CATALOGO_REFRESCO_S: cada cuánto se recarga el índice de autocompletado para
+# tomar los conteos de uso que sumaron otros workers (600)
+REFRESCO_S = float(os.getenv("CATALOGO_REFRESCO_S", "600"))
+
+
+def lineas_indicacion(indicacion: str | None):
+    return [x.strip() for x in (indicacion or "").split("\n") if x.strip()]
+
+
+def _agrupar(textos):
+    # norm -> [texto original (primera aparición), veces]
+    out = {}
+    for t in textos:
+        k = fold(t)
+        if k:
+            out.setdefault(k, [t, 0])[1] += 1
+    return out
+
+
+def _upsert(session, modelo, col_texto, col_norm, grupos, cuando):
+    if not grupos:
+        return
+    stmt = sqlite_insert(modelo).values([
+        {col_texto: texto, col_norm: k, "created_at": cuando, "usos": n, "ultimo_uso": cuando}
+        for k, (texto, n) in grupos.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[col_norm],
+        set_={"usos": modelo.usos + stmt.excluded.usos, "ultimo_uso": stmt.excluded.ultimo_uso},
+    )
+    session.execute(stmt)
+
+
+def aprender(session, items, cuando: datetime | None = None):
+    # items: [{'nombre', 'indicacion'}]; no hace commit
+    cuando = cuando or datetime.utcnow()
+    nombres, lineas = [], []
+    for it in items or []:
+        nombre = (it.get("nombre") or "").strip()
+        if nombre:
+            nombres.append(nombre)
+        lineas.extend(lineas_indicacion(it.get("indicacion")))
+    meds = _agrupar(nombres)
+    dosis = _agrupar(lineas)
+    _upsert(session, Medicine, "nombre", "nombre_norm", meds, cuando)
+    _upsert(session, Dosificacion, "texto", "texto_norm", dosis, cuando)
+    # Los usos de términos ya conocidos se suman en el índice de este worker;
+    # sólo un término nuevo sube el sello y obliga a reconstruir
+    nuevos = False
+    for indice, grupos in ((indice_medicamentos, meds), (indice_dosificaciones, dosis)):
+        idx = indice.actual(session)
+        for k, (_, n) in grupos.items():
+            if idx is None or not idx.sumar(k, n, cuando):
+                nuevos = True
+    if nuevos:
+        bump(session, "catalogo")
+        indice_medicamentos.invalidate()
+        indice_dosificaciones.invalidate()
+    return meds, dosis
+
+
+# --------- Autocompletado ---------
+# Índice en memoria por catálogo: claves normalizadas ordenadas (búsqueda por
+# prefijo con bisect, equivalente a recorrer un trie) más un índice de inicios
+# de palabra para coincidencias a media frase. Se reconstruye cuando cambia el
+# sello "catalogo", que aprender() sube sólo al agregar términos; los usos se
+# actualizan en sitio (sumar) y cada REFRESCO_S se recarga completo.
+class IndicePrefijos:
+    def __init__(self, filas):
+        # filas: [(norm, texto, usos, ultimo_uso)]
+        filas = sorted((f for f in filas if f[0]), key=lambda f: f[0])
+        self.claves = [f[0] for f in filas]
+        self.datos = [(f[1], f[2] or 0, f[3].timestamp() if f[3] else 0.0) for f in filas]
+        palabras = []
+        self.vocabulario = {}  # palabra -> [índices], para la búsqueda con errores de dedo
+        for i, norm in enumerate(self.claves):
+            ws = set(norm.split(" "))
+            for w in ws:
+                self.vocabulario.setdefault(w, []).append(i)
+            for w in ws - {norm.split(" ")[0]}:
+                palabras.append((w, i))
+        palabras.sort()
+        self.palabras = [w for w, _ in palabras]
+        self.palabras_idx = [i for _, i in palabras]
+        self.top = None
+
+    def sumar(self, norm: str, usos: int, cuando: datetime) -> bool:
+        # Suma usos a un término ya indexado; False si no está (hay que reconstruir)
+        i = bisect_left(self.claves, norm)
+        if i == len(self.claves) or self.claves[i] != norm:
+            return False
+        texto, n, _ = self.datos[i]
+        self.datos[i] = (texto, n + usos, cuando.timestamp())
+        self.top = None
+        return True
+
+    def _rango(self, lista, q):
+        return bisect_left(lista, q), bisect_left(lista, q + "\uffff")
+
+    def _mejores(self, idxs, k):
+        return heapq.nlargest(k, idxs, key=lambda i: (self.datos[i][1], self.datos[i][2]))
+
+    def buscar(self, q: str, k: int = 10):
+        qn = fold(q)
+        if not qn:
+            top = self.top
+            if top is None:
+                top = self.top = self._mejores(range(len(self.claves)), 50)
+            return [self._fila(i) for i in top[:k]]
+        lo, hi = self._rango(self.claves, qn)
+        out = self._mejores(range(lo, hi), k)
+        vistos = set(out)
+        if len(out) < k:
+            lo, hi = self._rango(self.palabras, qn)
+            extra = self._mejores({self.palabras_idx[j] for j in range(lo, hi)} - vistos, k - len(out))
+            out += extra
+            vistos.update(extra)
+        if len(out) < k:
+            # tolerancia a errores de dedo, sólo si no alcanzó con prefijos
+            extra = self._mejores(self._parecidos(qn) - vistos, k - len(out))
+            out += extra
+        return [self._fila(i) for i in out]
+
+    def _parecidos(self, qn: str, cutoff: float = 0.75):
+        # Índices cuyas palabras se parecen a la palabra más larga de la
+        # búsqueda; cada palabra se compara recortada a ese largo (+2) para
+        # que también encuentre lo que se está terminando de escribir
+        w = max(qn.split(" "), key=len)
+        if len(w) < 4:
+            return set()
+        sm = difflib.SequenceMatcher()
+        sm.set_seq2(w)
+        out = set()
+        for v, idxs in self.vocabulario.items():
+            sm.set_seq1(v[:len(w) + 2])
+            if sm.real_quick_ratio() >= cutoff and sm.quick_ratio() >= cutoff and sm.ratio() >= cutoff:
+                out.update(idxs)
+        return out
+
+    def _fila(self, i):
+        texto, usos, _ = self.datos[i]
+        return {"texto": texto, "usos": usos}
+
+
+def _cargar_indice(modelo, col_texto, col_norm):
+    def loader(session):
+        tabla = modelo.__table__
+        filas = session.execute(
+            select(tabla.c[col_norm], tabla.c[col_texto], tabla.c.usos, tabla.c.ultimo_uso)
+        ).all()
+        return IndicePrefijos(filas)
+    return loader
+
+
+indice_medicamentos = VersionedCache("catalogo", _cargar_indice(Medicine, "nombre", "nombre_norm"), REFRESCO_S)
+indice_dosificaciones = VersionedCache("catalogo", _cargar_indice(Dosificacion, "texto", "texto_norm"), REFRESCO_S)
+
+
+def sugerir(session, tipo: str, q: str, k: int = 10):
+    indice = indice_medicamentos if tipo == "medicamentos" else indice_dosificaciones
+    return indice.get(session).buscar(q, k)
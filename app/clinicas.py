@@ -0,0 +1,312 @@
+import contextvars
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.cookies import SimpleCookie
+
+from starlette.datastructures import Headers
+
+from app import metricas, migraciones
+from app.db import make_engine
+
+# Varias clínicas en un mismo despliegue, cada una con su propio archivo SQLite
+# (CLINICAS_DIR/<clínica>.db): no compiten por el candado de escritura y una
+# clínica con mucha carga no frena a las demás. La clínica de cada petición se
+# resuelve por subdominio, prefijo /c/<clínica>/, cabecera X-Clinica (la pone
+# el login o el proxy) o cookie, y sus engines salen de un pool acotado que los
+# abre al primer uso (migrando el esquema si hace falta) y cierra los que
+# llevan tiempo sin usarse. Sin CLINICAS_DIR la app usa una sola base, como antes.
+CLINICAS_DIR = os.getenv("CLINICAS_DIR", "")
+ACTIVO = bool(CLINICAS_DIR)
+# Dominio base para resolver por subdominio (norte.expediente.mx -> norte)
+DOMINIO = os.getenv("CLINICAS_DOMINIO", "").lower().strip(".")
+MAX_ABIERTAS = int(os.getenv("CLINICAS_MAX_ABIERTAS", "16"))
+INACTIVIDAD_S = float(os.getenv("CLINICAS_INACTIVIDAD_S", "900"))
+# Conexiones por clínica (cada una tiene escritor y lector)
+POOL_CLINICA = int(os.getenv("CLINICAS_POOL_SIZE", "8"))
+PREFIJO = "/c/"
+COOKIE = "clinica"
+CABECERA = "x-clinica"
+# Rutas que no son de ninguna clínica
+SIN_CLINICA = ("/static/", "/assets/", "/metrics", "/api/arranque", "/favicon.ico")
+
+_nombre_valido = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+_actual = contextvars.ContextVar("clinica_actual", default=None)
+
+
+def ruta_db(clinica: str) -> str:
+    return os.path.join(CLINICAS_DIR, f"{clinica}.db")
+
+
+def existe(clinica: str | None) -> bool:
+    return bool(clinica) and bool(_nombre_valido.match(clinica)) and os.path.exists(ruta_db(clinica))
+
+
+class Clinica:
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        url = f"sqlite:///{ruta_db(nombre)}"
+        self.engine = make_engine(url, pool_size=POOL_CLINICA, max_overflow=POOL_CLINICA)
+        self.read_engine = make_engine(url, readonly=True, pool_size=POOL_CLINICA, max_overflow=POOL_CLINICA)
+        metricas.instrumentar(self.engine)
+        metricas.instrumentar(self.read_engine)
+        self.en_uso = 0
+        self.ultimo_uso = time.monotonic()
+
+    def cerrar(self):
+        self.engine.dispose()
+        self.read_engine.dispose()
+
+
+class PoolClinicas:
+    # LRU de clínicas abiertas: como mucho max_abiertas (salvo que todas estén
+    # atendiendo peticiones) y ninguna ociosa más de inactividad_s segundos
+    def __init__(self, max_abiertas: int = MAX_ABIERTAS, inactividad_s: float = INACTIVIDAD_S):
+        self.max_abiertas = max_abiertas
+        self.inactividad_s = inactividad_s
+        self._abiertas = OrderedDict()
+        self._lock = threading.Lock()
+        self._abriendo = {}  # clínica -> Lock, para abrir/migrar una sola vez
+        self.peticiones = {}
+        self.aperturas = 0
+        self.cierres = 0
+
+    def tomar(self, nombre: str) -> Clinica | None:
+        # Clínica lista para usarse (en_uso + 1) o None si no existe; soltar() al terminar
+        c = self._usar(nombre)
+        if c is not None or not existe(nombre):
+            return c
+        with self._lock:
+            candado = self._abriendo.setdefault(nombre, threading.Lock())
+        with candado:
+            c = self._usar(nombre)
+            if c is not None:
+                return c
+            # Fuera del candado global: migrar una clínica no detiene a las demás
+            c = Clinica(nombre)
+            migraciones.preparar_esquema(c.engine)
+            with self._lock:
+                self._abiertas[nombre] = c
+                c.en_uso += 1
+                self.aperturas += 1
+                self.peticiones[nombre] = self.peticiones.get(nombre, 0) + 1
+                cerrar = self._desalojar()
+        for v in cerrar:
+            v.cerrar()
+        return c
+
+    def _usar(self, nombre):
+        with self._lock:
+            c = self._abiertas.get(nombre)
+            if c is None:
+                return None
+            self._abiertas.move_to_end(nombre)
+            c.en_uso += 1
+            c.ultimo_uso = time.monotonic()
+            self.peticiones[nombre] = self.peticiones.get(nombre, 0) + 1
+            cerrar = self._desalojar()
+        for v in cerrar:
+            v.cerrar()
+        return c
+
+    def soltar(self, c: Clinica):
+        with self._lock:
+            c.en_uso -= 1
+            c.ultimo_uso = time.monotonic()
+
+    def _desalojar(self):
+        # Con el candado tomado; devuelve las clínicas que hay que cerrar fuera de él
+        ahora = time.monotonic()
+        fuera = [n for n, c in self._abiertas.items() if not c.en_uso and ahora - c.ultimo_uso > self.inactividad_s]
+        sobran = len(self._abiertas) - len(fuera) - self.max_abiertas
+        for n, c in self._abiertas.items():
+            if sobran <= 0:
+                break
+            if not c.en_uso and n not in fuera:
+                fuera.append(n)
+                sobran -= 1
+        self.cierres += len(fuera)
+        return [self._abiertas.pop(n) for n in fuera]
+
+    def cerrar_todas(self):
+        with self._lock:
+            todas = list(self._abiertas.values())
+            self._abiertas.clear()
+        for c in todas:
+            c.cerrar()
+
+    def reporte(self) -> dict:
+        with self._lock:
+            return {
+                "abiertas": {n: {"en_uso": c.en_uso, "ociosa_s": round(time.monotonic() - c.ultimo_uso, 1)}
+                             for n, c in self._abiertas.items()},
+                "max_abiertas": self.max_abiertas,
+                "aperturas": self.aperturas,
+                "cierres": self.cierres,
+                "peticiones": dict(self.peticiones),
+            }
+
+
+pool = PoolClinicas()
+
+
+class EngineClinica:
+    # Va a los routers en lugar de un Engine: cada uso se resuelve al engine
+    # de la clínica de la petición en curso. Igualdad y hash son los del
+    # engine real para que Session reconozca sus propias conexiones, así que
+    # sólo es válido dentro de una petición (los hilos de fondo usan real()).
+    def __init__(self, lectura: bool = False):
+        self._lectura = lectura
+
+    def _engine(self):
+        c = _actual.get()
+        if c is None:
+            raise RuntimeError("sin clínica en el contexto de esta petición")
+        return c.read_engine if self._lectura else c.engine
+
+    def __getattr__(self, nombre):
+        return getattr(self._engine(), nombre)
+
+    def __hash__(self):
+        return hash(self._engine())
+
+    def __eq__(self, otro):
+        return otro is self or otro is self._engine()
+
+    def __repr__(self):
+        c = _actual.get()
+        return f"<EngineClinica {c.nombre if c else '-'}{' lectura' if self._lectura else ''}>"
+
+
+def real(engine):
+    # El Engine de verdad detrás de un EngineClinica (o el mismo engine)
+    return engine._engine() if isinstance(engine, EngineClinica) else engine
+
+
+def actual() -> str | None:
+    c = _actual.get()
+    return c.nombre if c else None
+
+
+def resolver(scope) -> tuple[str | None, bool]:
+    # -> (clínica, vino en el prefijo /c/<clínica>/). Orden: subdominio, prefijo, cabecera, cookie
+    headers = Headers(scope=scope)
+    if DOMINIO:
+        host = headers.get("host", "").split(":")[0].lower()
+        if host.endswith("." + DOMINIO):
+            return host[: -len(DOMINIO) - 1], False
+    path = scope.get("path", "")
+    if path.startswith(PREFIJO):
+        return path[len(PREFIJO):].split("/", 1)[0], True
+    if headers.get(CABECERA):
+        return headers[CABECERA].strip().lower(), False
+    cookie = SimpleCookie(headers.get("cookie", ""))
+    return (cookie[COOKIE].value if COOKIE in cookie else None), False
+
+
+class ClinicaMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith(SIN_CLINICA):
+            return await self.app(scope, receive, send)
+        nombre, por_prefijo = resolver(scope)
+        c = pool.tomar(nombre) if existe(nombre) else None
+        if c is None:
+            await send({"type": "http.response.start", "status": 404,
+                        "headers": [(b"content-type", b"text/plain; charset=utf-8")]})
+            await send({"type": "http.response.body", "body": "Clínica no encontrada".encode()})
+            return
+        if por_prefijo:
+            # /c/norte/paciente/1 se enruta como /paciente/1 (Starlette descuenta root_path);
+            # la cookie hace que los enlaces absolutos de las plantillas sigan en la clínica
+            scope = dict(scope, root_path=scope.get("root_path", "") + PREFIJO + nombre)
+            galleta = f"{COOKIE}={nombre}; Path=/; SameSite=Lax; HttpOnly".encode()
+
+            async def _send(msg):
+                if msg["type"] == "http.response.start":
+                    msg["headers"] = list(msg.get("headers", [])) + [(b"set-cookie", galleta)]
+                await send(msg)
+        else:
+            _send = send
+        token = _actual.set(c)
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _actual.reset(token)
+            pool.soltar(c)
+
+
+# --------- Administración ---------
+def crear(nombre: str, desde: str | None = None) -> str:
+    # Crea la base de una clínica nueva (vacía o copia en línea de otra base SQLite) y la migra
+    if not _nombre_valido.match(nombre or ""):
+        raise ValueError("nombre de clínica inválido (minúsculas, dígitos, - y _)")
+    ruta = ruta_db(nombre)
+    if os.path.exists(ruta):
+        raise ValueError(f"la clínica {nombre} ya existe")
+    os.makedirs(CLINICAS_DIR, exist_ok=True)
+    if desde:
+        origen = sqlite3.connect(desde)
+        destino = sqlite3.connect(ruta)
+        try:
+            origen.backup(destino)
+        finally:
+            destino.close()
+            origen.close()
+    engine = make_engine(f"sqlite:///{ruta}")
+    try:
+        migraciones.preparar_esquema(engine)
+    finally:
+        engine.dispose()
+    return ruta
+
+
+def listar() -> list[str]:
+    if not CLINICAS_DIR or not os.path.isdir(CLINICAS_DIR):
+        return []
+    return sorted(n[:-3] for n in os.listdir(CLINICAS_DIR) if n.endswith(".db") and _nombre_valido.match(n[:-3]))
+
+
+def main(argv=None):
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Clínicas del despliegue (una base SQLite por clínica)")
+    sub = ap.add_subparsers(dest="orden", required=True)
+    c = sub.add_parser("crear", help="crea la base de una clínica")
+    c.add_argument("nombre")
+    c.add_argument("--desde", help="copia una base existente (p. ej. el data.db de un despliegue de una clínica)")
+    sub.add_parser("listar", help="clínicas y tamaño de su base")
+    sub.add_parser("migrar", help="aplica las migraciones pendientes a todas las clínicas")
+    args = ap.parse_args(argv)
+
+    if not CLINICAS_DIR:
+        print("define CLINICAS_DIR", file=sys.stderr)
+        return 1
+    if args.orden == "crear":
+        try:
+            print(crear(args.nombre, args.desde))
+        except (ValueError, sqlite3.Error) as e:
+            print(e, file=sys.stderr)
+            return 1
+        return 0
+    for nombre in listar():
+        if args.orden == "migrar":
+            engine = make_engine(f"sqlite:///{ruta_db(nombre)}")
+            try:
+                aplicadas = migraciones.preparar_esquema(engine)
+            finally:
+                engine.dispose()
+            print(f"{nombre}: {', '.join(aplicadas) or 'al día'}")
+        else:
+            print(f"{nombre}\t{os.path.getsize(ruta_db(nombre)) / 1024:.0f} kB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
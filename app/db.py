@@ -0,0 +1,53 @@
+import os
+from sqlalchemy import event
+from sqlmodel import create_engine
+
+# Configuración de SQLite compartida por main.py, los routers y los scripts.
+# Cada conexión entra en WAL (lectores y escritor no se bloquean entre sí),
+# espera hasta busy_timeout antes de fallar con "database is locked" y usa
+# synchronous=NORMAL, que en WAL es seguro ante caídas del proceso.
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data.db")
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024)))
+# 40 = hilos del threadpool de anyio/starlette por defecto
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "40"))
+POOL_OVERFLOW = int(os.getenv("DB_POOL_OVERFLOW", "10"))
+
+
+def _es_memoria(url: str) -> bool:
+    return url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url
+
+
+def make_engine(url: str = DATABASE_URL, readonly: bool = False, **kwargs):
+    # readonly=True crea el pool de sólo lectura para los GET (PRAGMA query_only)
+    opts = dict(connect_args={"check_same_thread": False, "timeout": BUSY_TIMEOUT_MS / 1000})
+    if url.startswith("sqlite") and not _es_memoria(url):
+        opts.update(pool_size=POOL_SIZE, max_overflow=POOL_OVERFLOW, pool_timeout=30)
+    opts.update(kwargs)
+    engine = create_engine(url, **opts)
+    if not url.startswith("sqlite"):
+        return engine
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_conn, _record):
+        # Autocommit del driver: las transacciones las abre el evento "begin"
+        dbapi_conn.isolation_level = None
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        cur.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        if readonly:
+            cur.execute("PRAGMA query_only=ON")
+        cur.close()
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        # El escritor toma el candado al inicio (BEGIN IMMEDIATE): así busy_timeout
+        # aplica y no hay "database is locked" al promover una lectura a escritura.
+        conn.exec_driver_sql("BEGIN" if readonly else "BEGIN IMMEDIATE")
+
+    return engine
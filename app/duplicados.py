@@ -0,0 +1,410 @@
+import json
+import os
+import re
+import sys
+from datetime import date, datetime
+from difflib import SequenceMatcher
+from functools import lru_cache
+from itertools import combinations
+from sqlalchemy import text
+
+from app import busqueda, calendario
+from app.texto import fold, solo_digitos
+
+# Detección de expedientes duplicados por nombre, teléfono y fecha de
+# nacimiento. Cada paciente tiene unas cuantas claves de bloqueo en la tabla
+# pacienteclave y sólo se comparan pacientes que comparten alguna clave, así
+# que revisar un alta cuesta una búsqueda por índice y el reporte completo
+# recorre bloques pequeños en vez de todos los pares. Claves (palabras del
+# nombre en código fonético, ordenadas):
+#   n:a|b|c  cada trío de las primeras cuatro palabras del nombre
+#   p:a|b    cada par de palabras, sólo para encontrar nombres cortos
+#   c:a|b    nombre corto (una o dos palabras): "Juan Pérez" ~ "Juan Pérez López"
+#   t:...    últimos 7 dígitos del teléfono
+#   f:...    fecha de nacimiento
+UMBRAL = float(os.getenv("DUPLICADOS_UMBRAL", "0.6"))
+# Bloques más grandes que esto (nombres muy comunes sin otro dato) se omiten
+MAX_BLOQUE = int(os.getenv("DUPLICADOS_MAX_BLOQUE", "500"))
+
+# Pesos del puntaje. Con UMBRAL >= PESO_NOMBRE el bloqueo no pierde pares:
+# dos nombres largos que comparten menos de tres palabras no son iguales, así
+# que sólo llegan al umbral si coincide el teléfono o la fecha (que son claves).
+PESO_NOMBRE = 0.6
+PESO_TELEFONO = 0.25
+PESO_NACIMIENTO = 0.15
+CASTIGO_TELEFONO = 0.1
+CASTIGO_NACIMIENTO = 0.3
+
+_PARTICULAS = {"de", "del", "la", "las", "los", "y", "e", "da", "van", "von"}
+_ABREVIATURAS = {"ma": "maria", "fco": "francisco", "gpe": "guadalupe"}
+_VOCALES = set("aeiou")
+_palabras = re.compile(r"[a-z]+")
+_repetidas = re.compile(r"(.)\1+")
+
+# patient_id que se reasigna al fusionar; recetahistoryitem va por receta_id
+# (su índice) y antes que recetahistory
+REASIGNAR = {
+    "recetahistoryitem": "UPDATE recetahistoryitem SET patient_id = :k "
+                         "WHERE receta_id IN (SELECT id FROM recetahistory WHERE patient_id = :d)",
+    "recetahistory": "UPDATE recetahistory SET patient_id = :k WHERE patient_id = :d",
+    "consulta": "UPDATE consulta SET patient_id = :k WHERE patient_id = :d",
+    "consultavitales": "UPDATE consultavitales SET patient_id = :k WHERE patient_id = :d",
+    "appointment": "UPDATE appointment SET patient_id = :k WHERE patient_id = :d",
+}
+
+
+@lru_cache(maxsize=8192)
+def fonetico(palabra: str) -> str:
+    # Código fonético para español: "Vázquez" y "Basques" -> "baskes",
+    # "Guillermo" y "Guiyermo" -> "giyermo", "Hernández" y "Ernandes" -> "ernandes"
+    p = fold(palabra)
+    out = []
+    i = 0
+    while i < len(p):
+        c, sig = p[i], p[i + 1:i + 2]
+        paso = 1
+        if c == "c":
+            if sig == "h":
+                out.append("x"); paso = 2
+            else:
+                out.append("s" if sig in ("e", "i") else "k")
+        elif c == "g":
+            if sig == "u" and p[i + 2:i + 3] in ("e", "i"):
+                out.append("g"); paso = 2
+            else:
+                out.append("j" if sig in ("e", "i") else "g")
+        elif c == "q":
+            out.append("k"); paso = 2 if sig == "u" else 1
+        elif c == "l" and sig == "l":
+            out.append("y"); paso = 2
+        elif c == "p" and sig == "h":
+            out.append("f"); paso = 2
+        elif c == "h":
+            pass
+        elif c == "x":
+            out.append("ks")
+        elif c == "y":
+            out.append("y" if sig in _VOCALES else "i")
+        else:
+            out.append({"z": "s", "v": "b", "w": "u"}.get(c, c))
+        i += paso
+    return _repetidas.sub(r"\1", "".join(out))
+
+
+def palabras_nombre(nombre: str | None) -> list[str]:
+    # Palabras significativas del nombre, en código fonético y en su orden
+    out = []
+    for w in _palabras.findall(fold(nombre)):
+        if w in _PARTICULAS:
+            continue
+        out.append(fonetico(_ABREVIATURAS.get(w, w)))
+    return [w for w in out if w]
+
+
+def _telefono(telefono) -> str | None:
+    d = solo_digitos(telefono)
+    return d[-7:] if len(d) >= 7 else None
+
+
+def _nacimiento(fn) -> str | None:
+    if not fn:
+        return None
+    return fn.isoformat() if isinstance(fn, date) else str(fn)[:10]
+
+
+def claves(nombre, telefono=None, fecha_nacimiento=None) -> set[str]:
+    ws = sorted(set(palabras_nombre(nombre)[:4]))
+    if len(ws) <= 2:
+        out = {"c:" + "|".join(ws)} if ws else set()
+    else:
+        out = {"n:" + "|".join(t) for t in combinations(ws, 3)}
+        out |= {"p:" + "|".join(par) for par in combinations(ws, 2)}
+    tel = _telefono(telefono)
+    if tel:
+        out.add("t:" + tel)
+    fn = _nacimiento(fecha_nacimiento)
+    if fn:
+        out.add("f:" + fn)
+    return out
+
+
+def _claves_busqueda(ks) -> set[str]:
+    # Bloques en los que se buscan candidatos: los nombres cortos se cruzan con
+    # los pares de los largos; dos nombres largos sólo por trío
+    out = {k for k in ks if not k.startswith("p:")}
+    out |= {"p:" + k[2:] for k in ks if k.startswith("c:")}
+    out |= {"c:" + k[2:] for k in ks if k.startswith("p:")}
+    return out
+
+
+def similitud_nombre(a: str | None, b: str | None) -> float:
+    return _similitud(palabras_nombre(a), palabras_nombre(b))
+
+
+def _similitud(wa, wb, cota=None) -> float:
+    # Con cota, devuelve 0 en cuanto la cota superior (quick_ratio) no la alcanza
+    if not wa or not wb:
+        return 0.0
+    sa, sb = set(wa), set(wb)
+    if sa == sb:
+        return 1.0
+    # "María Pérez" dentro de "María Guadalupe Pérez López"
+    piso = 0.9 if sa <= sb or sb <= sa else 0.0
+    sm = SequenceMatcher(None, " ".join(sorted(wa)), " ".join(sorted(wb)))
+    if cota is not None and max(sm.quick_ratio(), piso) < cota:
+        return 0.0
+    return max(sm.ratio(), piso)
+
+
+def puntaje(a: dict, b: dict, minimo=None):
+    # a, b: {"nombre", "telefono", "fecha_nacimiento"[, "palabras"]} -> (puntaje, motivos);
+    # con minimo, los pares que no pueden alcanzarlo salen con puntaje 0 sin el cálculo fino
+    total, motivos = 0.0, []
+    ta, tb = _telefono(a.get("telefono")), _telefono(b.get("telefono"))
+    if ta and tb:
+        if ta == tb:
+            total += PESO_TELEFONO; motivos.append("mismo teléfono")
+        else:
+            total -= CASTIGO_TELEFONO; motivos.append("otro teléfono")
+    fa, fb = _nacimiento(a.get("fecha_nacimiento")), _nacimiento(b.get("fecha_nacimiento"))
+    if fa and fb:
+        if fa == fb:
+            total += PESO_NACIMIENTO; motivos.append("misma fecha de nacimiento")
+        else:
+            total -= CASTIGO_NACIMIENTO; motivos.append("otra fecha de nacimiento")
+    if minimo is not None and total + PESO_NOMBRE < minimo:
+        return 0.0, motivos
+    cota = (minimo - total) / PESO_NOMBRE if minimo is not None else None
+    sim = _similitud(a.get("palabras") or palabras_nombre(a["nombre"]),
+                     b.get("palabras") or palabras_nombre(b["nombre"]), cota)
+    return round(total + PESO_NOMBRE * sim, 3), [f"nombre {sim:.0%}"] + motivos
+
+
+# --------- Índice de claves ---------
+DATOS_SQL = (
+    "SELECT p.id, p.nombre, p.telefono, "
+    "(SELECT e.fecha_nacimiento FROM patientextra e WHERE e.patient_id = p.id AND e.fecha_nacimiento IS NOT NULL LIMIT 1) "
+    "AS fecha_nacimiento, p.created_at FROM patient p"
+)
+
+
+def _datos(conn, ids):
+    # id -> {"nombre", "telefono", "fecha_nacimiento", "created_at"}, en tandas para no pasar el límite de parámetros
+    ids = sorted({int(i) for i in ids})
+    out = {}
+    for i in range(0, len(ids), 500):
+        marcas = ", ".join(str(x) for x in ids[i:i + 500])
+        for r in conn.execute(text(f"{DATOS_SQL} WHERE p.id IN ({marcas})")):
+            out[r[0]] = {"nombre": r[1], "telefono": r[2], "fecha_nacimiento": r[3], "created_at": r[4]}
+    return out
+
+
+def indexar(session, patient_ids):
+    # Recalcula las claves de los pacientes dados (alta, importación, fusión, borrado)
+    ids = [int(i) for i in patient_ids if i]
+    if not ids:
+        return
+    marcas = ", ".join(str(i) for i in ids)
+    session.execute(text(f"DELETE FROM pacienteclave WHERE patient_id IN ({marcas})"))
+    filas = [{"p": pid, "c": k} for pid, d in _datos(session, ids).items()
+             for k in claves(d["nombre"], d["telefono"], d["fecha_nacimiento"])]
+    if filas:
+        session.execute(text("INSERT INTO pacienteclave (patient_id, clave) VALUES (:p, :c)"), filas)
+
+
+def reconstruir(conn):
+    # Relleno completo (migración); por tandas de id
+    conn.execute(text("DELETE FROM pacienteclave"))
+    ultimo = 0
+    while True:
+        filas = conn.execute(text(f"{DATOS_SQL} WHERE p.id > :u ORDER BY p.id LIMIT 1000"), {"u": ultimo}).all()
+        if not filas:
+            break
+        lote = [{"p": r[0], "c": k} for r in filas for k in claves(r[1], r[2], r[3])]
+        if lote:
+            conn.execute(text("INSERT INTO pacienteclave (patient_id, clave) VALUES (:p, :c)"), lote)
+        ultimo = filas[-1][0]
+
+
+# --------- Consulta en vivo ---------
+def bloques_sql(n: int) -> str:
+    # Miembros de n claves (parámetros :k0..:kn-1)
+    return f"SELECT clave, patient_id FROM pacienteclave WHERE clave IN ({', '.join(f':k{i}' for i in range(n))})"
+
+
+def candidatos(session, nombre, telefono=None, fecha_nacimiento=None, excluir=None, umbral=None, limite: int = 5):
+    # Posibles duplicados de un paciente (nuevo o existente), mejor puntaje primero
+    umbral = UMBRAL if umbral is None else umbral
+    busqueda = _claves_busqueda(claves(nombre, telefono, fecha_nacimiento))
+    if not busqueda:
+        return []
+    params = {f"k{i}": k for i, k in enumerate(busqueda)}
+    bloques = {}
+    for clave, pid in session.execute(text(bloques_sql(len(params))), params):
+        bloques.setdefault(clave, []).append(pid)
+    # Los bloques enormes (nombres muy comunes) no discriminan
+    ids = {pid for miembros in bloques.values() if len(miembros) <= MAX_BLOQUE for pid in miembros} - {excluir}
+    if not ids:
+        return []
+    nuevo = {"nombre": nombre, "telefono": telefono, "fecha_nacimiento": fecha_nacimiento, "palabras": palabras_nombre(nombre)}
+    out = []
+    for pid, d in _datos(session, ids).items():
+        p, motivos = puntaje(nuevo, d, umbral)
+        if p >= umbral:
+            out.append({"id": pid, "nombre": d["nombre"], "telefono": d["telefono"] or "",
+                        "fecha_nacimiento": _nacimiento(d["fecha_nacimiento"]), "puntaje": p, "motivos": motivos})
+    out.sort(key=lambda c: (-c["puntaje"], c["id"]))
+    return out[:limite]
+
+
+# --------- Reporte completo ---------
+def reporte(conn, umbral=None, limite: int = 500) -> dict:
+    # Recorre los bloques (índice clave, patient_id) y puntúa sólo los pares que comparten alguno
+    umbral = UMBRAL if umbral is None else umbral
+    bloques, pacientes = {}, set()
+    for clave, pid in conn.execute(text("SELECT clave, patient_id FROM pacienteclave ORDER BY clave, patient_id")):
+        bloques.setdefault(clave, []).append(pid)
+        pacientes.add(pid)
+    pares, omitidos = set(), 0
+    for clave, miembros in bloques.items():
+        if clave.startswith("p:"):
+            continue
+        otros = bloques.get("p:" + clave[2:], []) if clave.startswith("c:") else []
+        if len(miembros) + len(otros) > MAX_BLOQUE:
+            omitidos += 1
+            continue
+        pares.update(combinations(miembros, 2))
+        pares.update((min(a, b), max(a, b)) for a in miembros for b in otros)
+
+    datos = _datos(conn, {x for par in pares for x in par})
+    for d in datos.values():
+        d["palabras"] = palabras_nombre(d["nombre"])
+    encontrados = []
+    for a, b in pares:
+        p, motivos = puntaje(datos[a], datos[b], umbral)
+        if p >= umbral:
+            encontrados.append({"puntaje": p, "motivos": motivos, "pacientes": [
+                {"id": x, "nombre": datos[x]["nombre"], "telefono": datos[x]["telefono"] or "",
+                 "fecha_nacimiento": _nacimiento(datos[x]["fecha_nacimiento"]), "creado": str(datos[x]["created_at"])}
+                for x in (a, b)]})
+    encontrados.sort(key=lambda e: (-e["puntaje"], e["pacientes"][0]["id"]))
+    return {
+        "pacientes": len(pacientes),
+        "pares_comparados": len(pares),
+        "bloques_omitidos": omitidos,
+        "total": len(encontrados),
+        "pares": encontrados[:limite],
+    }
+
+
+# --------- Fusión ---------
+def fusionar(session, conservar_id: int, duplicado_id: int) -> dict:
+    # Pasa consultas, recetas, citas y datos del duplicado al expediente que se
+    # conserva y borra el duplicado. No hace commit: todo queda en la
+    # transacción de quien llama. ValueError si los ids no son válidos.
+    if conservar_id == duplicado_id:
+        raise ValueError("no se puede fusionar un expediente consigo mismo")
+    pacientes = {r[0]: r for r in session.execute(text(
+        "SELECT id, nombre, edad, sexo, telefono, email, alergias, origen_id FROM patient WHERE id IN (:a, :b)"),
+        {"a": conservar_id, "b": duplicado_id})}
+    if conservar_id not in pacientes or duplicado_id not in pacientes:
+        raise ValueError("paciente no encontrado")
+    keep, dup = pacientes[conservar_id], pacientes[duplicado_id]
+    params = {"k": conservar_id, "d": duplicado_id}
+
+    fechas_citas = [datetime.fromisoformat(str(f)) for f in session.execute(
+        text("SELECT fecha FROM appointment WHERE patient_id = :d"), params).scalars()]
+    movidos = {}
+    for tabla, sql in REASIGNAR.items():
+        movidos[tabla] = session.execute(text(sql), params).rowcount
+
+    # Datos del paciente: se completan los vacíos; las alergias se suman
+    cambios = {}
+    for i, campo in ((2, "edad"), (3, "sexo"), (4, "telefono"), (5, "email")):
+        if keep[i] in (None, "") and dup[i] not in (None, ""):
+            cambios[campo] = dup[i]
+    if dup[6] and fold(dup[6]) not in fold(keep[6] or ""):
+        cambios["alergias"] = f"{keep[6]}; {dup[6]}" if keep[6] else dup[6]
+    if cambios:
+        session.execute(text(f"UPDATE patient SET {', '.join(f'{c} = :{c}' for c in cambios)} WHERE id = :k"),
+                        {**cambios, **params})
+
+    # Antecedentes: si el conservado no tiene, se reasignan; si tiene, se completan y se borran los del duplicado
+    extra_keep = session.execute(text(
+        "SELECT id, fecha_nacimiento, app, cirugias_previas FROM patientextra WHERE patient_id = :k ORDER BY id LIMIT 1"),
+        params).first()
+    if extra_keep is None:
+        movidos["patientextra"] = session.execute(
+            text("UPDATE patientextra SET patient_id = :k WHERE patient_id = :d"), params).rowcount
+    else:
+        fn, app_, cirugias = extra_keep[1], extra_keep[2], extra_keep[3]
+        for _, fn_d, app_d, cir_d in session.execute(text(
+                "SELECT id, fecha_nacimiento, app, cirugias_previas FROM patientextra WHERE patient_id = :d"), params):
+            fn = fn or fn_d
+            if app_d:
+                vistos = [a for a in (app_ or "").split(",") if a]
+                app_ = ",".join(vistos + [a for a in app_d.split(",") if a and a not in vistos])
+            if cir_d and fold(cir_d) not in fold(cirugias or ""):
+                cirugias = f"{cirugias}; {cir_d}" if cirugias else cir_d
+        session.execute(text(
+            "UPDATE patientextra SET fecha_nacimiento = :fn, app = :app, cirugias_previas = :cir WHERE id = :id"),
+            {"fn": fn, "app": app_ or None, "cir": cirugias, "id": extra_keep[0]})
+        movidos["patientextra"] = session.execute(text("DELETE FROM patientextra WHERE patient_id = :d"), params).rowcount
+
+    # Rastro de la fusión: redirige enlaces viejos y conserva el origen_id para la importación
+    session.execute(text("UPDATE pacientefusion SET conservado_id = :k WHERE conservado_id = :d"), params)
+    session.execute(text(
+        "INSERT OR REPLACE INTO pacientefusion (duplicado_id, conservado_id, origen_id, fecha) "
+        "VALUES (:d, :k, :o, :f)"), {**params, "o": dup[7], "f": datetime.utcnow()})
+    session.execute(text("DELETE FROM patient WHERE id = :d"), params)
+
+    busqueda.reindex(session, [conservar_id, duplicado_id])
+    indexar(session, [conservar_id, duplicado_id])
+    calendario.tocar(session, fechas_citas)
+    return {"conservado": conservar_id, "duplicado": duplicado_id, "movidos": movidos, "completados": sorted(cambios)}
+
+
+DESTINO_SQL = "SELECT conservado_id FROM pacientefusion WHERE duplicado_id = :d"
+
+
+def destino(session, pid: int):
+    # Expediente que conserva a un duplicado ya fusionado (o None)
+    return session.execute(text(DESTINO_SQL), {"d": pid}).scalar()
+
+
+def main(argv=None):
+    import argparse
+    from sqlmodel import Session
+    from app.db import DATABASE_URL, make_engine
+    from app import migraciones
+
+    ap = argparse.ArgumentParser(description="Reporte de expedientes duplicados y fusión")
+    ap.add_argument("--db", default=DATABASE_URL)
+    ap.add_argument("--umbral", type=float, default=UMBRAL)
+    ap.add_argument("--limite", type=int, default=100)
+    ap.add_argument("--fusionar", nargs=2, type=int, metavar=("CONSERVAR", "DUPLICADO"))
+    args = ap.parse_args(argv)
+
+    engine = make_engine(args.db)
+    migraciones.preparar_esquema(engine)
+    if args.fusionar:
+        with Session(engine) as session:
+            try:
+                r = fusionar(session, *args.fusionar)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                return 1
+            session.commit()
+        print(json.dumps(r, ensure_ascii=False))
+        return 0
+    with engine.connect() as conn:
+        rep = reporte(conn, args.umbral, args.limite)
+    for par in rep["pares"]:
+        a, b = par["pacientes"]
+        print(f"{par['puntaje']:.2f}  #{a['id']} {a['nombre']}  ~  #{b['id']} {b['nombre']}  ({', '.join(par['motivos'])})")
+    print(json.dumps({k: v for k, v in rep.items() if k != "pares"}, ensure_ascii=False), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import date, datetime
+from sqlalchemy import select
+
+from app.models import Appointment, Consulta, Patient, PatientExtra, RecetaHistory
+
+# Exportación completa en streaming (NDJSON o CSV, opcionalmente gzip). Las
+# filas se leen con yield_per en una sola transacción de lectura (una foto
+# consistente de la base en WAL) y se escriben en bloques, así que la memoria
+# no crece con el número de registros.
+#
+# tabla -> (modelo, columna de fecha para desde/hasta, columna de paciente)
+TABLAS = {
+    "pacientes": (Patient, "created_at", "id"),
+    "extras": (PatientExtra, None, "patient_id"),
+    "consultas": (Consulta, "fecha", "patient_id"),
+    "recetas": (RecetaHistory, "fecha", "patient_id"),
+    "citas": (Appointment, "fecha", "patient_id"),
+}
+FORMATOS = ("ndjson", "csv")
+YIELD_PER = 1000
+BLOQUE_BYTES = 64 * 1024
+
+
+def tablas_validas(nombres):
+    nombres = [n.strip() for n in (nombres or "").split(",") if n.strip()] if isinstance(nombres, str) else list(nombres or [])
+    return nombres or list(TABLAS)
+
+
+def _consulta(nombre, desde=None, hasta=None, patient_id=None):
+    modelo, col_fecha, col_paciente = TABLAS[nombre]
+    t = modelo.__table__
+    q = select(t)
+    if patient_id is not None:
+        q = q.where(t.c[col_paciente] == patient_id)
+    if desde or hasta:
+        if col_fecha:
+            col = t.c[col_fecha]
+        else:
+            # extras no tiene fecha propia: sigue a los pacientes del rango
+            p = Patient.__table__
+            q = q.join(p, p.c.id == t.c.patient_id)
+            col = p.c.created_at
+        if desde:
+            q = q.where(col >= desde)
+        if hasta:
+            q = q.where(col < hasta)
+    return q
+
+
+def _valor(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    return v
+
+
+def filas(conn, nombre, desde=None, hasta=None, patient_id=None):
+    res = conn.execution_options(yield_per=YIELD_PER).execute(_consulta(nombre, desde, hasta, patient_id))
+    for row in res:
+        yield {k: _valor(v) for k, v in row._mapping.items()}
+
+
+def ndjson(conn, tablas, desde=None, hasta=None, patient_id=None):
+    # Una línea por registro; "_tabla" indica de dónde viene
+    buf = io.StringIO()
+    for nombre in tablas:
+        for fila in filas(conn, nombre, desde, hasta, patient_id):
+            buf.write(json.dumps({"_tabla": nombre, **fila}, ensure_ascii=False))
+            buf.write("\n")
+            if buf.tell() >= BLOQUE_BYTES:
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0); buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def csv_tabla(conn, nombre, desde=None, hasta=None, patient_id=None):
+    # CSV de una sola tabla (las columnas difieren entre tablas)
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow([c.name for c in TABLAS[nombre][0].__table__.columns])
+    for fila in filas(conn, nombre, desde, hasta, patient_id):
+        w.writerow(["" if v is None else v for v in fila.values()])
+        if buf.tell() >= BLOQUE_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0); buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def comprimir(bloques):
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = contenedor gzip
+    for b in bloques:
+        out = z.compress(b)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def exportar(engine, formato="ndjson", tablas=None, desde=None, hasta=None, patient_id=None, gz=False):
+    # Generador de bytes; abre su propia conexión para que viva lo que dure el stream
+    tablas = tablas_validas(tablas)
+    with engine.connect() as conn:
+        if formato == "csv":
+            bloques = csv_tabla(conn, tablas[0], desde, hasta, patient_id)
+        else:
+            bloques = ndjson(conn, tablas, desde, hasta, patient_id)
+        yield from (comprimir(bloques) if gz else bloques)
+
+
+def validar(formato, tablas):
+    # Mensaje de error o None
+    if formato not in FORMATOS:
+        return f"formato debe ser uno de {', '.join(FORMATOS)}"
+    tablas = tablas_validas(tablas)
+    desconocidas = [t for t in tablas if t not in TABLAS]
+    if desconocidas:
+        return f"tablas desconocidas: {', '.join(desconocidas)} (usa {', '.join(TABLAS)})"
+    if formato == "csv" and len(tablas) != 1:
+        return "csv exporta una sola tabla: indica tablas=<nombre>"
+    return None
+
+
+def main(argv=None):
+    import argparse
+    from app.db import DATABASE_URL, make_engine
+
+    ap = argparse.ArgumentParser(description="Exporta los registros en NDJSON o CSV")
+    ap.add_argument("--db", default=DATABASE_URL)
+    ap.add_argument("--formato", choices=FORMATOS, default="ndjson")
+    ap.add_argument("--tablas", default="", help=f"separadas por coma ({', '.join(TABLAS)}); por defecto todas")
+    ap.add_argument("--desde", help="YYYY-MM-DD (incluido)")
+    ap.add_argument("--hasta", help="YYYY-MM-DD (excluido)")
+    ap.add_argument("--paciente", type=int)
+    ap.add_argument("--gzip", action="store_true")
+    ap.add_argument("--salida", "-o", default="-", help="archivo de salida (- = stdout); .gz activa --gzip")
+    args = ap.parse_args(argv)
+
+    error = validar(args.formato, args.tablas)
+    if error:
+        ap.error(error)
+    gz = args.gzip or args.salida.endswith(".gz")
+    engine = make_engine(args.db, readonly=True)
+    out = sys.stdout.buffer if args.salida == "-" else open(args.salida, "wb")
+    try:
+        for b in exportar(engine, args.formato, args.tablas, args.desde, args.hasta, args.paciente, gz):
+            out.write(b)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+import csv
+import gzip
+import hashlib
+import io
+import json
+import sys
+from datetime import date, datetime
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session
+
+from app import agenda, busqueda, calendario, duplicados, sentencias
+from app.models import Appointment, Patient, PatientExtra
+from app.texto import fold, solo_digitos
+
+# Importación masiva de pacientes y citas desde CSV o NDJSON. El archivo se lee
+# en streaming y se inserta por lotes: un INSERT ... ON CONFLICT DO NOTHING con
+# executemany y un commit por lote. Cada registro lleva un origen_id (el id del
+# sistema anterior o, si no viene, un hash de sus datos) con índice único, así
+# que volver a importar el mismo archivo no duplica nada. Las filas inválidas
+# se reportan una por una sin detener la importación.
+#
+# Dos filas del mismo archivo sin origen_id y con los mismos datos no se funden
+# en silencio: la segunda se rechaza como posible duplicado. Las citas que se
+# empalman con la agenda (o con otra cita del archivo) se rechazan, salvo con
+# forzar=True, igual que al agendar a mano.
+LOTE = 1000
+MAX_ERRORES = 1000
+TIPOS = ("pacientes", "citas")
+
+
+def _texto(v):
+    v = (v if v is not None else "")
+    v = str(v).strip()
+    return v or None
+
+
+def _entero(v, campo, minimo=None, maximo=None):
+    v = _texto(v)
+    if v is None:
+        return None
+    try:
+        n = int(float(v))
+    except (ValueError, OverflowError):
+        raise ValueError(f"{campo} no es un número: {v!r}")
+    if (minimo is not None and n < minimo) or (maximo is not None and n > maximo):
+        raise ValueError(f"{campo} fuera de rango: {n}")
+    return n
+
+
+def _fecha(v, campo):
+    v = _texto(v)
+    if v is None:
+        return None
+    for fmt in ("%d/%m/%Y", "%d-%m-%Y"):
+        try:
+            return datetime.strptime(v, fmt).date()
+        except ValueError:
+            pass
+    try:
+        return date.fromisoformat(v[:10])
+    except ValueError:
+        raise ValueError(f"{campo} inválida: {v!r}")
+
+
+def _fecha_hora(v, campo):
+    v = _texto(v)
+    if v is None:
+        raise ValueError(f"falta {campo}")
+    for fmt in ("%Y-%m-%d %H:%M", "%d/%m/%Y %H:%M", "%d-%m-%Y %H:%M"):
+        try:
+            return datetime.strptime(v, fmt)
+        except ValueError:
+            pass
+    try:
+        return datetime.fromisoformat(v.replace("Z", ""))
+    except ValueError:
+        raise ValueError(f"{campo} inválida: {v!r}")
+
+
+PREFIJO_HASH = "h:"
+
+
+def _hash(*partes) -> str:
+    return PREFIJO_HASH + hashlib.sha1("|".join(str(p or "") for p in partes).encode("utf-8")).hexdigest()[:20]
+
+
+def validar_paciente(fila):
+    nombre = _texto(fila.get("nombre"))
+    if not nombre:
+        raise ValueError("falta nombre")
+    telefono = _texto(fila.get("telefono"))
+    fn = _fecha(fila.get("fecha_nacimiento"), "fecha_nacimiento")
+    edad = _entero(fila.get("edad"), "edad", 0, 130)
+    sexo = _texto(fila.get("sexo"))
+    alergias = _texto(fila.get("alergias"))
+    origen = _texto(fila.get("origen_id")) or _hash(
+        fold(nombre), solo_digitos(telefono), fn, fold(sexo or ""), edad, fold(alergias or ""))
+    return {
+        "origen_id": origen,
+        "nombre": nombre,
+        "edad": edad,
+        "sexo": sexo,
+        "telefono": telefono,
+        "email": _texto(fila.get("email")),
+        "alergias": alergias,
+    }, {
+        "fecha_nacimiento": fn,
+        "app": _texto(fila.get("app")),
+        "cirugias_previas": _texto(fila.get("cirugias_previas")),
+    }
+
+
+def validar_cita(fila):
+    fecha = _fecha_hora(fila.get("fecha"), "fecha")
+    pid = _entero(fila.get("patient_id"), "patient_id", 1)
+    pac_origen = _texto(fila.get("paciente_origen_id"))
+    if pid is None and pac_origen is None:
+        raise ValueError("falta patient_id o paciente_origen_id")
+    origen = _texto(fila.get("origen_id")) or _hash(pid, pac_origen, fecha.isoformat())
+    return {
+        "origen_id": origen,
+        "patient_id": pid,
+        "paciente_origen_id": pac_origen,
+        "fecha": fecha,
+        "duracion_min": _entero(fila.get("duracion_min"), "duracion_min", 1, agenda.MAX_DURACION_MIN),
+        "notas": _texto(fila.get("notas")) or "",
+    }
+
+
+def leer(archivo, formato: str):
+    # Itera (número de fila, dict, tipo o None) sin cargar el archivo completo.
+    # Acepta gzip; en NDJSON, "_tabla" (como en app.exportar) indica el tipo.
+    crudo = archivo if hasattr(archivo, "peek") else io.BufferedReader(archivo)
+    if crudo.peek(2)[:2] == b"\x1f\x8b":
+        crudo = gzip.GzipFile(fileobj=crudo, mode="rb")
+    texto = io.TextIOWrapper(crudo, encoding="utf-8-sig", newline="")
+    if formato == "csv":
+        for n, fila in enumerate(csv.DictReader(texto), start=2):
+            yield n, fila, None
+        return
+    for n, linea in enumerate(texto, start=1):
+        if not linea.strip():
+            continue
+        try:
+            fila = json.loads(linea)
+        except ValueError as e:
+            yield n, e, None
+            continue
+        if not isinstance(fila, dict):
+            yield n, ValueError("la línea no es un objeto JSON"), None
+            continue
+        yield n, fila, fila.get("_tabla")
+
+
+class Reporte:
+    def __init__(self):
+        self.filas = 0
+        self.insertados = {t: 0 for t in TIPOS}
+        self.existentes = {t: 0 for t in TIPOS}
+        self.rechazados = 0
+        self.errores = []
+        # origen_id derivado (hash) -> fila donde apareció primero en este archivo
+        self.derivados = {}
+
+    def error(self, fila, mensaje):
+        self.rechazados += 1
+        if len(self.errores) < MAX_ERRORES:
+            self.errores.append({"fila": fila, "error": mensaje})
+
+    def dict(self):
+        return {
+            "filas": self.filas,
+            "insertados": self.insertados,
+            "existentes": self.existentes,
+            "rechazados": self.rechazados,
+            "errores": sorted(self.errores, key=lambda e: e["fila"]),
+            "errores_truncados": self.rechazados > len(self.errores),
+        }
+
+
+def _ids_por_origen(session, modelo, origenes):
+    if not origenes:
+        return {}
+    return dict(session.execute(sentencias.ids_por_origen(modelo, origenes)).all())
+
+
+def _pacientes_por_origen(session, origenes):
+    # Como _ids_por_origen, pero un origen_id de un expediente ya fusionado apunta al conservado
+    ids = _ids_por_origen(session, Patient, origenes)
+    faltan = [o for o in origenes if o not in ids]
+    if faltan:
+        ids.update(session.execute(sentencias.fusionados_por_origen(faltan)).all())
+    return ids
+
+
+def _lote_pacientes(session, lote, reporte):
+    # lote: [(fila, paciente, extra)]
+    unicos = {}
+    for fila, pac, extra in lote:
+        origen = pac["origen_id"]
+        if origen.startswith(PREFIJO_HASH):
+            primera = reporte.derivados.setdefault(origen, fila)
+            if primera != fila:
+                reporte.error(fila, f"posible duplicado de la fila {primera} (mismos datos y sin origen_id)")
+                continue
+        unicos.setdefault(origen, (fila, pac, extra))
+    previos = _pacientes_por_origen(session, list(unicos))
+    nuevos = [v for k, v in unicos.items() if k not in previos]
+    reporte.existentes["pacientes"] += len(unicos) - len(nuevos)
+    if not nuevos:
+        return
+    ahora = datetime.utcnow()
+    session.execute(
+        sqlite_insert(Patient).on_conflict_do_nothing(index_elements=["origen_id"]),
+        [{**pac, "created_at": ahora} for _, pac, _ in nuevos],
+    )
+    ids = _ids_por_origen(session, Patient, [pac["origen_id"] for _, pac, _ in nuevos])
+    session.execute(
+        sqlite_insert(PatientExtra),
+        [{"patient_id": ids[pac["origen_id"]], **extra} for _, pac, extra in nuevos],
+    )
+    busqueda.reindex(session, ids.values())
+    duplicados.indexar(session, ids.values())
+    reporte.insertados["pacientes"] += len(ids)
+
+
+def _empalme(session, c, aceptadas):
+    # Mensaje de error si la cita choca con la agenda o con otra cita ya aceptada del archivo
+    choques = agenda.conflictos(session, c["fecha"], c["duracion_min"])
+    if choques:
+        ch = choques[0]
+        return f"se empalma con la cita {ch['id']} ({ch['inicio']} a {ch['fin'][-5:]})"
+    a = c["fecha"].hour * 60 + c["fecha"].minute
+    b = a + (c["duracion_min"] or agenda.DURACION_MIN)
+    for fila, a2, b2 in aceptadas.get(c["fecha"].date(), ()):
+        if a < b2 and a2 < b:
+            return f"se empalma con la cita de la fila {fila}"
+    aceptadas.setdefault(c["fecha"].date(), []).append((c["fila"], a, b))
+    return None
+
+
+def _lote_citas(session, lote, reporte, forzar=False):
+    # lote: [(fila, cita)]; resuelve paciente_origen_id -> patient_id
+    por_origen = _pacientes_por_origen(session, list({c["paciente_origen_id"] for _, c in lote if c["paciente_origen_id"]}))
+    locales = {c["patient_id"] for _, c in lote if c["patient_id"]}
+    if locales:
+        locales = set(session.execute(select(Patient.id).where(Patient.id.in_(list(locales)))).scalars())
+    validas = {}
+    for fila, c in lote:
+        pid = por_origen.get(c["paciente_origen_id"]) if c["paciente_origen_id"] else c["patient_id"]
+        if pid is None or (not c["paciente_origen_id"] and pid not in locales):
+            reporte.error(fila, f"paciente no encontrado: {c['paciente_origen_id'] or c['patient_id']}")
+            continue
+        validas.setdefault(c["origen_id"], {
+            "fila": fila, "origen_id": c["origen_id"], "patient_id": pid, "fecha": c["fecha"],
+            "duracion_min": c["duracion_min"], "notas": c["notas"],
+        })
+    previos = _ids_por_origen(session, Appointment, validas)
+    nuevas = [v for k, v in validas.items() if k not in previos]
+    reporte.existentes["citas"] += len(validas) - len(nuevas)
+    if not forzar:
+        aceptadas = {}
+        revisadas = []
+        for c in sorted(nuevas, key=lambda c: c["fila"]):
+            error = _empalme(session, c, aceptadas)
+            if error:
+                reporte.error(c["fila"], error)
+            else:
+                revisadas.append(c)
+        nuevas = revisadas
+    if not nuevas:
+        return
+    nuevas = [{k: v for k, v in c.items() if k != "fila"} for c in nuevas]
+    session.execute(sqlite_insert(Appointment).on_conflict_do_nothing(index_elements=["origen_id"]), nuevas)
+    calendario.tocar(session, [c["fecha"] for c in nuevas])
+    reporte.insertados["citas"] += len(nuevas)
+
+
+def importar(engine, archivo, formato: str = "csv", tipo: str | None = None, lote: int = LOTE,
+             forzar: bool = False) -> dict:
+    # tipo: pacientes|citas (obligatorio en CSV; en NDJSON puede venir en "_tabla")
+    # forzar: importa también las citas que se empalman con otras
+    reporte = Reporte()
+    pendientes = {"pacientes": [], "citas": []}
+    validadores = {"pacientes": validar_paciente, "citas": validar_cita}
+    procesar = {"pacientes": _lote_pacientes, "citas": lambda s, l, r: _lote_citas(s, l, r, forzar)}
+
+    def vaciar(t):
+        if not pendientes[t]:
+            return
+        with Session(engine) as session:
+            procesar[t](session, pendientes[t], reporte)
+            session.commit()
+        pendientes[t] = []
+
+    for n, fila, tabla in leer(archivo, formato):
+        reporte.filas += 1
+        if isinstance(fila, Exception):
+            reporte.error(n, f"JSON inválido: {fila}")
+            continue
+        t = tabla or tipo
+        if t == "extras":
+            t = None
+        if t not in TIPOS:
+            reporte.error(n, f"tipo de registro desconocido: {t!r}")
+            continue
+        try:
+            validado = validadores[t](fila)
+            pendientes[t].append((n, *validado) if t == "pacientes" else (n, validado))
+        except ValueError as e:
+            reporte.error(n, str(e))
+            continue
+        if len(pendientes[t]) >= lote:
+            # las citas pueden apuntar a pacientes del mismo archivo: primero pacientes
+            if t == "citas":
+                vaciar("pacientes")
+            vaciar(t)
+    vaciar("pacientes")
+    vaciar("citas")
+    return reporte.dict()
+
+
+def main(argv=None):
+    import argparse
+    from app.db import DATABASE_URL, make_engine
+
+    ap = argparse.ArgumentParser(description="Importa pacientes y citas desde CSV o NDJSON")
+    ap.add_argument("archivo", help="ruta del archivo (.csv, .ndjson, opcionalmente .gz)")
+    ap.add_argument("--db", default=DATABASE_URL)
+    ap.add_argument("--tipo", choices=TIPOS, help="obligatorio para CSV")
+    ap.add_argument("--formato", choices=("csv", "ndjson"), help="por defecto según la extensión")
+    ap.add_argument("--lote", type=int, default=LOTE)
+    ap.add_argument("--forzar", action="store_true", help="importa también las citas que se empalman")
+    args = ap.parse_args(argv)
+
+    formato = args.formato or ("csv" if ".csv" in args.archivo else "ndjson")
+    if formato == "csv" and not args.tipo:
+        ap.error("para CSV indica --tipo pacientes|citas")
+    from sqlmodel import SQLModel
+    from app import migraciones
+    engine = make_engine(args.db)
+    SQLModel.metadata.create_all(engine)
+    migraciones.migrar(engine)
+    with open(args.archivo, "rb") as f:
+        rep = importar(engine, f, formato, args.tipo, args.lote, args.forzar)
+    for e in rep["errores"]:
+        print(f"fila {e['fila']}: {e['error']}", file=sys.stderr)
+    print(json.dumps({k: v for k, v in rep.items() if k != "errores"}, ensure_ascii=False))
+    return 1 if rep["rechazados"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
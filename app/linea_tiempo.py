@@ -0,0 +1,109 @@
+from datetime import datetime
+from sqlalchemy import text
+
+# Línea de tiempo de un paciente: consultas, recetas y citas en una sola
+# consulta UNION ALL, ordenada por fecha descendente y paginada por keyset.
+# Cada rama usa su índice (patient_id, fecha) con su propio LIMIT, así que el
+# costo no crece con la antigüedad del expediente. Sólo devuelve resúmenes
+# (diagnóstico, medicamentos, notas), nunca los JSON completos.
+POR_PAGINA = 30
+MAX_POR_PAGINA = 100
+
+# Orden de desempate entre eventos con la misma fecha (mayor = primero)
+TIPOS = {"cita": 2, "receta": 1, "consulta": 0}
+
+_RAMAS = {
+    "consulta": (
+        "SELECT 'consulta' AS tipo, id, fecha, coalesce(nullif(dx, ''), nullif(motivo, '—')) AS titulo, "
+        "substr(tratamiento, 1, 160) AS detalle, NULL AS consulta_id FROM consulta "
+        "WHERE patient_id = :pid{filtro} ORDER BY fecha DESC, id DESC LIMIT :lim"
+    ),
+    "receta": (
+        "SELECT 'receta' AS tipo, id, fecha, NULL AS titulo, substr(recomendaciones, 1, 160) AS detalle, consulta_id "
+        "FROM recetahistory WHERE patient_id = :pid{filtro} ORDER BY fecha DESC, id DESC LIMIT :lim"
+    ),
+    "cita": (
+        "SELECT 'cita' AS tipo, id, fecha, notas AS titulo, CAST(duracion_min AS TEXT) AS detalle, NULL AS consulta_id "
+        "FROM appointment WHERE patient_id = :pid{filtro} ORDER BY fecha DESC, id DESC LIMIT :lim"
+    ),
+}
+
+
+def cursor_de(fila) -> str:
+    # "<fecha tal como está en la base>_<tipo>_<id>" del último evento de la página
+    return f"{fila['fecha']}_{fila['tipo']}_{fila['id']}"
+
+
+def _leer_cursor(cursor: str):
+    fecha, tipo, id_ = cursor.rsplit("_", 2)
+    if tipo not in TIPOS or not fecha:
+        raise ValueError("cursor inválido")
+    return fecha, tipo, int(id_)
+
+
+def _filtro(tipo: str, pos):
+    # Condición keyset de una rama: (fecha, orden del tipo, id) < cursor.
+    # El orden del tipo es constante en la rama, así que se resuelve aquí y
+    # queda un rango simple sobre el índice (patient_id, fecha).
+    if pos is None:
+        return ""
+    _, tipo_c, _ = pos
+    if TIPOS[tipo] < TIPOS[tipo_c]:
+        return " AND fecha <= :f"
+    if TIPOS[tipo] > TIPOS[tipo_c]:
+        return " AND fecha < :f"
+    return " AND (fecha < :f OR (fecha = :f AND id < :id))"
+
+
+def sql_pagina(tipos, pos, lim: int):
+    # -> (SQL, parámetros sin :pid) de una página; pos = cursor ya leído o None
+    ramas = " UNION ALL ".join(f"SELECT * FROM ({_RAMAS[t].format(filtro=_filtro(t, pos))})" for t in tipos)
+    # Los medicamentos de la receta sólo se calculan para los eventos de la página
+    sql = (
+        "SELECT t.tipo, t.id, t.fecha, t.consulta_id, t.detalle, "
+        "CASE WHEN t.tipo = 'receta' THEN (SELECT group_concat(medicamento, ', ') FROM "
+        "(SELECT medicamento FROM recetahistoryitem WHERE receta_id = t.id ORDER BY posicion)) "
+        "ELSE t.titulo END AS titulo "
+        f"FROM ({ramas}) t ORDER BY t.fecha DESC, "
+        "CASE t.tipo WHEN 'cita' THEN 2 WHEN 'receta' THEN 1 ELSE 0 END DESC, t.id DESC LIMIT :lim"
+    )
+    params = {"lim": lim}
+    if pos:
+        params["f"], params["id"] = pos[0], pos[2]
+    return sql, params
+
+
+def pagina(session, pid: int, cursor: str | None = None, limite: int = POR_PAGINA, tipos=None):
+    # -> (eventos, cursor siguiente o None); ValueError si el cursor no es válido
+    limite = min(max(int(limite), 1), MAX_POR_PAGINA)
+    tipos = [t for t in (tipos or TIPOS) if t in TIPOS]
+    if not tipos:
+        return [], None
+    pos = _leer_cursor(cursor) if cursor else None
+    sql, params = sql_pagina(tipos, pos, limite + 1)
+    params["pid"] = pid
+    filas = [dict(r._mapping) for r in session.execute(text(sql), params)]
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = cursor_de(filas[-1])
+    return [_evento(f) for f in filas], siguiente
+
+
+def _evento(f):
+    tipo, id_ = f["tipo"], f["id"]
+    fecha = datetime.fromisoformat(str(f["fecha"]))
+    ev = {"tipo": tipo, "id": id_, "fecha": fecha.isoformat(timespec="minutes"), "fecha_txt": fecha.strftime("%d/%m/%Y %H:%M"),
+          "titulo": f["titulo"] or "", "detalle": f["detalle"] or ""}
+    if tipo == "consulta":
+        ev["url"] = f"/consulta/{id_}"
+        ev["titulo"] = ev["titulo"] or "Consulta"
+    elif tipo == "receta":
+        ev["url"] = f"/receta/historial/{id_}/pdf"
+        ev["titulo"] = ev["titulo"] or "Receta"
+        ev["consulta_id"] = f["consulta_id"]
+    else:
+        ev["url"] = None
+        ev["titulo"] = ev["titulo"] or "Cita"
+        ev["detalle"] = f"{ev['detalle']} min" if ev["detalle"] else ""
+    return ev
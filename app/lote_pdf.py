@@ -0,0 +1,77 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+# Impresión por lote de recetas (p. ej. todas las del día) en un solo PDF.
+# Las recetas se reparten en fragmentos que se dibujan en procesos aparte, cada
+# uno a su propio archivo temporal; al final se unen en disco y el resultado se
+# devuelve como archivo, sin ocupar el threadpool de la API ni la memoria.
+PROCESOS = int(os.getenv("PDF_LOTE_PROCESOS", str(min(4, os.cpu_count() or 1))))
+TAM_FRAGMENTO = int(os.getenv("PDF_LOTE_FRAGMENTO", "25"))
+MAX_RECETAS = int(os.getenv("PDF_LOTE_MAX", "2000"))
+
+_pool = None
+
+
+def pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: no heredar hilos ni conexiones abiertas del worker de uvicorn
+        _pool = ProcessPoolExecutor(max_workers=PROCESOS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def cerrar():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def receta_para_lote(hist, nombre_paciente):
+    # Tupla serializable con lo necesario para dibujar la receta (mismo formato que /receta/historial/{id}/pdf)
+    from app.pdf import items_normalizados
+    try:
+        items = items_normalizados(json.loads(hist.items_json or "[]"))
+    except Exception:
+        items = []
+    return (nombre_paciente or "Paciente", hist.fecha.date().isoformat(), items, hist.recomendaciones, hist.proxima_cita)
+
+
+def dibujar_fragmento(recetas, ruta: str) -> str:
+    # Corre en el pool de procesos: una página por receta
+    from reportlab.pdfgen import canvas as _cv
+    from reportlab.lib.pagesizes import letter as _letter
+    from app.pdf import dibujar_receta
+    c = _cv.Canvas(ruta, pagesize=_letter)
+    for nombre, fecha, items, rec, prox in recetas:
+        dibujar_receta(c, nombre, fecha, items, rec, prox)
+    c.save()
+    return ruta
+
+
+def unir(rutas, destino: str) -> str:
+    from pypdf import PdfWriter
+    w = PdfWriter()
+    for r in rutas:
+        w.append(r)
+    with open(destino, "wb") as f:
+        w.write(f)
+    w.close()
+    return destino
+
+
+def fragmentos(recetas, tam: int = TAM_FRAGMENTO):
+    for i in range(0, len(recetas), tam):
+        yield recetas[i:i + tam]
+
+
+def directorio_temporal() -> str:
+    return tempfile.mkdtemp(prefix="recetas_lote_")
+
+
+def limpiar(directorio: str):
+    shutil.rmtree(directorio, ignore_errors=True)
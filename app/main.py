@@ -1,63 +1,147 @@
 
+from app import arranque  # primero: marca el inicio de la importación
 from fastapi import FastAPI, Request, Form, Depends
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-from sqlmodel import SQLModel, Session, create_engine, select
+from sqlmodel import Session, select
 from typing import Optional
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-from datetime import datetime, date, timedelta
-from app.models import Patient, PatientExtra, Consulta, Ajustes, RecetaItem, Medicine, Dosificacion, Appointment, RecetaHistory
+from datetime import datetime, timedelta
+from app.models import Patient, PatientExtra, Consulta, Ajustes, RecetaItem, RecetaHistory
 from app.routers.appointments import make_router
 from app.routers.recetas import make_router as make_recetas_router
-import json, os
-
-DATABASE_URL = "sqlite:///./data.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+from app.routers.pacientes import make_router as make_pacientes_router
+from app.routers.catalogo import make_router as make_catalogo_router
+from app.routers.consultas import make_router as make_consultas_router
+from app.routers.mantenimiento import make_router as make_mantenimiento_router
+from app import agenda, assets, busqueda, catalogo, clinicas, duplicados, linea_tiempo, metricas, migraciones, pdf, pdf_cache, plantillas, recetas_items, reconciliacion, respaldos, sentencias, vitales
+from app.cache import CHECK_SECONDS, VersionedCache, bump
+from app.db import make_engine
+import json, os, time
+
+if clinicas.ACTIVO:
+    # Una base por clínica (CLINICAS_DIR): los engines se resuelven en cada petición
+    engine = clinicas.EngineClinica()
+    read_engine = clinicas.EngineClinica(lectura=True)
+else:
+    engine = make_engine()
+    read_engine = make_engine(readonly=True)
+    metricas.instrumentar(engine)
+    metricas.instrumentar(read_engine)
 
 app = FastAPI(title="Expediente Médico 1.3.0 (calibrated)")
-app.include_router(make_router(engine))
-app.include_router(make_recetas_router(engine))
+if clinicas.ACTIVO:
+    app.add_middleware(clinicas.ClinicaMiddleware)
+app.add_middleware(assets.GZipDinamico, minimum_size=1024)
+app.add_middleware(metricas.MetricasMiddleware)
+app.include_router(make_router(engine, read_engine))
+app.include_router(make_recetas_router(engine, read_engine))
+app.include_router(make_pacientes_router(engine, read_engine))
+app.include_router(make_catalogo_router(engine, read_engine))
+app.include_router(make_consultas_router(engine, read_engine))
+app.include_router(make_mantenimiento_router(engine, read_engine))
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
+app.mount(assets.URL_PREFIX, assets.StaticPrecomprimidos(directory=assets.ASSETS_DIR, check_dir=False), name="assets")
 
-env = Environment(loader=FileSystemLoader("app/templates"), autoescape=select_autoescape())
+env = plantillas.env
 
 def render(name: str, **ctx):
-    return HTMLResponse(env.get_template(name).render(**ctx))
+    return HTMLResponse(plantillas.render(name, **ctx))
 
 def get_session():
     with Session(engine) as session:
         yield session
 
+def get_read_session():
+    with Session(read_engine) as session:
+        yield session
+
+def _cargar_ajustes(session: Session):
+    a = session.exec(select(Ajustes)).first()
+    if a:
+        session.expunge(a)
+    return a
+
+# Ajustes de la clínica en memoria; ajustes_post sube el sello "ajustes"
+ajustes_cache = VersionedCache("ajustes", _cargar_ajustes)
+
+# (existe, revisado_en): el logo se vuelve a buscar como mucho cada
+# CHECK_SECONDS, así que subirlo o quitarlo se nota sin reiniciar los workers
+_logo = (False, float("-inf"))
+
+def _logo_existe() -> bool:
+    global _logo
+    ahora = time.monotonic()
+    if ahora - _logo[1] >= CHECK_SECONDS:
+        _logo = (os.path.exists("app/static/logo-header.png"), ahora)
+    return _logo[0]
+
 @app.on_event("startup")
 def on_startup():
-    SQLModel.metadata.create_all(engine)
-    with Session(engine) as s:
-        ajustes = s.exec(select(Ajustes)).first()
-        if not ajustes:
-            ajustes = Ajustes(
-                clinica_nombre="CLINICA IMAGEN",
-                clinica_direccion="Tabasco 403, Valle de Aguayo, 87020 Cdad. Victoria, Tamps.",
-                clinica_telefono="8341779965",
-                medico_nombre="Dr. Jorge Alberto Rodríguez Martinez",
-                cedula="5439453",
-                cedula_especialista="1067241",
-            )
-            s.add(ajustes); s.commit()
+    # Con varias clínicas, cada base se migra al abrirse por primera vez
+    if not clinicas.ACTIVO:
+        with arranque.fase("esquema"):
+            migraciones.preparar_esquema(engine)
+    with arranque.fase("assets"):
+        assets.preparar()
+    with arranque.fase("plantillas"):
+        plantillas.precompilar()
+    # Respaldos en línea programados (RESPALDOS_CADA_H, 0 los desactiva)
+    respaldos.programar()
+    arranque.listo()
+    # ReportLab se carga en segundo plano; el primer /receta/pdf ya no lo paga
+    arranque.en_segundo_plano("pdf", pdf.calentar)
+
+@app.on_event("shutdown")
+def on_shutdown():
+    respaldos.detener()
+    if clinicas.ACTIVO:
+        clinicas.pool.cerrar_todas()
+
+@app.get("/api/arranque")
+def arranque_reporte():
+    return {"ok": True, **arranque.reporte()}
 
 # --------- Splash ---------
 @app.get("/", response_class=HTMLResponse)
-def bienvenida(request: Request, session: Session = Depends(get_session)):
-    ajustes = session.exec(select(Ajustes)).first()
-    logo_exists = os.path.exists("app/static/logo-header.png")
-    return render("bienvenida.html", request=request, ajustes=ajustes, has_logo=logo_exists)
+def bienvenida(request: Request, session: Session = Depends(get_read_session)):
+    ajustes = ajustes_cache.get(session)
+    return render("bienvenida.html", request=request, ajustes=ajustes, has_logo=_logo_existe())
 
 # --------- Expediente con calendario ---------
+PACIENTES_POR_PAGINA = 50
+
+def _cursor_pacientes(cursor: str | None):
+    # cursor = "<created_at ISO>_<id>" del último paciente de la página anterior
+    try:
+        ts, pid = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(ts), int(pid)
+    except Exception:
+        return None
+
+def _conteo_consultas(session: Session, ids):
+    # Un solo GROUP BY para todas las filas visibles (evita p.consultas|length por fila)
+    if not ids:
+        return {}
+    rows = session.exec(sentencias.conteo_consultas(ids)).all()
+    return {pid: n for pid, n in rows}
+
 @app.get("/expediente", response_class=HTMLResponse)
-def expediente_home(request: Request, q: str|None=None, fecha: str|None=None, session: Session = Depends(get_session)):
-    pacientes = session.exec(select(Patient).order_by(Patient.created_at.desc())).all()
+def expediente_home(request: Request, q: str|None=None, fecha: str|None=None, page: int = 1, cursor: str|None=None, session: Session = Depends(get_read_session)):
+    page = max(page, 1)
+    total = None
+    siguiente = None
     if q:
-        ql = q.lower()
-        pacientes = [p for p in pacientes if ql in (p.nombre or '').lower() or ql in (p.alergias or '')]
+        # Búsqueda indexada (FTS5, sin acentos ni mayúsculas), paginada
+        pacientes, total = busqueda.buscar(session, q, page=page, per_page=PACIENTES_POR_PAGINA)
+    else:
+        # Paginación keyset sobre (created_at, id), estable aunque se agreguen pacientes
+        pos = _cursor_pacientes(cursor) if cursor else None
+        pacientes = session.exec(sentencias.pacientes_pagina(pos, PACIENTES_POR_PAGINA + 1)).all()
+        if len(pacientes) > PACIENTES_POR_PAGINA:
+            pacientes = pacientes[:PACIENTES_POR_PAGINA]
+            ult = pacientes[-1]
+            siguiente = f"{ult.created_at.isoformat()}_{ult.id}"
+    conteos = _conteo_consultas(session, [p.id for p in pacientes])
 
     try:
         sel = datetime.fromisoformat(fecha) if fecha else datetime.now()
@@ -66,11 +150,10 @@ def expediente_home(request: Request, q: str|None=None, fecha: str|None=None, se
     dia_ini = sel.replace(hour=0, minute=0, second=0, microsecond=0)
     dia_fin = sel.replace(hour=23, minute=59, second=59, microsecond=999999)
 
-    citas = session.exec(select(Appointment).where(Appointment.fecha >= dia_ini, Appointment.fecha <= dia_fin).order_by(Appointment.fecha.asc())).all()
+    citas = session.exec(sentencias.citas_rango(dia_ini, dia_fin, con_paciente_faltante=True)).all()
 
     cita_rows = []
-    for c in citas:
-        p = session.get(Patient, c.patient_id)
+    for c, p in citas:
         cita_rows.append({
             "id": c.id,
             "pid": p.id if p else None,
@@ -84,13 +167,25 @@ def expediente_home(request: Request, q: str|None=None, fecha: str|None=None, se
     sel_str = dia_ini.strftime("%Y-%m-%d")
     titulo = sel.strftime("%A %d/%m/%Y")
 
-    return render("home.html", request=request, pacientes=pacientes, q=q or '',
+    paginas = -(-total // PACIENTES_POR_PAGINA) if total else 0
+    return render("home.html", request=request, pacientes=pacientes, conteos=conteos, q=q or '', page=page, total=total, paginas=paginas,
+                  cursor=cursor or '', siguiente=siguiente,
                   citas=cita_rows, hoy=titulo, sel=sel_str, prev_day=prev_day, next_day=next_day)
 
+# Tiempo de render por plantilla (desde el arranque de este worker)
+@app.get("/api/plantillas/tiempos")
+def plantillas_tiempos():
+    return {"ok": True, "plantillas": plantillas.tiempos()}
+
+@app.get("/metrics")
+def metrics():
+    return Response(metricas.exposicion(plantillas.totales(), arranque.reporte(),
+                                        clinicas.pool.reporte() if clinicas.ACTIVO else None, respaldos.estados()), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # --------- Ajustes ---------
 @app.get("/ajustes", response_class=HTMLResponse)
-def ajustes_get(request: Request, session: Session = Depends(get_session)):
-    ajustes = session.exec(select(Ajustes)).first()
+def ajustes_get(request: Request, session: Session = Depends(get_read_session)):
+    ajustes = ajustes_cache.get(session)
     return render("ajustes.html", request=request, a=ajustes)
 
 @app.post("/ajustes", response_class=HTMLResponse)
@@ -111,17 +206,21 @@ def ajustes_post(
     a.medico_nombre = medico_nombre or a.medico_nombre
     a.cedula = cedula or a.cedula
     a.cedula_especialista = cedula_especialista or a.cedula_especialista
-    session.add(a); session.commit()
+    session.add(a)
+    bump(session, "ajustes")
+    session.commit()
+    ajustes_cache.invalidate()
     return RedirectResponse("/", status_code=303)
 
 # --------- Pacientes / Consultas ---------
 @app.get("/paciente/nuevo", response_class=HTMLResponse)
 def paciente_nuevo(request: Request):
     APP_OPTS = ["Diabetes Mellitus","Hipertensión Arterial","Artritis Reumatoide","Infarto Agudo del Miocardio","Hipotiroidismo","Insuficiencia renal"]
-    return render("patient_form.html", request=request, paciente=None, app_opts=APP_OPTS)
+    return render("patient_form.html", request=request, paciente=None, app_opts=APP_OPTS, valores={}, duplicados=[])
 
 @app.post("/paciente/guardar")
 def paciente_guardar(
+    request: Request,
     nombre: str = Form(...),
     edad: Optional[int] = Form(None),
     sexo: Optional[str] = Form(None),
@@ -130,35 +229,53 @@ def paciente_guardar(
     fecha_nacimiento: Optional[str] = Form(None),
     app_sel: Optional[str] = Form(None),
     cirugias_previas: Optional[str] = Form(None),
+    forzar: bool = Form(False),
     session: Session = Depends(get_session),
 ):
-    paciente = Patient(nombre=nombre, edad=edad, sexo=sexo, telefono=telefono, alergias=alergias)
-    session.add(paciente); session.commit()
     from datetime import date as ddate
     fn = None
     try:
         fn = ddate.fromisoformat(fecha_nacimiento) if fecha_nacimiento else None
     except Exception:
         fn = None
-    extras = PatientExtra(patient_id=paciente.id, fecha_nacimiento=fn, app=app_sel, cirugias_previas=cirugias_previas)
-    session.add(extras); session.commit()
-    return RedirectResponse(url=f"/paciente/{paciente.id}#previas", status_code=303)
+    # Posible duplicado: se vuelve a mostrar el formulario con los candidatos hasta confirmar
+    if not forzar:
+        candidatos = duplicados.candidatos(session, nombre, telefono, fn)
+        if candidatos:
+            valores = {"nombre": nombre, "edad": edad, "sexo": sexo, "telefono": telefono, "alergias": alergias,
+                       "fecha_nacimiento": fecha_nacimiento, "app_sel": app_sel, "cirugias_previas": cirugias_previas}
+            return HTMLResponse(plantillas.render("patient_form.html", request=request, paciente=None, valores=valores,
+                                                  duplicados=candidatos), status_code=409)
+    # Paciente, antecedentes, índice de búsqueda y claves de duplicados en un solo commit
+    paciente = Patient(nombre=nombre, edad=edad, sexo=sexo, telefono=telefono, alergias=alergias)
+    session.add(paciente); session.flush()
+    pid = paciente.id
+    extras = PatientExtra(patient_id=pid, fecha_nacimiento=fn, app=app_sel, cirugias_previas=cirugias_previas)
+    session.add(extras); session.flush()
+    busqueda.reindex(session, [pid])
+    duplicados.indexar(session, [pid])
+    session.commit()
+    return RedirectResponse(url=f"/paciente/{pid}#previas", status_code=303)
 
 @app.get("/paciente/{pid}", response_class=HTMLResponse)
-def paciente_detalle(pid: int, request: Request, session: Session = Depends(get_session)):
+def paciente_detalle(pid: int, request: Request, session: Session = Depends(get_read_session)):
     paciente = session.get(Patient, pid)
     if not paciente:
-        return RedirectResponse("/expediente", 303)
-    extra = session.exec(select(PatientExtra).where(PatientExtra.patient_id==pid)).first()
+        # Expediente fusionado con otro: los enlaces viejos siguen funcionando
+        destino = duplicados.destino(session, pid)
+        return RedirectResponse(f"/paciente/{destino}" if destino else "/expediente", 303)
+    extra = session.exec(sentencias.extra_paciente(pid)).first()
     edad_calc = paciente.edad
     if extra and extra.fecha_nacimiento:
         today = datetime.today().date()
         edad_calc = today.year - extra.fecha_nacimiento.year - ((today.month, today.day) < (extra.fecha_nacimiento.month, extra.fecha_nacimiento.day))
     app_list = (extra.app.split(",") if extra and extra.app else [])
     # Última consulta para enlazar receta rápida
-_ultima = session.exec(select(Consulta).where(Consulta.patient_id==pid).order_by(Consulta.fecha.desc())).first()
-ultima_consulta_id = _ultima.id if _ultima else None
-return render("patient_detail.html", request=request, p=paciente, extra=extra, edad_calc=edad_calc, app_list=app_list, ultima_consulta_id=ultima_consulta_id)
+    ultima_consulta_id = session.exec(sentencias.ultima_consulta(pid)).first()
+    # Primera página de la línea de tiempo; el resto lo pide la página a /api/pacientes/{pid}/linea-tiempo
+    eventos, siguiente = linea_tiempo.pagina(session, pid)
+    return render("patient_detail.html", request=request, p=paciente, extra=extra, edad_calc=edad_calc, app_list=app_list,
+                  ultima_consulta_id=ultima_consulta_id, eventos=eventos, siguiente=siguiente)
 
 @app.post("/consulta/guardar")
 def consulta_guardar(
@@ -191,12 +308,17 @@ def consulta_guardar(
         "notas_libres": notas or ""
     }
     c = Consulta(patient_id=patient_id, fecha=fecha_dt, motivo="—", dx=diagnosticos, tratamiento=plan_manejo, notas=json.dumps(payload, ensure_ascii=False))
-    session.add(c); session.commit()
+    session.add(c); session.flush()
+    # Copias consultables: vitales tipados e índice de diagnósticos
+    vitales.guardar(session, c, payload["vitales"])
+    busqueda.reindex_dx(session, [c.id])
+    reconciliacion.enlazar_del_dia(session, c)
+    session.commit()
     return RedirectResponse(url=f"/paciente/{patient_id}#previas", status_code=303)
 
 
 @app.get("/consulta/{cid}", response_class=HTMLResponse)
-def consulta_detalle(cid: int, request: Request, session: Session = Depends(get_session)):
+def consulta_detalle(cid: int, request: Request, session: Session = Depends(get_read_session)):
     c = session.get(Consulta, cid)
     if not c: return RedirectResponse("/expediente", 303)
     p = session.get(Patient, c.patient_id)
@@ -205,34 +327,9 @@ def consulta_detalle(cid: int, request: Request, session: Session = Depends(get_
     except Exception:
         detalle = {}
     
-    # Receta asociada por consulta_id (preferente), fallback por día
-    hist = session.exec(
-        select(RecetaHistory)
-        .where(RecetaHistory.consulta_id == cid)
-        .order_by(RecetaHistory.fecha.desc())
-    ).first()
-    if not hist:
-        # Fallback: recetas del mismo día para compatibilidad histórica
-        dia_ini = c.fecha.replace(hour=0, minute=0, second=0, microsecond=0)
-        dia_fin = c.fecha.replace(hour=23, minute=59, second=59, microsecond=999999)
-        hist = session.exec(
-            select(RecetaHistory)
-            .where(
-                (RecetaHistory.patient_id == c.patient_id) &
-                (RecetaHistory.fecha >= dia_ini) &
-                (RecetaHistory.fecha <= dia_fin)
-            )
-            .order_by(RecetaHistory.fecha.desc())
-        ).first()
-    # if fallback found a recipe with no consulta_id, link it now
-    if hist and getattr(hist, 'consulta_id', None) in (None, 0):
-        try:
-            hist.consulta_id = cid
-            session.add(hist)
-            session.commit()
-        except Exception:
-            session.rollback()
-            pass
+    # Receta asociada por consulta_id (las recetas del mismo día sin consulta
+    # las enlaza app/reconciliacion.py, ya no este GET)
+    hist = session.exec(sentencias.receta_de_consulta(cid)).first()
     if hist:
         try:
             items = json.loads(hist.items_json or "[]")
@@ -267,24 +364,30 @@ def cita_guardar(
     patient_id: int = Form(...),
     fecha: str = Form(...),
     notas: str = Form(None),
+    duracion_min: int = Form(None),
+    forzar: bool = Form(False),
     session: Session = Depends(get_session)
 ):
     try:
         dt = datetime.fromisoformat(fecha)
     except Exception:
         return JSONResponse({"ok": False, "error": "Fecha inválida"}, status_code=400)
-    session.add(Appointment(patient_id=patient_id, fecha=dt, notas=notas or ""))
+    try:
+        duracion_min = agenda.duracion_de(duracion_min)
+    except ValueError as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+    ap, choques = agenda.agendar(session, patient_id, dt, duracion_min, notas, forzar)
+    if ap is None:
+        return JSONResponse(agenda.respuesta_empalme(session, dt, duracion_min, choques), status_code=409)
     session.commit()
-    return JSONResponse({"ok": True})
+    return JSONResponse({"ok": True, "empalme": bool(choques)})
 
 # --------- Recetas (form, preview, imprimir, PDF calibrado) ---------
 @app.get("/receta/nueva/{pid}", response_class=HTMLResponse)
-def receta_form(pid: int, request: Request, session: Session = Depends(get_session)):
+def receta_form(pid: int, request: Request, session: Session = Depends(get_read_session)):
     paciente = session.get(Patient, pid)
-    ajustes = session.exec(select(Ajustes)).first()
+    ajustes = ajustes_cache.get(session)
     consulta_id = request.query_params.get("consulta_id") if hasattr(request, "query_params") else None
-    meds = session.exec(select(Medicine).order_by(Medicine.created_at.desc())).all()
-    dosif = session.exec(select(Dosificacion).order_by(Dosificacion.created_at.desc())).all()
     RECOMS = [
         "Usar Cabestrillo 24hr",
         "Faja con soporte lumbar 24hr",
@@ -295,7 +398,7 @@ def receta_form(pid: int, request: Request, session: Session = Depends(get_sessi
         "Dormir de lado posición fetal con una almohada entre las piernas",
     ]
     return render("receta_form.html", request=request, p=paciente, ajustes=ajustes, hoy=datetime.now(), consulta_id=consulta_id,
-                  med_sugeridos=meds, dosif_sugeridas=dosif, recoms=RECOMS)
+                  recoms=RECOMS)
 
 @app.post("/receta/preview", response_class=HTMLResponse)
 def receta_preview(
@@ -308,7 +411,7 @@ def receta_preview(
     session: Session = Depends(get_session)
 ):
     paciente = session.get(Patient, patient_id)
-    ajustes = session.exec(select(Ajustes)).first()
+    ajustes = ajustes_cache.get(session)
     items = []
     import json as _json
     try:
@@ -332,22 +435,15 @@ def receta_imprimir(
     session: Session = Depends(get_session)
 ):
     paciente = session.get(Patient, patient_id)
-    ajustes = session.exec(select(Ajustes)).first()
+    ajustes = ajustes_cache.get(session)
     items = []
     import json as _json
     try:
         raw = _json.loads(items_json) if items_json else []
-        for r in raw:
-            if r.get("nombre") and r.get("indicacion"):
-                items.append(RecetaItem(nombre=r["nombre"], indicacion=r["indicacion"]))
-                # aprender catálogos
-                nombre = r["nombre"].strip()
-                if nombre and not session.exec(select(Medicine).where(Medicine.nombre==nombre)).first():
-                    session.add(Medicine(nombre=nombre))
-                indic = r["indicacion"].strip()
-                for linea in [x.strip() for x in indic.split('\n') if x.strip()]:
-                    if not session.exec(select(Dosificacion).where(Dosificacion.texto==linea)).first():
-                        session.add(Dosificacion(texto=linea))
+        validos = [r for r in raw if r.get("nombre") and r.get("indicacion")]
+        items = [RecetaItem(nombre=r["nombre"], indicacion=r["indicacion"]) for r in validos]
+        # aprender catálogos (un upsert por tabla)
+        catalogo.aprender(session, validos)
         session.commit()
     except Exception:
         items = []
@@ -355,13 +451,54 @@ def receta_imprimir(
                   recomendaciones=recomendaciones, proxima_cita=proxima_cita)
 
 
-# PDF calibrado (según ajuste final aceptado: Y=26.7 cm)
-from reportlab.pdfgen import canvas as _cv
-from reportlab.lib.pagesizes import letter as _letter
-from reportlab.lib.units import cm as _cm_unit
+# PDF calibrado (según ajuste final aceptado: Y=26.7 cm) — dibujo en app/pdf.py
+def _fecha_receta(fecha: str):
+    # (datetime, fecha YYYY-MM-DD): la misma fecha se guarda en el historial, entra
+    # en las claves y se imprime, así que /receta/pdf y /receta/historial/{id}/pdf
+    # dan el mismo PDF y el mismo ETag
+    fecha = (fecha or "").strip()
+    fdt = None
+    for fmt in ("%d/%m/%Y", "%d-%m-%Y"):
+        try:
+            fdt = datetime.strptime(fecha, fmt)
+        except ValueError:
+            pass
+    if fdt is None:
+        try:
+            fdt = datetime.fromisoformat(fecha)
+        except ValueError:
+            fdt = datetime.now()
+    return fdt, fdt.date().isoformat()
+
+def _respuesta_pdf(request: Request, pdf_bytes: bytes | None, etag: str, hist_id: int | None):
+    headers = {
+        "Content-Disposition": 'inline; filename="receta_calibrada.pdf"',
+        "ETag": f'"{etag}"',
+        "Cache-Control": "private, no-cache",
+    }
+    if hist_id:
+        headers["X-Receta-Id"] = str(hist_id)
+        headers["Content-Location"] = f"/receta/historial/{hist_id}/pdf"
+    if pdf_bytes is None:
+        return Response(status_code=304, headers=headers)
+    return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
+
+def _pdf_en_cache(etag: str, nombre_paciente, fecha, items, recomendaciones, proxima_cita) -> bytes:
+    pdf_bytes = pdf_cache.get(etag)
+    if pdf_bytes is None:
+        t0 = time.perf_counter()
+        pdf_bytes = pdf.render_receta(nombre_paciente, fecha, items, recomendaciones, proxima_cita)
+        metricas.observar_pdf(time.perf_counter() - t0)
+        pdf_cache.put(etag, pdf_bytes)
+    return pdf_bytes
+
+def _etag_coincide(request: Request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match") or ""
+    return f'"{etag}"' in inm or inm.strip() == "*"
 
 @app.post("/receta/pdf")
 def receta_pdf(
+    request: Request,
     patient_id: int = Form(...),
     consulta_id: Optional[int] = Form(None),
     fecha: str = Form(...),
@@ -370,117 +507,75 @@ def receta_pdf(
     proxima_cita: Optional[str] = Form(None),
     session: Session = Depends(get_session),
 ):
-    from io import BytesIO
     import json as _json
-    buf = BytesIO()
-    c = _cv.Canvas(buf, pagesize=_letter)
-    width, height = _letter
-
-    def _cm(n: float) -> float:
-        return n * _cm_unit
-
-    c.setFont("Helvetica", 9)
-
-    # Desplazar todo 1 renglón hacia abajo
-    y_shift = 12
 
     # Datos paciente
     p = session.get(Patient, patient_id)
     nombre_paciente = p.nombre if p else "Paciente"
 
-    # Coordenadas calibradas
-    x_nombre = _cm(2.5)
-    x_fecha = _cm(11.5)
-    y_base = _cm(26.7)
-
-    c.drawString(x_nombre, y_base - y_shift, nombre_paciente)
-    c.drawString(x_fecha, y_base - y_shift, fecha)
-
     # Items
     try:
         items = _json.loads(items_json) if items_json else []
     except Exception:
         items = []
-    # AUTOGUARDAR_CATALOGO_PDF
-    try:
-        for it in (items or []):
-            nombre = (it.get("nombre") or "").strip()
-            indic = (it.get("indicacion") or "").strip()
-            if nombre and not session.exec(select(Medicine).where(Medicine.nombre==nombre)).first():
-                session.add(Medicine(nombre=nombre))
-            if indic:
-                for linea in [x.strip() for x in indic.split('\n') if x.strip()]:
-                    if not session.exec(select(Dosificacion).where(Dosificacion.texto==linea)).first():
-                        session.add(Dosificacion(texto=linea))
-        session.commit()
-    except Exception:
-        pass
-
-
-    x_left = _cm(1.5)
-    sangria = _cm(1)
-    y = (y_base - y_shift) - _cm(0.8) - _cm(0.5)  # 2 renglones + extra y 1 renglón abajo
-    for it in items:
-        nombre = (it.get("nombre") or "").strip()
-        indic = (it.get("indicacion") or "").strip()
-        dosis = ""
-        forma = ""
-        if indic:
-            lines = [l.strip() for l in indic.split("\n") if l.strip()] if isinstance(indic, str) else []
-            if lines:
-                dosis = lines[0]
-                forma = "\n".join(lines[1:])
-        linea1 = nombre if nombre else ""
-        if dosis:
-            linea1 = f"{linea1} — {dosis}" if linea1 else dosis
-        c.drawString(x_left, y, linea1); y -= 12
-        if forma:
-            for sub in forma.split("\n"):
-                c.drawString(x_left + sangria, y, sub); y -= 12
-        y -= 14  # espacio entre medicamentos
-
-    # 3 renglones antes de recomendaciones
-    y -= 27
-    if (recomendaciones or "").strip():
-        c.drawString(x_left, y, "Recomendaciones:"); y -= 12
-        for line in (recomendaciones or "").split("\n"):
-            t = line.strip()
-            if not t: continue
-            t_fmt = f"- {t}" if not t.startswith("-") else t
-            c.drawString(x_left + sangria, y, t_fmt); y -= 12
-
-    # 1 renglón antes de próxima cita
-    y -= 9
-    if (proxima_cita or "").strip():
-        c.drawString(x_left, y, f"Próxima cita: {proxima_cita}"); y -= 12
-
-    c.showPage(); c.save()
-    pdf = buf.getvalue(); buf.close()
-
-    # Guardar historial de receta (igual que en imprimir)
-    from datetime import datetime as _dt
-    try:
-        fdt = _dt.fromisoformat(fecha)
-    except Exception:
-        fdt = _dt.now()
+    items = pdf.items_normalizados(items)
+
+    fdt, fecha_norm = _fecha_receta(fecha)
+    clave = pdf.clave_contenido(patient_id, fecha_norm, items, recomendaciones, proxima_cita)
+    etag = pdf.clave_pdf(clave, nombre_paciente, fecha_norm)
+
+    # Reimpresión: la misma receta ya está en el historial, no se duplica
+    hist = session.exec(sentencias.receta_por_contenido(clave, patient_id)).first()
+    if not hist:
+        # AUTOGUARDAR_CATALOGO_PDF
+        try:
+            catalogo.aprender(session, items)
+            session.commit()
+        except Exception:
+            session.rollback()
+
+        # Guardar historial de receta (igual que en imprimir)
         # infer consulta_id if missing (link receta to consulta del mismo día)
-    try:
-        if not consulta_id:
-            dia_ini = fdt.replace(hour=0, minute=0, second=0, microsecond=0)
-            dia_fin = fdt.replace(hour=23, minute=59, second=59, microsecond=999999)
-            _c = session.exec(
-                select(Consulta)
-                .where((Consulta.patient_id==patient_id) & (Consulta.fecha>=dia_ini) & (Consulta.fecha<=dia_fin))
-                .order_by(Consulta.fecha.desc())
-            ).first()
-            if _c:
-                consulta_id = _c.id
-    except Exception:
-        pass
+        try:
+            if not consulta_id:
+                dia_ini = fdt.replace(hour=0, minute=0, second=0, microsecond=0)
+                dia_fin = fdt.replace(hour=23, minute=59, second=59, microsecond=999999)
+                _c = session.exec(sentencias.consulta_del_dia(patient_id, dia_ini, dia_fin)).first()
+                if _c:
+                    consulta_id = _c.id
+        except Exception:
+            pass
 
-    hist = RecetaHistory(patient_id=patient_id, consulta_id=consulta_id, fecha=fdt,
-                         items_json=items_json, recomendaciones=recomendaciones, proxima_cita=proxima_cita)
-    session.add(hist); session.commit()
+        hist = RecetaHistory(patient_id=patient_id, consulta_id=consulta_id, fecha=fdt, contenido_hash=clave,
+                             items_json=items_json, recomendaciones=recomendaciones, proxima_cita=proxima_cita)
+        session.add(hist); session.flush()
+        recetas_items.sincronizar(session, hist, items)
+        session.commit()
+
+    if _etag_coincide(request, etag):
+        return _respuesta_pdf(request, None, etag, hist.id)
+    pdf_bytes = _pdf_en_cache(etag, nombre_paciente, fecha_norm, items, recomendaciones, proxima_cita)
+    return _respuesta_pdf(request, pdf_bytes, etag, hist.id)
 
-    headers = {"Content-Disposition": 'inline; filename="receta_calibrada.pdf"'}
-    return Response(content=pdf, media_type="application/pdf", headers=headers)
\ No newline at end of file
+# URL estable para volver a descargar una receta guardada sin reenviar el formulario
+@app.get("/receta/historial/{hid}/pdf")
+def receta_historial_pdf(hid: int, request: Request, session: Session = Depends(get_read_session)):
+    import json as _json
+    hist = session.get(RecetaHistory, hid)
+    if not hist:
+        return JSONResponse({"ok": False, "error": "Receta no encontrada"}, status_code=404)
+    p = session.get(Patient, hist.patient_id)
+    nombre_paciente = p.nombre if p else "Paciente"
+    try:
+        items = pdf.items_normalizados(_json.loads(hist.items_json or "[]"))
+    except Exception:
+        items = []
+    _, fecha = _fecha_receta(hist.fecha.isoformat())
+    clave = hist.contenido_hash or pdf.clave_contenido(hist.patient_id, fecha, items, hist.recomendaciones, hist.proxima_cita)
+    etag = pdf.clave_pdf(clave, nombre_paciente, fecha)
+    if _etag_coincide(request, etag):
+        return _respuesta_pdf(request, None, etag, hist.id)
+    pdf_bytes = _pdf_en_cache(etag, nombre_paciente, fecha, items, hist.recomendaciones, hist.proxima_cita)
+    return _respuesta_pdf(request, pdf_bytes, etag, hist.id)
+
+arranque.importacion_terminada()
@@ -0,0 +1,206 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from sqlalchemy import event
+
+# Instrumentación por petición: latencia por ruta, número y tiempo de SQL,
+# tiempo de dibujo de PDF y de plantillas, expuestos en /metrics (texto de
+# Prometheus). Los contadores son por proceso: con varios workers, cada uno
+# reporta los suyos (Prometheus los suma por instancia).
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Cabecera X-Query-Count en cada respuesta (por defecto sólo fuera de producción)
+QUERY_HEADER = os.getenv("METRICS_QUERY_HEADER", "0" if os.getenv("APP_ENV", "production") == "production" else "1") == "1"
+
+BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_SQL = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+INF = 'le="+Inf"'
+
+log_lento = logging.getLogger("app.sql.lento")
+
+# Estadísticas de la petición en curso; el dict es mutable para que los hilos
+# del threadpool (que copian el contexto) sumen sobre el mismo objeto.
+_peticion = contextvars.ContextVar("metricas_peticion", default=None)
+
+
+class Histograma:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._series = {}  # etiquetas -> [conteos por bucket..., suma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, etiquetas=()):
+        with self._lock:
+            st = self._series.get(etiquetas)
+            if st is None:
+                st = self._series[etiquetas] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if valor <= b:
+                    st[i] += 1
+                    break
+            st[-2] += valor
+            st[-1] += 1
+
+    def series(self):
+        with self._lock:
+            return {k: list(v) for k, v in self._series.items()}
+
+
+latencia = Histograma(BUCKETS_S)          # (método, ruta, estado)
+sql_por_peticion = Histograma(BUCKETS_SQL)  # (método, ruta)
+sql_tiempo = Histograma(BUCKETS_S)          # (método, ruta): segundos de SQL por petición
+pdf_render = Histograma(BUCKETS_S)          # (tipo,)
+_sql_total = [0, 0.0, 0]  # sentencias, segundos, lentas
+_lock = threading.Lock()
+
+
+def observar_pdf(segundos: float, tipo: str = "receta"):
+    pdf_render.observar(segundos, (tipo,))
+
+
+# --------- SQL ---------
+def instrumentar(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metricas_t0", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _despues(conn, cursor, statement, parameters, context, executemany):
+        pila = conn.info.get("metricas_t0")
+        if not pila:
+            return
+        dt = time.perf_counter() - pila.pop()
+        lenta = dt * 1000 >= SLOW_QUERY_MS
+        with _lock:
+            _sql_total[0] += 1
+            _sql_total[1] += dt
+            _sql_total[2] += lenta
+        st = _peticion.get()
+        if st is not None:
+            st["consultas"] += 1
+            st["sql_s"] += dt
+        if lenta:
+            log_lento.warning("SQL lenta (%.1f ms)%s: %s", dt * 1000,
+                              f" en {st['ruta']}" if st else "", " ".join(statement.split())[:500])
+
+
+# --------- Middleware ASGI ---------
+class MetricasMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        st = {"consultas": 0, "sql_s": 0.0, "ruta": scope.get("path", "")}
+        token = _peticion.set(st)
+        estado = [500]
+        t0 = time.perf_counter()
+
+        async def _send(msg):
+            if msg["type"] == "http.response.start":
+                estado[0] = msg["status"]
+                if QUERY_HEADER:
+                    msg["headers"] = list(msg.get("headers", [])) + [
+                        (b"x-query-count", str(st["consultas"]).encode()),
+                        (b"x-sql-ms", f"{st['sql_s'] * 1000:.1f}".encode()),
+                    ]
+            await send(msg)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            dt = time.perf_counter() - t0
+            _peticion.reset(token)
+            # Plantilla de la ruta (/paciente/{pid}) para no crear una serie por id
+            route = scope.get("route")
+            ruta = getattr(route, "path", None) or ("/static" if scope.get("path", "").startswith("/static") else "otra")
+            metodo = scope.get("method", "")
+            latencia.observar(dt, (metodo, ruta, str(estado[0])))
+            sql_por_peticion.observar(st["consultas"], (metodo, ruta))
+            sql_tiempo.observar(st["sql_s"], (metodo, ruta))
+
+
+# --------- Exposición ---------
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(nombres, valores, extra=None):
+    partes = [f'{n}="{_esc(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _histograma(lineas, nombre, ayuda, h, nombres):
+    lineas.append(f"# HELP {nombre} {ayuda}")
+    lineas.append(f"# TYPE {nombre} histogram")
+    les = [f'le="{b}"' for b in h.buckets]
+    for valores, st in sorted(h.series().items()):
+        acumulado = 0
+        for le, n in zip(les, st[:len(h.buckets)]):
+            acumulado += n
+            lineas.append(f"{nombre}_bucket{_etiquetas(nombres, valores, le)} {acumulado}")
+        # +Inf incluye lo que excede el último bucket: siempre igual a _count
+        lineas.append(f"{nombre}_bucket{_etiquetas(nombres, valores, INF)} {st[-1]}")
+        lineas.append(f"{nombre}_sum{_etiquetas(nombres, valores)} {st[-2]:.6f}")
+        lineas.append(f"{nombre}_count{_etiquetas(nombres, valores)} {st[-1]}")
+
+
+def exposicion(tiempos_plantillas=None, arranque=None, clinicas=None, respaldos=None) -> str:
+    lineas = []
+    _histograma(lineas, "http_request_duration_seconds", "Latencia por ruta", latencia, ("method", "route", "status"))
+    _histograma(lineas, "http_request_sql_queries", "Sentencias SQL por petición", sql_por_peticion, ("method", "route"))
+    _histograma(lineas, "http_request_sql_seconds", "Tiempo de SQL por petición", sql_tiempo, ("method", "route"))
+    _histograma(lineas, "pdf_render_seconds", "Tiempo de dibujo de PDF", pdf_render, ("tipo",))
+    with _lock:
+        n, seg, lentas = _sql_total
+    lineas += [
+        "# HELP sql_statements_total Sentencias SQL ejecutadas", "# TYPE sql_statements_total counter",
+        f"sql_statements_total {n}",
+        "# HELP sql_seconds_total Tiempo total en SQL", "# TYPE sql_seconds_total counter",
+        f"sql_seconds_total {seg:.6f}",
+        f"# HELP sql_slow_statements_total Sentencias de más de {SLOW_QUERY_MS:g} ms", "# TYPE sql_slow_statements_total counter",
+        f"sql_slow_statements_total {lentas}",
+    ]
+    if tiempos_plantillas:
+        # plantillas.totales(): nombre -> (renders, segundos)
+        lineas += ["# HELP template_render_seconds Tiempo de render por plantilla", "# TYPE template_render_seconds summary"]
+        for nombre, (renders, segundos) in sorted(tiempos_plantillas.items()):
+            lineas.append(f"template_render_seconds_sum{_etiquetas(('template',), (nombre,))} {segundos:.6f}")
+            lineas.append(f"template_render_seconds_count{_etiquetas(('template',), (nombre,))} {renders}")
+    if arranque:
+        # app.arranque.reporte(): fases del arranque del proceso
+        lineas += ["# HELP app_startup_phase_seconds Duración de cada fase del arranque", "# TYPE app_startup_phase_seconds gauge"]
+        for tipo in ("fases_ms", "segundo_plano_ms"):
+            for nombre, ms in arranque.get(tipo, {}).items():
+                lineas.append(f"app_startup_phase_seconds{_etiquetas(('fase', 'fondo'), (nombre, int(tipo != 'fases_ms')))} {ms / 1000:.4f}")
+        if arranque.get("listo_ms") is not None:
+            lineas += ["# HELP app_startup_seconds Tiempo hasta aceptar peticiones", "# TYPE app_startup_seconds gauge",
+                       f"app_startup_seconds {arranque['listo_ms'] / 1000:.4f}"]
+    if clinicas:
+        # app.clinicas.pool.reporte(): engines abiertos y peticiones por clínica
+        lineas += ["# HELP clinic_engines_open Clínicas con engines abiertos en este worker", "# TYPE clinic_engines_open gauge",
+                   f"clinic_engines_open {len(clinicas['abiertas'])}",
+                   "# HELP clinic_engine_evictions_total Clínicas cerradas por inactividad o por el límite", "# TYPE clinic_engine_evictions_total counter",
+                   f"clinic_engine_evictions_total {clinicas['cierres']}",
+                   "# HELP clinic_requests_total Peticiones por clínica", "# TYPE clinic_requests_total counter"]
+        for nombre, n in sorted(clinicas["peticiones"].items()):
+            lineas.append(f"clinic_requests_total{_etiquetas(('clinica',), (nombre,))} {n}")
+    if respaldos:
+        # app.respaldos.estados(): último respaldo de cada base en este worker
+        series = (("backup_running", "gauge", "Respaldo en curso", lambda st: int(st["estado"] in ("copiando", "verificando", "comprimiendo"))),
+                  ("backup_last_duration_seconds", "gauge", "Duración del último respaldo", lambda st: st["duracion_s"]),
+                  ("backup_last_copy_seconds", "gauge", "Tiempo de copia por pasos del último respaldo", lambda st: st["copia_s"]),
+                  ("backup_last_steps", "gauge", "Pasos de copia del último respaldo", lambda st: st["pasos"]),
+                  ("backup_last_size_bytes", "gauge", "Tamaño comprimido del último respaldo", lambda st: st["bytes"]),
+                  ("backup_last_success_timestamp_seconds", "gauge", "Hora del último respaldo verificado", lambda st: st["ultimo_ok"]),
+                  ("backup_failures_total", "counter", "Respaldos fallidos", lambda st: st["fallos"]))
+        for nombre, tipo, ayuda, valor in series:
+            lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"]
+            for base, st in sorted(respaldos.items()):
+                if valor(st) is not None:
+                    lineas.append(f"{nombre}{_etiquetas(('db',), (base,))} {valor(st)}")
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,339 @@
+import re
+import sys
+from sqlalchemy import text
+from sqlmodel import SQLModel
+
+from app import busqueda
+from app.models import CacheVersion, CalendarioDia, ConsultaVitales, PacienteClave, PacienteFusion, RecetaHistoryItem
+from app.texto import fold
+
+# Migraciones versionadas. La versión aplicada se guarda en PRAGMA user_version
+# del propio archivo SQLite; cada migración corre en su propia transacción y
+# sube la versión al terminar. Las tablas nuevas las crea create_all() antes de
+# migrar, así que aquí sólo van índices, columnas nuevas en tablas existentes y
+# rellenos de datos; todo debe ser idempotente.
+
+
+def _m001_indice_busqueda(conn):
+    busqueda.ensure_index(conn)
+
+
+def _m002_indices_calientes(conn):
+    for ddl in (
+        "CREATE INDEX IF NOT EXISTS ix_consulta_patient_fecha ON consulta (patient_id, fecha)",
+        "CREATE INDEX IF NOT EXISTS ix_consulta_fecha ON consulta (fecha)",
+        "CREATE INDEX IF NOT EXISTS ix_appointment_fecha ON appointment (fecha)",
+        "CREATE INDEX IF NOT EXISTS ix_appointment_patient_fecha ON appointment (patient_id, fecha)",
+        "CREATE INDEX IF NOT EXISTS ix_recetahistory_consulta_fecha ON recetahistory (consulta_id, fecha)",
+        "CREATE INDEX IF NOT EXISTS ix_recetahistory_patient_fecha ON recetahistory (patient_id, fecha)",
+        "CREATE INDEX IF NOT EXISTS ix_recetahistory_fecha ON recetahistory (fecha)",
+        "CREATE INDEX IF NOT EXISTS ix_patientextra_patient ON patientextra (patient_id)",
+        "CREATE INDEX IF NOT EXISTS ix_patient_created ON patient (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_medicine_nombre ON medicine (nombre)",
+        "CREATE INDEX IF NOT EXISTS ix_dosificacion_texto ON dosificacion (texto)",
+    ):
+        conn.execute(text(ddl))
+    conn.execute(text("ANALYZE"))
+
+
+def _m003_sellos_cache(conn):
+    SQLModel.metadata.create_all(conn, tables=[CacheVersion.__table__])
+
+
+def _columnas(conn, tabla):
+    return {r[1] for r in conn.execute(text(f"PRAGMA table_info({tabla})"))}
+
+
+def _agregar_columna(conn, tabla, columna, ddl):
+    if columna not in _columnas(conn, tabla):
+        conn.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {columna} {ddl}"))
+
+
+def _normalizar_catalogo(conn, tabla, col_texto, col_norm):
+    # Rellena el texto normalizado y fusiona duplicados (se queda el id menor)
+    _agregar_columna(conn, tabla, col_norm, "VARCHAR")
+    _agregar_columna(conn, tabla, "usos", "INTEGER NOT NULL DEFAULT 0")
+    _agregar_columna(conn, tabla, "ultimo_uso", "DATETIME")
+    grupos = {}
+    for rid, txt, usos in conn.execute(text(f"SELECT id, {col_texto}, usos FROM {tabla} ORDER BY id")):
+        grupos.setdefault(fold(txt), []).append((rid, usos or 0))
+    for norm, filas in grupos.items():
+        keep = filas[0][0]
+        usos = sum(max(u, 1) for _, u in filas)
+        conn.execute(text(f"UPDATE {tabla} SET {col_norm} = :n, usos = :u WHERE id = :id"),
+                     {"n": norm or None, "u": usos, "id": keep})
+        sobran = [rid for rid, _ in filas[1:]]
+        if sobran:
+            conn.execute(text(f"DELETE FROM {tabla} WHERE id IN ({', '.join(str(i) for i in sobran)})"))
+    conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{tabla}_{col_norm} ON {tabla} ({col_norm})"))
+
+
+def _m004_catalogos_unicos(conn):
+    _normalizar_catalogo(conn, "medicine", "nombre", "nombre_norm")
+    _normalizar_catalogo(conn, "dosificacion", "texto", "texto_norm")
+
+
+def _m005_hash_recetas(conn):
+    import json
+    from app import pdf
+    _agregar_columna(conn, "recetahistory", "contenido_hash", "VARCHAR")
+    ultimo = 0
+    while True:
+        filas = conn.execute(text(
+            "SELECT id, patient_id, fecha, items_json, recomendaciones, proxima_cita FROM recetahistory "
+            "WHERE id > :u AND contenido_hash IS NULL ORDER BY id LIMIT 500"), {"u": ultimo}).all()
+        if not filas:
+            break
+        for rid, pid, fecha, items_json, rec, prox in filas:
+            try:
+                items = json.loads(items_json or "[]")
+            except Exception:
+                items = []
+            clave = pdf.clave_contenido(pid, str(fecha)[:10], items, rec, prox)
+            conn.execute(text("UPDATE recetahistory SET contenido_hash = :h WHERE id = :id"), {"h": clave, "id": rid})
+        ultimo = filas[-1][0]
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recetahistory_hash ON recetahistory (contenido_hash)"))
+
+
+def _m006_vitales_y_diagnosticos(conn):
+    # Relleno único: se abre el JSON de cada consulta una sola vez
+    import json
+    from app import vitales
+    SQLModel.metadata.create_all(conn, tables=[ConsultaVitales.__table__])
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_consultavitales_patient_fecha ON consultavitales (patient_id, fecha)"))
+    ultimo = 0
+    while True:
+        filas = conn.execute(text(
+            "SELECT id, patient_id, fecha, notas FROM consulta WHERE id > :u ORDER BY id LIMIT 500"), {"u": ultimo}).all()
+        if not filas:
+            break
+        lote = []
+        for cid, pid, fecha, notas in filas:
+            try:
+                detalle = json.loads(notas or "{}")
+            except Exception:
+                detalle = {}
+            if isinstance(detalle, dict) and isinstance(detalle.get("vitales"), dict):
+                lote.append({"consulta_id": cid, "patient_id": pid, "fecha": fecha, **vitales.parsear(detalle["vitales"])})
+        if lote:
+            cols = list(lote[0].keys())
+            conn.execute(text(
+                f"INSERT OR REPLACE INTO consultavitales ({', '.join(cols)}) VALUES ({', '.join(':' + c for c in cols)})"
+            ), lote)
+        ultimo = filas[-1][0]
+    busqueda.rebuild_dx(conn)
+
+
+def _m007_renglones_receta(conn):
+    from types import SimpleNamespace
+    from app import recetas_items
+    SQLModel.metadata.create_all(conn, tables=[RecetaHistoryItem.__table__])
+    for ddl in (
+        "CREATE INDEX IF NOT EXISTS ix_recetahistoryitem_receta ON recetahistoryitem (receta_id)",
+        "CREATE INDEX IF NOT EXISTS ix_recetahistoryitem_fecha_med ON recetahistoryitem (fecha, medicamento_norm, patient_id)",
+        "CREATE INDEX IF NOT EXISTS ix_recetahistoryitem_med_paciente ON recetahistoryitem (medicamento_norm, patient_id, fecha)",
+    ):
+        conn.execute(text(ddl))
+    conn.execute(text("DELETE FROM recetahistoryitem"))
+    ultimo = 0
+    while True:
+        filas = conn.execute(text(
+            "SELECT id, patient_id, fecha, items_json FROM recetahistory WHERE id > :u ORDER BY id LIMIT 500"), {"u": ultimo}).all()
+        if not filas:
+            break
+        lote = []
+        for rid, pid, fecha, items_json in filas:
+            hist = SimpleNamespace(id=rid, patient_id=pid, fecha=fecha, items_json=items_json)
+            lote.extend(recetas_items.filas(hist))
+        if lote:
+            cols = list(lote[0].keys())
+            conn.execute(text(
+                f"INSERT INTO recetahistoryitem ({', '.join(cols)}) VALUES ({', '.join(':' + c for c in cols)})"
+            ), lote)
+        ultimo = filas[-1][0]
+
+
+def _m008_versiones_calendario(conn):
+    SQLModel.metadata.create_all(conn, tables=[CalendarioDia.__table__])
+
+
+def _m009_duracion_citas(conn):
+    _agregar_columna(conn, "appointment", "duracion_min", "INTEGER")
+
+
+def _m010_origen_importacion(conn):
+    # Clave de idempotencia de app/importar.py (NULL en los registros capturados a mano)
+    for tabla in ("patient", "appointment"):
+        _agregar_columna(conn, tabla, "origen_id", "VARCHAR")
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{tabla}_origen ON {tabla} (origen_id)"))
+
+
+def _m011_ajustes_iniciales(conn):
+    # Antes lo sembraba on_startup con una consulta en cada arranque
+    conn.execute(text(
+        "INSERT INTO ajustes (clinica_nombre, clinica_direccion, clinica_telefono, medico_nombre, cedula, cedula_especialista) "
+        "SELECT :nombre, :direccion, :telefono, :medico, :cedula, :especialista "
+        "WHERE NOT EXISTS (SELECT 1 FROM ajustes)"), {
+            "nombre": "CLINICA IMAGEN",
+            "direccion": "Tabasco 403, Valle de Aguayo, 87020 Cdad. Victoria, Tamps.",
+            "telefono": "8341779965",
+            "medico": "Dr. Jorge Alberto Rodríguez Martinez",
+            "cedula": "5439453",
+            "especialista": "1067241",
+        })
+
+
+def _m012_claves_duplicados(conn):
+    from app import duplicados
+    SQLModel.metadata.create_all(conn, tables=[PacienteClave.__table__, PacienteFusion.__table__])
+    for ddl in (
+        "CREATE INDEX IF NOT EXISTS ix_pacienteclave_clave ON pacienteclave (clave, patient_id)",
+        "CREATE INDEX IF NOT EXISTS ix_pacienteclave_patient ON pacienteclave (patient_id)",
+        "CREATE INDEX IF NOT EXISTS ix_pacientefusion_origen ON pacientefusion (origen_id)",
+        "CREATE INDEX IF NOT EXISTS ix_pacientefusion_conservado ON pacientefusion (conservado_id)",
+    ):
+        conn.execute(text(ddl))
+    duplicados.reconstruir(conn)
+
+
+def _m013_enlazar_recetas(conn):
+    # Enlace único de recetas huérfanas con su consulta del mismo día; antes se
+    # lanzaba en segundo plano en cada arranque (y en cada clínica al abrirla)
+    from app import reconciliacion
+    ultimo = 0
+    while True:
+        ids, _ = reconciliacion.enlazar_lote(conn, ultimo)
+        if not ids:
+            break
+        ultimo = ids[-1]
+
+
+MIGRACIONES = [
+    (1, "indice_busqueda_pacientes", _m001_indice_busqueda),
+    (2, "indices_claves_y_fechas", _m002_indices_calientes),
+    (3, "sellos_cache", _m003_sellos_cache),
+    (4, "catalogos_unicos_con_uso", _m004_catalogos_unicos),
+    (5, "hash_contenido_recetas", _m005_hash_recetas),
+    (6, "vitales_y_diagnosticos", _m006_vitales_y_diagnosticos),
+    (7, "renglones_de_receta", _m007_renglones_receta),
+    (8, "versiones_calendario", _m008_versiones_calendario),
+    (9, "duracion_citas", _m009_duracion_citas),
+    (10, "origen_importacion", _m010_origen_importacion),
+    (11, "ajustes_iniciales", _m011_ajustes_iniciales),
+    (12, "claves_duplicados", _m012_claves_duplicados),
+    (13, "enlazar_recetas_huerfanas", _m013_enlazar_recetas),
+]
+VERSION_ACTUAL = MIGRACIONES[-1][0]
+
+
+def version(conn) -> int:
+    return conn.execute(text("PRAGMA user_version")).scalar() or 0
+
+
+def migrar(engine):
+    # Aplica en orden las migraciones pendientes; devuelve las que se aplicaron
+    aplicadas = []
+    with engine.connect() as conn:
+        actual = version(conn)
+    for num, nombre, fn in MIGRACIONES:
+        if num <= actual:
+            continue
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(text(f"PRAGMA user_version = {int(num)}"))
+        aplicadas.append(f"{num:03d}_{nombre}")
+    return aplicadas
+
+
+def preparar_esquema(engine):
+    # Arranque: si la base ya está en VERSION_ACTUAL no se llama create_all ni
+    # se revisa ninguna migración (una sola lectura de PRAGMA user_version)
+    with engine.connect() as conn:
+        if version(conn) == VERSION_ACTUAL:
+            return []
+    SQLModel.metadata.create_all(engine)
+    return migrar(engine)
+
+
+# --------- Verificación de planes de consulta ---------
+# Las consultas de las rutas calientes salen de app.sentencias.calientes(): las
+# mismas sentencias y el mismo SQL que ejecutan los módulos. Ninguna debe
+# recorrer una tabla completa (SCAN sin índice), salvo tablas de menos de
+# MIN_FILAS_SCAN filas, donde SQLite (con estadísticas de ANALYZE) prefiere
+# recorrerlas y es lo correcto.
+MIN_FILAS_SCAN = 1000
+
+
+def _es_recorrido_completo(detalle: str) -> bool:
+    d = detalle.strip()
+    return d.startswith("SCAN ") and " USING " not in d and "VIRTUAL TABLE" not in d
+
+
+def _plan(conn, consulta):
+    # -> (SQL, filas de EXPLAIN QUERY PLAN) de una sentencia de SQLModel o de un par (SQL, parámetros)
+    if isinstance(consulta, tuple):
+        sql, params = consulta
+        return sql, conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).all()
+    compilada = consulta.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    # Para el plan sólo importa el tipo del valor (fechas como texto, como las guarda SQLite)
+    params = tuple(v if v is None or isinstance(v, (int, float, str)) else str(v)
+                   for v in (compilada.params[k] for k in compilada.positiontup))
+    return str(compilada), conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compilada), params).all()
+
+
+def _tabla_recorrida(conn, detalle: str, sql: str):
+    # Tabla de "SCAN <tabla o alias>"; None si es una subconsulta
+    nombre = detalle.split()[1]
+    tablas = {r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+    if nombre in tablas:
+        return nombre
+    m = re.search(rf"\b(\w+)\s+(?:AS\s+)?{re.escape(nombre)}\b", sql, re.IGNORECASE)
+    return m.group(1) if m and m.group(1) in tablas else None
+
+
+def verificar_planes(conn, consultas=None, min_filas: int = MIN_FILAS_SCAN):
+    # Devuelve [(nombre, detalle)] de cada consulta que hace un SCAN completo de una tabla grande
+    from app import sentencias
+
+    fallas = []
+    for nombre, consulta in (consultas or sentencias.calientes()).items():
+        sql, filas = _plan(conn, consulta)
+        for row in filas:
+            if not _es_recorrido_completo(row[-1]):
+                continue
+            # Subconsultas y tablas derivadas son resultados ya acotados, no tablas
+            tabla = _tabla_recorrida(conn, row[-1], sql)
+            if tabla is None or conn.execute(text(f'SELECT count(*) FROM (SELECT 1 FROM "{tabla}" LIMIT :n)'),
+                                      {"n": min_filas}).scalar() < min_filas:
+                continue
+            fallas.append((nombre, row[-1]))
+    return fallas
+
+
+def main(argv=None):
+    import argparse
+    from app.db import DATABASE_URL, make_engine
+    import app.models  # noqa: F401  (registra las tablas)
+
+    ap = argparse.ArgumentParser(description="Migraciones del esquema SQLite")
+    ap.add_argument("--db", default=DATABASE_URL)
+    ap.add_argument("--check", action="store_true", help="verifica con EXPLAIN QUERY PLAN que no haya SCAN completos")
+    args = ap.parse_args(argv)
+
+    engine = make_engine(args.db)
+    SQLModel.metadata.create_all(engine)
+    for m in migrar(engine):
+        print(f"aplicada {m}")
+    with engine.connect() as conn:
+        print(f"versión del esquema: {version(conn)}")
+        if not args.check:
+            return 0
+        fallas = verificar_planes(conn)
+    for nombre, detalle in fallas:
+        print(f"SCAN completo en [{nombre}]: {detalle}")
+    print("planes OK" if not fallas else f"{len(fallas)} consulta(s) sin índice")
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
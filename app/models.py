@@ -14,6 +14,7 @@ class PatientBase(SQLModel):
 class Patient(PatientBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    origen_id: Optional[str] = None  # id en el sistema de origen (único, ver app/importar.py)
     consultas: List["Consulta"] = Relationship(back_populates="patient")
 
 class PatientExtra(SQLModel, table=True):
@@ -35,6 +36,19 @@ class Consulta(ConsultaBase, table=True):
     patient_id: int = Field(foreign_key="patient.id")
     patient: "Patient" = Relationship(back_populates="consultas")
 
+class ConsultaVitales(SQLModel, table=True):
+    # Signos vitales tipados de cada consulta (antes sólo dentro de Consulta.notas)
+    consulta_id: int = Field(foreign_key="consulta.id", primary_key=True)
+    patient_id: int = Field(foreign_key="patient.id")
+    fecha: datetime
+    ta_sistolica: Optional[int] = None
+    ta_diastolica: Optional[int] = None
+    fc: Optional[int] = None
+    fr: Optional[int] = None
+    peso_kg: Optional[float] = None
+    talla_m: Optional[float] = None
+    imc: Optional[float] = None
+
 class RecetaItem(SQLModel):
     nombre: str
     indicacion: str
@@ -43,17 +57,25 @@ class Medicine(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     nombre: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    nombre_norm: Optional[str] = None  # único (ux_medicine_nombre_norm), ver app/catalogo.py
+    usos: int = 0
+    ultimo_uso: Optional[datetime] = None
 
 class Dosificacion(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     texto: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    texto_norm: Optional[str] = None  # único (ux_dosificacion_texto_norm)
+    usos: int = 0
+    ultimo_uso: Optional[datetime] = None
 
 class Appointment(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     patient_id: int = Field(foreign_key="patient.id")
     fecha: datetime
     notas: Optional[str] = None
+    duracion_min: Optional[int] = None
+    origen_id: Optional[str] = None  # id en el sistema de origen (único)
 
 class Ajustes(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -73,3 +95,45 @@ class RecetaHistory(SQLModel, table=True):
     items_json: str  # JSON con [{'nombre','indicacion'}]
     recomendaciones: Optional[str] = None
     proxima_cita: Optional[str] = None
+    contenido_hash: Optional[str] = None  # app.pdf.clave_contenido, evita duplicar reimpresiones
+
+
+class CacheVersion(SQLModel, table=True):
+    # Sello de versión por clave ("ajustes", ...) para invalidar cachés en memoria entre workers
+    clave: str = Field(primary_key=True)
+    version: int = 0
+
+
+class RecetaHistoryItem(SQLModel, table=True):
+    # Un renglón por medicamento de cada RecetaHistory (copia normalizada de items_json)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    receta_id: int = Field(foreign_key="recetahistory.id")
+    patient_id: int = Field(foreign_key="patient.id")
+    fecha: datetime
+    posicion: int = 0
+    medicamento: str
+    medicamento_norm: str
+    dosis: Optional[str] = None
+    indicaciones: Optional[str] = None
+
+
+class CalendarioDia(SQLModel, table=True):
+    # Contador de cambios por día de agenda ('YYYY-MM-DD'); da el ETag de /api/calendar
+    dia: str = Field(primary_key=True)
+    version: int = 0
+    modificado: datetime = Field(default_factory=datetime.utcnow)
+
+
+class PacienteClave(SQLModel, table=True):
+    # Claves de bloqueo para detectar expedientes duplicados (ver app/duplicados.py)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    patient_id: int = Field(foreign_key="patient.id")
+    clave: str
+
+
+class PacienteFusion(SQLModel, table=True):
+    # Expedientes fusionados: /paciente/{duplicado_id} redirige al conservado
+    duplicado_id: int = Field(primary_key=True)
+    conservado_id: int = Field(foreign_key="patient.id")
+    origen_id: Optional[str] = None  # origen_id del duplicado, para que reimportar no lo vuelva a crear
+    fecha: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+from io import BytesIO
+
+# PDF calibrado (según ajuste final aceptado: Y=26.7 cm). ReportLab se importa
+# hasta el primer PDF (o en calentar(), en segundo plano tras el arranque) para
+# no alargar el arranque de cada worker.
+
+# Coordenadas calibradas sobre la hoja membretada. Forman parte de la clave de
+# caché: si se recalibra, los PDF guardados dejan de servirse solos.
+CALIBRACION = {
+    "fuente": "Helvetica",
+    "tamano": 9,
+    "y_shift": 12,       # todo 1 renglón hacia abajo
+    "x_nombre_cm": 2.5,
+    "x_fecha_cm": 11.5,
+    "y_base_cm": 26.7,
+    "x_left_cm": 1.5,
+    "sangria_cm": 1,
+}
+
+
+def items_normalizados(items):
+    out = []
+    for it in items or []:
+        if isinstance(it, dict):
+            out.append({"nombre": (it.get("nombre") or "").strip(), "indicacion": (it.get("indicacion") or "").strip()})
+    return out
+
+
+def clave_contenido(patient_id, fecha: str, items, recomendaciones, proxima_cita) -> str:
+    # Identifica una receta (para no duplicar RecetaHistory en reimpresiones)
+    doc = {
+        "patient_id": int(patient_id),
+        "fecha": fecha,
+        "items": items_normalizados(items),
+        "recomendaciones": (recomendaciones or "").strip(),
+        "proxima_cita": (proxima_cita or "").strip(),
+    }
+    return hashlib.sha256(json.dumps(doc, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def clave_pdf(clave: str, nombre_paciente: str, fecha_impresa: str) -> str:
+    # Identifica el PDF ya dibujado (ETag y nombre en la caché)
+    doc = {"receta": clave, "nombre": nombre_paciente, "fecha": fecha_impresa, "calibracion": CALIBRACION}
+    return hashlib.sha256(json.dumps(doc, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def dibujar_receta(c, nombre_paciente, fecha, items, recomendaciones=None, proxima_cita=None):
+    # Dibuja una página completa de receta sobre el canvas (termina con showPage)
+    from reportlab.lib.units import cm as _cm_unit
+    cal = CALIBRACION
+
+    def _cm(n: float) -> float:
+        return n * _cm_unit
+
+    c.setFont(cal["fuente"], cal["tamano"])
+
+    # Desplazar todo 1 renglón hacia abajo
+    y_shift = cal["y_shift"]
+
+    # Coordenadas calibradas
+    x_nombre = _cm(cal["x_nombre_cm"])
+    x_fecha = _cm(cal["x_fecha_cm"])
+    y_base = _cm(cal["y_base_cm"])
+
+    c.drawString(x_nombre, y_base - y_shift, nombre_paciente)
+    c.drawString(x_fecha, y_base - y_shift, fecha)
+
+    x_left = _cm(cal["x_left_cm"])
+    sangria = _cm(cal["sangria_cm"])
+    y = (y_base - y_shift) - _cm(0.8) - _cm(0.5)  # 2 renglones + extra y 1 renglón abajo
+    for it in items:
+        nombre = (it.get("nombre") or "").strip()
+        indic = (it.get("indicacion") or "").strip()
+        dosis = ""
+        forma = ""
+        if indic:
+            lines = [l.strip() for l in indic.split("\n") if l.strip()] if isinstance(indic, str) else []
+            if lines:
+                dosis = lines[0]
+                forma = "\n".join(lines[1:])
+        linea1 = nombre if nombre else ""
+        if dosis:
+            linea1 = f"{linea1} — {dosis}" if linea1 else dosis
+        c.drawString(x_left, y, linea1); y -= 12
+        if forma:
+            for sub in forma.split("\n"):
+                c.drawString(x_left + sangria, y, sub); y -= 12
+        y -= 14  # espacio entre medicamentos
+
+    # 3 renglones antes de recomendaciones
+    y -= 27
+    if (recomendaciones or "").strip():
+        c.drawString(x_left, y, "Recomendaciones:"); y -= 12
+        for line in (recomendaciones or "").split("\n"):
+            t = line.strip()
+            if not t: continue
+            t_fmt = f"- {t}" if not t.startswith("-") else t
+            c.drawString(x_left + sangria, y, t_fmt); y -= 12
+
+    # 1 renglón antes de próxima cita
+    y -= 9
+    if (proxima_cita or "").strip():
+        c.drawString(x_left, y, f"Próxima cita: {proxima_cita}"); y -= 12
+
+    c.showPage()
+
+
+def render_receta(nombre_paciente, fecha, items, recomendaciones=None, proxima_cita=None) -> bytes:
+    from reportlab.pdfgen import canvas as _cv
+    from reportlab.lib.pagesizes import letter as _letter
+    buf = BytesIO()
+    c = _cv.Canvas(buf, pagesize=_letter)
+    dibujar_receta(c, nombre_paciente, fecha, items, recomendaciones, proxima_cita)
+    c.save()
+    pdf = buf.getvalue(); buf.close()
+    return pdf
+
+
+def calentar():
+    # Importa ReportLab y dibuja una receta de prueba (carga métricas de la fuente)
+    render_receta("Paciente", "2000-01-01", [{"nombre": "x", "indicacion": "y"}], "z", "w")
@@ -0,0 +1,54 @@
+import os
+import tempfile
+
+# Caché LRU en disco para PDF ya dibujados, compartida por todos los workers.
+# El nombre de archivo es la clave (sha256 del contenido + calibración); cada
+# acierto actualiza el mtime y al guardar se eliminan los más viejos.
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", "./pdf_cache")
+PDF_CACHE_MAX = int(os.getenv("PDF_CACHE_MAX", "500"))
+
+
+def _ruta(clave: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, f"{clave}.pdf")
+
+
+def get(clave: str) -> bytes | None:
+    ruta = _ruta(clave)
+    try:
+        with open(ruta, "rb") as f:
+            data = f.read()
+        os.utime(ruta)
+        return data
+    except OSError:
+        return None
+
+
+def put(clave: str, data: bytes):
+    try:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=PDF_CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, _ruta(clave))
+        _podar()
+    except OSError:
+        pass
+
+
+def _podar():
+    entradas = []
+    with os.scandir(PDF_CACHE_DIR) as it:
+        for e in it:
+            if e.name.endswith(".pdf"):
+                try:
+                    entradas.append((e.stat().st_mtime, e.path))
+                except OSError:
+                    pass
+    if len(entradas) <= PDF_CACHE_MAX:
+        return
+    entradas.sort()
+    for _, ruta in entradas[: len(entradas) - PDF_CACHE_MAX]:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
@@ -0,0 +1,78 @@
+import os
+import sys
+import threading
+import time
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+
+from app import assets
+
+# Entorno Jinja compartido. Las plantillas compiladas se guardan como bytecode
+# en JINJA_CACHE_DIR, así que tras un reinicio no se vuelven a compilar; en
+# producción no se revisa el mtime de los archivos en cada render.
+TEMPLATES_DIR = "app/templates"
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", "./.jinja_cache")
+PRODUCCION = os.getenv("APP_ENV", "production") == "production"
+
+
+def _bytecode_cache():
+    try:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        return FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    except OSError:
+        return None
+
+
+env = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    autoescape=select_autoescape(),
+    bytecode_cache=_bytecode_cache(),
+    auto_reload=not PRODUCCION,
+)
+env.globals["asset_url"] = assets.asset_url
+
+# nombre -> [renders, segundos totales, máximo]
+_tiempos = {}
+_lock = threading.Lock()
+
+
+def precompilar():
+    # Compila (o carga del bytecode) todas las plantillas; devuelve {nombre: ms}
+    out = {}
+    for name in env.list_templates(extensions=["html"]):
+        t0 = time.perf_counter()
+        env.get_template(name)
+        out[name] = round((time.perf_counter() - t0) * 1000, 2)
+    return out
+
+
+def render(name: str, **ctx) -> str:
+    t0 = time.perf_counter()
+    html = env.get_template(name).render(**ctx)
+    dt = time.perf_counter() - t0
+    with _lock:
+        st = _tiempos.setdefault(name, [0, 0.0, 0.0])
+        st[0] += 1
+        st[1] += dt
+        st[2] = max(st[2], dt)
+    return html
+
+
+def tiempos():
+    with _lock:
+        return {
+            name: {"renders": n, "promedio_ms": round(total / n * 1000, 3), "max_ms": round(mx * 1000, 3)}
+            for name, (n, total, mx) in sorted(_tiempos.items())
+        }
+
+
+def totales():
+    # nombre -> (renders, segundos totales), para /metrics
+    with _lock:
+        return {name: (n, total) for name, (n, total, _) in _tiempos.items()}
+
+
+if __name__ == "__main__":
+    # Paso de build: python -m app.plantillas
+    for name, ms in precompilar().items():
+        print(f"{name}: {ms} ms")
+    sys.exit(0)
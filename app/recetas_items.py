@@ -0,0 +1,50 @@
+import json
+from sqlalchemy import delete, insert
+
+from app.models import RecetaHistoryItem
+from app.texto import fold
+
+# Mantiene RecetaHistoryItem en sincronía con RecetaHistory.items_json para
+# poder consultar uso de medicamentos con índices en vez de json.loads por fila.
+
+
+def separar_indicacion(indic: str):
+    # (dosis, indicaciones) con el mismo criterio que el detalle de consulta
+    indic = (indic or "").strip()
+    if "—" in indic:
+        dosis, forma = indic.split("—", 1)
+        return dosis.strip(), forma.strip()
+    lineas = [x.strip() for x in indic.split("\n") if x.strip()]
+    if not lineas:
+        return "", ""
+    return lineas[0], "\n".join(lineas[1:])
+
+
+def filas(hist, items=None):
+    if items is None:
+        try:
+            items = json.loads(hist.items_json or "[]")
+        except Exception:
+            items = []
+    out = []
+    for pos, it in enumerate(items or []):
+        if not isinstance(it, dict):
+            continue
+        nombre = (it.get("nombre") or "").strip()
+        if not nombre:
+            continue
+        dosis, forma = separar_indicacion(it.get("indicacion"))
+        out.append({
+            "receta_id": hist.id, "patient_id": hist.patient_id, "fecha": hist.fecha, "posicion": pos,
+            "medicamento": nombre, "medicamento_norm": fold(nombre),
+            "dosis": dosis or None, "indicaciones": forma or None,
+        })
+    return out
+
+
+def sincronizar(session, hist, items=None):
+    # Reemplaza los renglones de la receta (hist debe tener id; no hace commit)
+    session.execute(delete(RecetaHistoryItem).where(RecetaHistoryItem.receta_id == hist.id))
+    rows = filas(hist, items)
+    if rows:
+        session.execute(insert(RecetaHistoryItem), rows)
@@ -0,0 +1,106 @@
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+# Enlaza recetas "huérfanas" (RecetaHistory sin consulta_id) con la consulta
+# del mismo paciente y día. Antes lo hacía consulta_detalle dentro del GET; ahora
+# las existentes se enlazan una sola vez en la migración 13, consulta_guardar
+# enlaza las del día al registrar una consulta y, si hiciera falta repetirlo,
+# POST /api/mantenimiento/enlazar-recetas lo corre en segundo plano en lotes
+# cortos para no retener el candado de escritura.
+LOTE = 500
+
+_ENLAZAR = """
+UPDATE recetahistory SET consulta_id = (
+    SELECT c.id FROM consulta c
+    WHERE c.patient_id = recetahistory.patient_id
+      AND c.fecha >= date(recetahistory.fecha) AND c.fecha < date(recetahistory.fecha, '+1 day')
+    ORDER BY c.fecha DESC LIMIT 1)
+WHERE id IN ({ids})
+  AND EXISTS (
+    SELECT 1 FROM consulta c
+    WHERE c.patient_id = recetahistory.patient_id
+      AND c.fecha >= date(recetahistory.fecha) AND c.fecha < date(recetahistory.fecha, '+1 day'))
+"""
+
+# Un trabajo por base de datos (con varias clínicas cada una lleva el suyo): url -> (candado, estado)
+_trabajos = {}
+DEL_DIA_SQL = (
+    "UPDATE recetahistory SET consulta_id = :cid WHERE patient_id = :pid "
+    "AND (consulta_id IS NULL OR consulta_id = 0) AND fecha >= :ini AND fecha < :fin"
+)
+
+_lock = threading.Lock()
+
+
+def _trabajo(engine):
+    url = str(engine.url)
+    with _lock:
+        t = _trabajos.get(url)
+        if t is None:
+            t = _trabajos[url] = (threading.Lock(), {"estado": "inactivo", "total": 0, "procesadas": 0, "enlazadas": 0,
+                                                     "inicio": None, "fin": None, "error": None})
+    return t
+
+
+def estado_de(engine) -> dict:
+    return dict(_trabajo(engine)[1])
+
+
+def enlazar_huerfanas(engine, lote: int = LOTE):
+    estado = _trabajo(engine)[1]
+    with engine.connect() as conn:
+        total = conn.execute(text(
+            "SELECT count(*) FROM recetahistory WHERE consulta_id IS NULL OR consulta_id = 0")).scalar() or 0
+        conn.rollback()
+    estado.update(total=total, procesadas=0, enlazadas=0)
+    ultimo = 0
+    while True:
+        with engine.begin() as conn:
+            ids, enlazadas = enlazar_lote(conn, ultimo, lote)
+        if not ids:
+            break
+        ultimo = ids[-1]
+        estado["procesadas"] += len(ids)
+        estado["enlazadas"] += enlazadas
+    return dict(estado)
+
+
+def enlazar_lote(conn, ultimo: int, lote: int = LOTE):
+    # Siguiente lote de huérfanas con id > ultimo: (ids revisados, enlazadas). No hace commit.
+    ids = [r[0] for r in conn.execute(text(
+        "SELECT id FROM recetahistory WHERE (consulta_id IS NULL OR consulta_id = 0) AND id > :u "
+        "ORDER BY id LIMIT :n"), {"u": ultimo, "n": lote})]
+    if not ids:
+        return ids, 0
+    res = conn.execute(text(_ENLAZAR.format(ids=", ".join(str(i) for i in ids))))
+    return ids, res.rowcount or 0
+
+
+def _correr(engine):
+    candado, estado = _trabajo(engine)
+    try:
+        enlazar_huerfanas(engine)
+        estado.update(estado="terminado", fin=datetime.now().isoformat(timespec="seconds"))
+    except Exception as e:
+        estado.update(estado="error", error=str(e), fin=datetime.now().isoformat(timespec="seconds"))
+    finally:
+        candado.release()
+
+
+def iniciar(engine) -> bool:
+    # Lanza el trabajo en un hilo; False si ya hay uno corriendo para esa base en este worker
+    candado, estado = _trabajo(engine)
+    if not candado.acquire(blocking=False):
+        return False
+    estado.update(estado="corriendo", inicio=datetime.now().isoformat(timespec="seconds"), fin=None, error=None)
+    threading.Thread(target=_correr, args=(engine,), name="enlazar-recetas", daemon=True).start()
+    return True
+
+
+def enlazar_del_dia(session, consulta):
+    # Al guardar una consulta, le asigna las recetas sin consulta del mismo día (no hace commit)
+    dia_ini = consulta.fecha.replace(hour=0, minute=0, second=0, microsecond=0)
+    session.execute(text(DEL_DIA_SQL),
+        {"cid": consulta.id, "pid": consulta.patient_id,
+         "ini": dia_ini.strftime("%Y-%m-%d %H:%M:%S"), "fin": (dia_ini + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")})
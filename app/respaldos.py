@@ -0,0 +1,322 @@
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.engine import make_url
+
+from app import clinicas
+from app.db import BUSY_TIMEOUT_MS, DATABASE_URL
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin candado entre procesos
+    fcntl = None
+
+# Respaldos en línea: copia la base con la API de backup de SQLite en pasos de
+# pocas páginas (con una pausa entre pasos, así los escritores nunca esperan
+# más de un paso), verifica la copia con PRAGMA integrity_check y la guarda
+# comprimida en RESPALDOS_DIR/<base>/<base>-AAAAMMDD-HHMMSS-ffffff.db.gz, conservando
+# las últimas RESPALDOS_CONSERVAR. Un hilo los programa cada RESPALDOS_CADA_H
+# horas; con varios workers sólo programa uno (candado de archivo) y otro
+# candado por base evita dos copias a la vez.
+RESPALDOS_DIR = os.getenv("RESPALDOS_DIR", "./respaldos")
+CADA_H = float(os.getenv("RESPALDOS_CADA_H", "24"))  # 0 desactiva el programador
+CONSERVAR = int(os.getenv("RESPALDOS_CONSERVAR", "7"))
+PAGINAS_POR_PASO = int(os.getenv("RESPALDOS_PAGINAS_POR_PASO", "256"))
+PAUSA_MS = float(os.getenv("RESPALDOS_PAUSA_MS", "5"))
+# Si aun así la copia se reinicia (p. ej. una base sin WAL), tras estos reinicios se termina en un solo paso
+MAX_REINICIOS = 3
+REVISAR_CADA_S = 300
+EXT = ".db.gz"
+
+log = logging.getLogger("app.respaldos")
+
+_lock = threading.Lock()  # un respaldo a la vez por worker
+_estados = {}  # base -> estado del último respaldo
+_parar = threading.Event()
+
+
+class _Reiniciado(Exception):
+    pass
+
+
+def ruta_de(url) -> str:
+    # Archivo de una URL sqlite:///... (ValueError si es en memoria o no es SQLite)
+    u = make_url(str(url))
+    if not u.drivername.startswith("sqlite") or not u.database or u.database == ":memory:":
+        raise ValueError(f"no se puede respaldar {url}")
+    return u.database
+
+
+def nombre_de(ruta_db: str) -> str:
+    return os.path.splitext(os.path.basename(ruta_db))[0]
+
+
+def bases() -> list[str]:
+    # Archivos a respaldar: el de cada clínica o el de DATABASE_URL
+    if clinicas.ACTIVO:
+        return [clinicas.ruta_db(c) for c in clinicas.listar()]
+    return [ruta_de(DATABASE_URL)]
+
+
+def _estado(nombre: str) -> dict:
+    return _estados.setdefault(nombre, {"estado": "inactivo", "inicio": None, "fin": None, "duracion_s": None,
+                                        "copia_s": None, "verificacion_s": None, "compresion_s": None,
+                                        "paginas_total": 0, "paginas_copiadas": 0, "pasos": 0, "reinicios": 0,
+                                        "archivo": None, "bytes": None, "error": None, "ultimo_ok": None, "fallos": 0})
+
+
+def estado_de(ruta_db: str) -> dict:
+    return dict(_estado(nombre_de(ruta_db)))
+
+
+def estados() -> dict:
+    return {n: dict(st) for n, st in _estados.items()}
+
+
+def _copiar(ruta_db, tmp, st, paginas, pausa_s):
+    src = sqlite3.connect(ruta_db, timeout=BUSY_TIMEOUT_MS / 1000)
+    dst = sqlite3.connect(tmp)
+    try:
+        src.execute("PRAGMA query_only=ON")
+        # Una transacción de lectura abierta durante toda la copia: en WAL los pasos leen
+        # la misma instantánea y la escritura de otras conexiones no reinicia el backup
+        src.execute("BEGIN")
+        src.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        previo = [None]
+
+        def progreso(_status, restantes, total):
+            st["paginas_total"] = total
+            st["paginas_copiadas"] = total - restantes
+            st["pasos"] += 1
+            if previo[0] is not None and restantes > previo[0]:
+                st["reinicios"] += 1
+                if st["reinicios"] > MAX_REINICIOS:
+                    raise _Reiniciado()
+            previo[0] = restantes
+
+        try:
+            src.backup(dst, pages=paginas, progress=progreso, sleep=pausa_s)
+        except _Reiniciado:
+            # Mucha escritura: un solo paso lee una instantánea consistente (en WAL no detiene a los escritores)
+            src.backup(dst, pages=-1)
+            st["paginas_copiadas"] = st["paginas_total"]
+        # La copia queda autocontenida (sin -wal) y se verifica antes de conservarla
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+
+
+def _verificar(ruta: str):
+    con = sqlite3.connect(ruta)
+    try:
+        filas = [r[0] for r in con.execute("PRAGMA integrity_check")]
+    finally:
+        con.close()
+    if filas != ["ok"]:
+        raise RuntimeError("integrity_check: " + "; ".join(filas[:5]))
+
+
+def _candado_archivo(directorio, nombre=".lock"):
+    # Candado entre workers/procesos; None si otro ya lo tiene
+    f = open(os.path.join(directorio, nombre), "w")
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+    return f
+
+
+def respaldar(ruta_db: str, destino: str = RESPALDOS_DIR, paginas: int = PAGINAS_POR_PASO,
+              pausa_ms: float = PAUSA_MS, conservar: int = CONSERVAR) -> dict:
+    # Un respaldo verificado y comprimido de ruta_db; devuelve su estado (RuntimeError si falla)
+    if not os.path.isfile(ruta_db):
+        raise RuntimeError(f"no existe {ruta_db}")
+    nombre = nombre_de(ruta_db)
+    directorio = os.path.join(destino, nombre)
+    os.makedirs(directorio, exist_ok=True)
+    st = _estado(nombre)
+    candado = _candado_archivo(directorio)
+    if candado is None:
+        raise RuntimeError(f"otro proceso está respaldando {nombre}")
+    t0 = time.perf_counter()
+    st.update(estado="copiando", inicio=datetime.now().isoformat(timespec="seconds"), fin=None, duracion_s=None,
+              copia_s=None, verificacion_s=None, compresion_s=None, paginas_total=0, paginas_copiadas=0,
+              pasos=0, reinicios=0, archivo=None, bytes=None, error=None)
+    # Con microsegundos: dos respaldos en el mismo segundo no se pisan y el orden
+    # alfabético sigue siendo el cronológico (rotar() depende de eso)
+    final = os.path.join(directorio, f"{nombre}-{datetime.now():%Y%m%d-%H%M%S-%f}{EXT}")
+    tmp = final.removesuffix(".gz") + ".tmp"
+    try:
+        _copiar(ruta_db, tmp, st, paginas, pausa_ms / 1000)
+        t1 = time.perf_counter()
+        st.update(estado="verificando", copia_s=round(t1 - t0, 3))
+        _verificar(tmp)
+        t2 = time.perf_counter()
+        st.update(estado="comprimiendo", verificacion_s=round(t2 - t1, 3))
+        with open(tmp, "rb") as fin, gzip.open(final + ".tmp", "wb", compresslevel=6) as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+        os.replace(final + ".tmp", final)
+        t3 = time.perf_counter()
+        st.update(estado="terminado", compresion_s=round(t3 - t2, 3), duracion_s=round(t3 - t0, 3),
+                  archivo=os.path.basename(final), bytes=os.path.getsize(final), ultimo_ok=time.time(),
+                  fin=datetime.now().isoformat(timespec="seconds"))
+        rotar(directorio, conservar)
+        log.info("respaldo %s: %s páginas en %d pasos, %.2f s (copia %.2f s), %d bytes",
+                 st["archivo"], st["paginas_total"], st["pasos"], st["duracion_s"], st["copia_s"], st["bytes"])
+        return dict(st)
+    except Exception as e:
+        st.update(estado="error", error=str(e), fallos=st["fallos"] + 1, duracion_s=round(time.perf_counter() - t0, 3),
+                  fin=datetime.now().isoformat(timespec="seconds"))
+        raise RuntimeError(f"respaldo de {nombre}: {e}") from e
+    finally:
+        for f in (tmp, tmp + "-journal", tmp + "-wal", tmp + "-shm", final + ".tmp"):
+            if os.path.exists(f):
+                os.remove(f)
+        candado.close()
+
+
+def rotar(directorio: str, conservar: int = CONSERVAR):
+    # Borra los respaldos más viejos; el nombre lleva la fecha, así que el orden alfabético es cronológico
+    archivos = sorted(n for n in os.listdir(directorio) if n.endswith(EXT))
+    for n in archivos[:-conservar] if conservar > 0 else []:
+        os.remove(os.path.join(directorio, n))
+
+
+def listar(ruta_db: str, destino: str = RESPALDOS_DIR) -> list[dict]:
+    # Respaldos de una base, del más reciente al más viejo
+    directorio = os.path.join(destino, nombre_de(ruta_db))
+    if not os.path.isdir(directorio):
+        return []
+    salida = []
+    for n in sorted((n for n in os.listdir(directorio) if n.endswith(EXT)), reverse=True):
+        st = os.stat(os.path.join(directorio, n))
+        salida.append({"archivo": n, "bytes": st.st_size,
+                       "fecha": datetime.fromtimestamp(st.st_mtime).isoformat(timespec="seconds")})
+    return salida
+
+
+def _ultimo(ruta_db: str, destino: str = RESPALDOS_DIR) -> float | None:
+    directorio = os.path.join(destino, nombre_de(ruta_db))
+    try:
+        return max((os.path.getmtime(os.path.join(directorio, n)) for n in os.listdir(directorio) if n.endswith(EXT)),
+                   default=None)
+    except OSError:
+        return None
+
+
+def _correr(ruta_db):
+    try:
+        respaldar(ruta_db)
+    except Exception as e:
+        log.warning("%s", e)
+    finally:
+        _lock.release()
+
+
+def iniciar(ruta_db: str) -> bool:
+    # Lanza un respaldo en un hilo; False si ya hay uno corriendo en este worker
+    if not _lock.acquire(blocking=False):
+        return False
+    _estado(nombre_de(ruta_db)).update(estado="en cola", error=None)
+    threading.Thread(target=_correr, args=(ruta_db,), name="respaldo", daemon=True).start()
+    return True
+
+
+def _programador(cada_h: float):
+    # Respalda cada base cuyo último respaldo (de cualquier worker) tenga más de cada_h horas.
+    # Sólo programa el worker que tiene RESPALDOS_DIR/.programador (lo conserva mientras
+    # viva); los demás vuelven a intentarlo en cada revisión por si ese worker termina.
+    espera = 60  # la primera revisión no compite con el arranque
+    candado = None
+    try:
+        while not _parar.wait(espera):
+            espera = REVISAR_CADA_S
+            if candado is None:
+                os.makedirs(RESPALDOS_DIR, exist_ok=True)
+                candado = _candado_archivo(RESPALDOS_DIR, ".programador")
+                if candado is None:
+                    continue
+            if not _revisar(cada_h):
+                return
+    finally:
+        if candado is not None:
+            candado.close()
+
+
+def _revisar(cada_h: float) -> bool:
+    # Una pasada por las bases; False si hay que detenerse
+    for ruta in bases():
+        ultimo = _ultimo(ruta)
+        if ultimo is not None and time.time() - ultimo < cada_h * 3600:
+            continue
+        if not _lock.acquire(blocking=False):
+            break
+        try:
+            respaldar(ruta)
+        except Exception as e:
+            log.warning("%s", e)
+        finally:
+            _lock.release()
+        if _parar.is_set():
+            return False
+    return True
+
+
+def programar(cada_h: float = CADA_H) -> bool:
+    if cada_h <= 0:
+        return False
+    _parar.clear()
+    threading.Thread(target=_programador, args=(cada_h,), name="respaldos", daemon=True).start()
+    return True
+
+
+def detener():
+    _parar.set()
+
+
+def main(argv=None):
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Respaldos en línea de la base (o de cada clínica)")
+    sub = ap.add_subparsers(dest="orden", required=True)
+    c = sub.add_parser("crear", help="respalda ahora")
+    c.add_argument("--db", help="archivo a respaldar (por defecto DATABASE_URL o todas las clínicas)")
+    c.add_argument("--destino", default=RESPALDOS_DIR)
+    c.add_argument("--paginas", type=int, default=PAGINAS_POR_PASO, help="páginas por paso")
+    c.add_argument("--pausa-ms", type=float, default=PAUSA_MS, help="pausa entre pasos")
+    c.add_argument("--conservar", type=int, default=CONSERVAR)
+    l = sub.add_parser("listar", help="respaldos existentes")
+    l.add_argument("--db")
+    l.add_argument("--destino", default=RESPALDOS_DIR)
+    args = ap.parse_args(argv)
+
+    rutas = [args.db] if args.db else bases()
+    fallas = 0
+    for ruta in rutas:
+        if args.orden == "crear":
+            try:
+                st = respaldar(ruta, args.destino, args.paginas, args.pausa_ms, args.conservar)
+            except RuntimeError as e:
+                print(e, file=sys.stderr)
+                fallas += 1
+                continue
+            print(f"{st['archivo']}\t{st['bytes'] / 1024:.0f} kB\t{st['paginas_total']} páginas en {st['pasos']} pasos"
+                  f"\t{st['duracion_s']:.2f} s (copia {st['copia_s']:.2f} s, verificación {st['verificacion_s']:.2f} s)")
+        else:
+            for r in listar(ruta, args.destino):
+                print(f"{r['archivo']}\t{r['bytes'] / 1024:.0f} kB\t{r['fecha']}")
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
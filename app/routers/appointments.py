@@ -1,58 +1,142 @@
-
-from fastapi import APIRouter, Form, Depends
+from fastapi import APIRouter, Form, Depends, Request, Response
 from fastapi.responses import JSONResponse
-from sqlmodel import Session, select
-from datetime import datetime, date, time
-from app.models import Appointment, Patient
+from sqlmodel import Session
+from datetime import datetime, time, timedelta
+from app import agenda, calendario, sentencias
+
+MAX_DIAS_RANGO = 62
 
-def make_router(engine):
+def make_router(engine, read_engine=None):
     router = APIRouter()
+    read_engine = read_engine or engine
 
     def get_session():
         with Session(engine) as s:
             yield s
 
+    def get_read_session():
+        with Session(read_engine) as s:
+            yield s
+
     @router.post("/api/appointments")
     def create_appointment(
         patient_id: int = Form(...),
         consulta_id: int | None = Form(None),
         fecha: str = Form(...),
         nota: str = Form(""),
+        duracion_min: int | None = Form(None),
+        forzar: bool = Form(False),
         session: Session = Depends(get_session)
     ):
         try:
             dt = datetime.fromisoformat(fecha)
         except Exception:
             return JSONResponse({"ok": False, "error": "Fecha inválida"}, status_code=400)
-        ap = Appointment(patient_id=patient_id, consulta_id=consulta_id, fecha=dt, nota=nota)
-        session.add(ap)
+        try:
+            duracion_min = agenda.duracion_de(duracion_min)
+        except ValueError as e:
+            return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+        ap, choques = agenda.agendar(session, patient_id, dt, duracion_min, nota, forzar)
+        if ap is None:
+            return JSONResponse(agenda.respuesta_empalme(session, dt, duracion_min, choques), status_code=409)
         session.commit()
-        return {"ok": True, "id": ap.id}
+        return {"ok": True, "id": ap.id, "empalme": bool(choques), "conflictos": choques,
+                "fuera_de_horario": not agenda.en_horario(dt, ap.duracion_min)}
+
+    # Siguientes n huecos libres a partir de `desde` (por defecto, ahora)
+    @router.get("/api/agenda/libres")
+    def agenda_libres(desde: str | None = None, n: int = 5, duracion_min: int | None = None,
+                      session: Session = Depends(get_read_session)):
+        try:
+            dt = datetime.fromisoformat(desde) if desde else datetime.now()
+        except Exception:
+            return JSONResponse({"ok": False, "error": "Fecha inválida"}, status_code=400)
+        try:
+            duracion_min = agenda.duracion_de(duracion_min)
+        except ValueError as e:
+            return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+        n = max(1, min(n, 50))
+        return {"ok": True, "duracion_min": duracion_min,
+                "libres": [s.isoformat(timespec="minutes") for s in agenda.libres(session, dt, n, duracion_min)]}
+
+    # ¿Se empalma una cita en `fecha`? (para avisar en el formulario antes de guardar)
+    @router.get("/api/agenda/empalmes")
+    def agenda_empalmes(fecha: str, duracion_min: int | None = None, session: Session = Depends(get_read_session)):
+        try:
+            dt = datetime.fromisoformat(fecha)
+        except Exception:
+            return JSONResponse({"ok": False, "error": "Fecha inválida"}, status_code=400)
+        try:
+            duracion_min = agenda.duracion_de(duracion_min)
+        except ValueError as e:
+            return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+        choques = agenda.conflictos(session, dt, duracion_min)
+        return {"ok": True, "libre": not choques, "conflictos": choques,
+                "fuera_de_horario": not agenda.en_horario(dt, duracion_min)}
+
+    def _citas(session, start, end):
+        rows = session.exec(sentencias.citas_rango(start, end)).all()
+        for ap, p in rows:
+            yield ap.fecha.date().isoformat(), {
+                "id": ap.id,
+                "hora": ap.fecha.strftime("%H:%M"),
+                "paciente": p.nombre,
+                "nota": ap.notas or ""
+            }
+
+    def _cabeceras(response: Response, etag: str, vers):
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+        lm = calendario.last_modified(vers)
+        if lm:
+            response.headers["Last-Modified"] = lm
 
     @router.get("/api/calendar")
-    def calendar(day: str, session: Session = Depends(get_session)):
+    def calendar(day: str, request: Request, response: Response, session: Session = Depends(get_read_session)):
         try:
             base = datetime.fromisoformat(day).date()
         except Exception:
             base = datetime.now().date()
+        vers = calendario.versiones(session, base, base)
+        etag = calendario.etag_dia(base.isoformat(), vers[base.isoformat()][0])
+        if calendario.sin_cambios(request, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        _cabeceras(response, etag, vers)
         start = datetime.combine(base, time.min)
         end   = datetime.combine(base, time.max)
+        items = [it for _, it in _citas(session, start, end)]
+        return {"ok": True, "day": base.isoformat(), "etag": etag, "items": items}
 
-        rows = session.exec(
-            select(Appointment, Patient)
-            .where((Appointment.fecha >= start) & (Appointment.fecha <= end))
-            .join(Patient, Patient.id == Appointment.patient_id)
-            .order_by(Appointment.fecha)
-        ).all()
+    # Varios días (desde/hasta, o day + vista=semana|mes) agrupados por día, con ETag del rango
+    @router.get("/api/calendar/rango")
+    def calendar_rango(request: Request, response: Response, desde: str | None = None, hasta: str | None = None,
+                       day: str | None = None, vista: str | None = None, session: Session = Depends(get_read_session)):
+        try:
+            if vista in ("semana", "mes"):
+                base = datetime.fromisoformat(day).date() if day else datetime.now().date()
+                if vista == "semana":
+                    d1 = base - timedelta(days=base.weekday())
+                    d2 = d1 + timedelta(days=6)
+                else:
+                    d1 = base.replace(day=1)
+                    d2 = (d1 + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            else:
+                d1 = datetime.fromisoformat(desde).date()
+                d2 = datetime.fromisoformat(hasta).date() if hasta else d1
+        except Exception:
+            return JSONResponse({"ok": False, "error": "Usa desde/hasta (YYYY-MM-DD) o day + vista=semana|mes"}, status_code=400)
+        if d2 < d1 or (d2 - d1).days >= MAX_DIAS_RANGO:
+            return JSONResponse({"ok": False, "error": f"Rango inválido (máximo {MAX_DIAS_RANGO} días)"}, status_code=400)
 
-        items = []
-        for ap, p in rows:
-            items.append({
-                "id": ap.id,
-                "hora": ap.fecha.strftime("%H:%M"),
-                "paciente": p.nombre,
-                "nota": ap.nota or ""
-            })
-        return {"ok": True, "day": base.isoformat(), "items": items}
+        vers = calendario.versiones(session, d1, d2)
+        etag = calendario.etag_rango(vers)
+        if calendario.sin_cambios(request, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        _cabeceras(response, etag, vers)
+        dias = {d: [] for d in vers}
+        for d, it in _citas(session, datetime.combine(d1, time.min), datetime.combine(d2, time.max)):
+            dias.setdefault(d, []).append(it)
+        return {"ok": True, "desde": d1.isoformat(), "hasta": d2.isoformat(), "etag": etag,
+                "dias": [{"day": d, "etag": calendario.etag_dia(d, vers[d][0]), "items": dias[d]} for d in sorted(dias)]}
 
     return router
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends
+from sqlmodel import Session
+
+from app import catalogo
+
+def make_router(engine, read_engine=None):
+    router = APIRouter()
+    read_engine = read_engine or engine
+
+    def get_read_session():
+        with Session(read_engine) as s:
+            yield s
+
+    # Autocompletado por prefijo (y a media palabra / con errores menores),
+    # ordenado por frecuencia de uso y recencia
+    @router.get("/api/catalogo/medicamentos")
+    def sugerir_medicamentos(q: str = "", k: int = 10, session: Session = Depends(get_read_session)):
+        return {"ok": True, "q": q, "items": catalogo.sugerir(session, "medicamentos", q, min(max(k, 1), 50))}
+
+    @router.get("/api/catalogo/dosificaciones")
+    def sugerir_dosificaciones(q: str = "", k: int = 10, session: Session = Depends(get_read_session)):
+        return {"ok": True, "q": q, "items": catalogo.sugerir(session, "dosificaciones", q, min(max(k, 1), 50))}
+
+    return router
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+from sqlmodel import Session
+from typing import Optional
+from datetime import datetime, timedelta
+
+from app import busqueda, sentencias
+
+def _rango(desde: Optional[str], hasta: Optional[str]):
+    # Fechas YYYY-MM-DD; hasta es inclusivo
+    d1 = datetime.fromisoformat(desde) if desde else None
+    d2 = datetime.fromisoformat(hasta) + timedelta(days=1) if hasta else None
+    return d1, d2
+
+def make_router(engine, read_engine=None):
+    router = APIRouter()
+    read_engine = read_engine or engine
+
+    def get_read_session():
+        with Session(read_engine) as s:
+            yield s
+
+    # Serie de tiempo de signos vitales de un paciente (índice patient_id, fecha)
+    @router.get("/api/pacientes/{pid}/vitales")
+    def vitales_paciente(pid: int, desde: Optional[str] = None, hasta: Optional[str] = None, session: Session = Depends(get_read_session)):
+        try:
+            d1, d2 = _rango(desde, hasta)
+        except ValueError:
+            return JSONResponse({"ok": False, "error": "Fecha inválida"}, status_code=400)
+        rows = session.exec(sentencias.vitales_paciente(pid, d1, d2)).all()
+        items = [{
+            "consulta_id": v.consulta_id,
+            "fecha": v.fecha.isoformat(),
+            "ta_sistolica": v.ta_sistolica, "ta_diastolica": v.ta_diastolica,
+            "fc": v.fc, "fr": v.fr,
+            "peso_kg": v.peso_kg, "talla_m": v.talla_m, "imc": v.imc,
+        } for v in rows]
+        return {"ok": True, "patient_id": pid, "items": items}
+
+    # Consultas por diagnóstico (FTS sobre Consulta.dx, sin acentos), opcionalmente por rango de fechas
+    @router.get("/api/diagnosticos/buscar")
+    def buscar_diagnosticos(q: str, desde: Optional[str] = None, hasta: Optional[str] = None,
+                            page: int = 1, per_page: int = 50, session: Session = Depends(get_read_session)):
+        try:
+            d1, d2 = _rango(desde, hasta)
+        except ValueError:
+            return JSONResponse({"ok": False, "error": "Fecha inválida"}, status_code=400)
+        fmt = "%Y-%m-%d %H:%M:%S"
+        rows = busqueda.buscar_dx(session, q, d1.strftime(fmt) if d1 else None, d2.strftime(fmt) if d2 else None,
+                                  page=page, per_page=min(max(per_page, 1), 200))
+        items = [{"consulta_id": cid, "fecha": str(fecha), "patient_id": pid, "paciente": nombre, "dx": dx}
+                 for cid, fecha, pid, nombre, dx in rows]
+        pacientes = len({i["patient_id"] for i in items})
+        return {"ok": True, "q": q, "page": max(page, 1), "items": items, "pacientes": pacientes}
+
+    return router
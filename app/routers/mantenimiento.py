@@ -0,0 +1,82 @@
+from datetime import datetime
+from fastapi import APIRouter, File, Form, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app import clinicas, duplicados, exportar, importar, reconciliacion, respaldos
+
+def make_router(engine, read_engine=None):
+    router = APIRouter()
+    read_engine = read_engine or engine
+
+    # Enlace de recetas huérfanas con su consulta del mismo día (en segundo plano)
+    @router.post("/api/mantenimiento/enlazar-recetas")
+    def enlazar_recetas():
+        # El hilo no hereda la clínica de la petición: recibe su engine real
+        iniciado = reconciliacion.iniciar(clinicas.real(engine))
+        return {"ok": True, "iniciado": iniciado, "progreso": reconciliacion.estado_de(engine)}
+
+    @router.get("/api/mantenimiento/enlazar-recetas")
+    def enlazar_recetas_estado():
+        return {"ok": True, "progreso": reconciliacion.estado_de(engine)}
+
+    # Respaldo en línea de la base (la de la clínica en curso, con varias clínicas)
+    @router.post("/api/respaldos")
+    def respaldo_crear():
+        try:
+            ruta = respaldos.ruta_de(engine.url)
+        except ValueError as e:
+            return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+        iniciado = respaldos.iniciar(ruta)
+        return {"ok": True, "iniciado": iniciado, "progreso": respaldos.estado_de(ruta)}
+
+    @router.get("/api/respaldos")
+    def respaldo_lista():
+        try:
+            ruta = respaldos.ruta_de(engine.url)
+        except ValueError as e:
+            return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+        return {"ok": True, "progreso": respaldos.estado_de(ruta), "respaldos": respaldos.listar(ruta)}
+
+    # Exportación en streaming: NDJSON (todas o varias tablas) o CSV (una tabla).
+    # desde/hasta (YYYY-MM-DD) y patient_id permiten exportar por partes.
+    @router.get("/api/exportar")
+    def exportar_registros(formato: str = "ndjson", tablas: str = "", desde: str | None = None,
+                           hasta: str | None = None, patient_id: int | None = None, gzip: bool = False):
+        error = exportar.validar(formato, tablas)
+        try:
+            for f in (desde, hasta):
+                if f:
+                    datetime.fromisoformat(f)
+        except ValueError:
+            error = error or "desde/hasta deben ser YYYY-MM-DD"
+        if error:
+            return JSONResponse({"ok": False, "error": error}, status_code=400)
+        nombre = f"expediente-{datetime.now():%Y%m%d-%H%M%S}.{formato}" + (".gz" if gzip else "")
+        media = "text/csv" if formato == "csv" else "application/x-ndjson"
+        return StreamingResponse(
+            exportar.exportar(clinicas.real(read_engine), formato, tablas, desde, hasta, patient_id, gzip),
+            media_type="application/gzip" if gzip else media,
+            headers={"Content-Disposition": f'attachment; filename="{nombre}"'},
+        )
+
+    # Importación masiva (CSV con tipo=pacientes|citas, o NDJSON con "_tabla");
+    # responde con el conteo y los errores por fila
+    @router.post("/api/importar")
+    def importar_registros(archivo: UploadFile = File(...), tipo: str | None = Form(None),
+                           formato: str | None = Form(None), forzar: bool = Form(False)):
+        formato = formato or ("csv" if ".csv" in (archivo.filename or "") else "ndjson")
+        if formato not in ("csv", "ndjson"):
+            return JSONResponse({"ok": False, "error": "formato debe ser csv o ndjson"}, status_code=400)
+        if formato == "csv" and tipo not in importar.TIPOS:
+            return JSONResponse({"ok": False, "error": "para CSV indica tipo=pacientes|citas"}, status_code=400)
+        reporte = importar.importar(engine, archivo.file, formato, tipo, forzar=forzar)
+        return {"ok": not reporte["rechazados"], **reporte}
+
+    # Reporte de posibles expedientes duplicados en todo el registro (por bloques)
+    @router.get("/api/duplicados")
+    def reporte_duplicados(umbral: float | None = None, limite: int = 200):
+        with read_engine.connect() as conn:
+            rep = duplicados.reporte(conn, umbral, min(max(limite, 1), 5000))
+        return {"ok": True, **rep}
+
+    return router
@@ -0,0 +1,66 @@
+from datetime import date
+from fastapi import APIRouter, Depends, Form
+from fastapi.responses import JSONResponse
+from sqlmodel import Session
+
+from app import busqueda, duplicados, linea_tiempo
+
+def make_router(engine, read_engine=None):
+    router = APIRouter()
+    read_engine = read_engine or engine
+
+    def get_session():
+        with Session(engine) as s:
+            yield s
+
+    def get_read_session():
+        with Session(read_engine) as s:
+            yield s
+
+    # Búsqueda para autocompletado (mismo índice FTS que /expediente?q=)
+    @router.get("/api/pacientes/buscar")
+    def buscar_pacientes(q: str = "", page: int = 1, per_page: int = 10, session: Session = Depends(get_read_session)):
+        per_page = min(max(per_page, 1), 100)
+        pacientes, total = busqueda.buscar(session, q, page=page, per_page=per_page)
+        items = [{
+            "id": p.id,
+            "nombre": p.nombre,
+            "telefono": p.telefono or "",
+            "edad": p.edad,
+            "alergias": p.alergias or "",
+        } for p in pacientes]
+        return {"ok": True, "q": q, "page": max(page, 1), "per_page": per_page, "total": total, "items": items}
+
+    # Posibles duplicados de un paciente en captura (o de uno existente con excluir=id)
+    @router.get("/api/pacientes/duplicados")
+    def pacientes_duplicados(nombre: str = "", telefono: str = "", fecha_nacimiento: str = "",
+                             excluir: int | None = None, session: Session = Depends(get_read_session)):
+        try:
+            fn = date.fromisoformat(fecha_nacimiento) if fecha_nacimiento else None
+        except ValueError:
+            fn = None
+        items = duplicados.candidatos(session, nombre, telefono, fn, excluir=excluir) if nombre.strip() else []
+        return {"ok": True, "items": items}
+
+    # Fusiona duplicado_id dentro de pid (una sola transacción)
+    @router.post("/api/pacientes/{pid}/fusionar")
+    def fusionar_paciente(pid: int, duplicado_id: int = Form(...), session: Session = Depends(get_session)):
+        try:
+            resultado = duplicados.fusionar(session, pid, duplicado_id)
+        except ValueError as e:
+            return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+        session.commit()
+        return {"ok": True, **resultado}
+
+    # Consultas, recetas y citas del paciente, más recientes primero; ?cursor= trae la página siguiente
+    @router.get("/api/pacientes/{pid}/linea-tiempo")
+    def linea_tiempo_paciente(pid: int, cursor: str | None = None, limite: int = linea_tiempo.POR_PAGINA,
+                              tipos: str = "", session: Session = Depends(get_read_session)):
+        try:
+            eventos, siguiente = linea_tiempo.pagina(session, pid, cursor, limite,
+                                                     [t.strip() for t in tipos.split(",") if t.strip()])
+        except ValueError:
+            return JSONResponse({"ok": False, "error": "Cursor inválido"}, status_code=400)
+        return {"ok": True, "patient_id": pid, "items": eventos, "siguiente": siguiente}
+
+    return router
@@ -1,20 +1,32 @@
 from fastapi import APIRouter, Depends, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from sqlmodel import Session, select
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, timedelta
+import asyncio
 import json
+import os
+import time
 
-from app.models import RecetaHistory, Consulta
+from app.models import RecetaHistory, Patient
+from app import metricas, pdf, lote_pdf, recetas_items, sentencias
+from app.texto import fold
 
-def make_router(engine):
+def make_router(engine, read_engine=None):
     router = APIRouter()
+    read_engine = read_engine or engine
 
     def get_session():
         from sqlmodel import Session as _S
         with _S(engine) as s:
             yield s
 
+    def get_read_session():
+        with Session(read_engine) as s:
+            yield s
+
     @router.post("/receta/guardar")
     def receta_guardar(
         patient_id: int = Form(...),
@@ -45,11 +57,7 @@ def make_router(engine):
             try:
                 dia_ini = fdt.replace(hour=0, minute=0, second=0, microsecond=0)
                 dia_fin = fdt.replace(hour=23, minute=59, second=59, microsecond=999999)
-                c = session.exec(
-                    select(Consulta)
-                    .where((Consulta.patient_id == patient_id) & (Consulta.fecha >= dia_ini) & (Consulta.fecha <= dia_fin))
-                    .order_by(Consulta.fecha.desc())
-                ).first()
+                c = session.exec(sentencias.consulta_del_dia(patient_id, dia_ini, dia_fin)).first()
                 if c:
                     consulta_id = c.id
             except Exception:
@@ -57,30 +65,30 @@ def make_router(engine):
 
         hist = None
         if consulta_id:
-            hist = session.exec(
-                select(RecetaHistory).where(RecetaHistory.consulta_id == consulta_id).order_by(RecetaHistory.fecha.desc())
-            ).first()
+            hist = session.exec(sentencias.receta_de_consulta(consulta_id)).first()
 
+        clave = pdf.clave_contenido(patient_id, fdt.date().isoformat(), items, recomendaciones, proxima_cita)
         if hist:
             hist.items_json = items_json
             hist.recomendaciones = recomendaciones
             hist.proxima_cita = proxima_cita
             hist.fecha = fdt
+            hist.contenido_hash = clave
         else:
             hist = RecetaHistory(
-                patient_id=patient_id, consulta_id=consulta_id, fecha=fdt,
+                patient_id=patient_id, consulta_id=consulta_id, fecha=fdt, contenido_hash=clave,
                 items_json=items_json, recomendaciones=recomendaciones, proxima_cita=proxima_cita
             )
             session.add(hist)
 
+        session.flush()
+        recetas_items.sincronizar(session, hist, items)
         session.commit()
         return {"ok": True, "hist_id": hist.id, "consulta_id": consulta_id}
 
     @router.get("/receta/por-consulta/{consulta_id}")
-    def receta_por_consulta(consulta_id: int, session: Session = Depends(get_session)):
-        hist = session.exec(
-            select(RecetaHistory).where(RecetaHistory.consulta_id == consulta_id).order_by(RecetaHistory.fecha.desc())
-        ).first()
+    def receta_por_consulta(consulta_id: int, session: Session = Depends(get_read_session)):
+        hist = session.exec(sentencias.receta_de_consulta(consulta_id)).first()
         if not hist:
             return JSONResponse({"ok": False, "error": "No hay receta ligada a esta consulta."}, status_code=404)
         try:
@@ -92,4 +100,96 @@ def make_router(engine):
             "recomendaciones": hist.recomendaciones, "proxima_cita": hist.proxima_cita,
             "fecha": hist.fecha.isoformat()
         }}
+
+    def _rango(desde, hasta):
+        d1 = datetime.fromisoformat(desde) if desde else None
+        d2 = datetime.fromisoformat(hasta) + timedelta(days=1) if hasta else None
+        return d1, d2
+
+    # Medicamentos más recetados en un periodo (tabla de renglones, sin json.loads)
+    @router.get("/api/medicamentos/top")
+    def medicamentos_top(desde: Optional[str] = None, hasta: Optional[str] = None, limit: int = 20,
+                         session: Session = Depends(get_read_session)):
+        try:
+            d1, d2 = _rango(desde, hasta)
+        except ValueError:
+            return JSONResponse({"ok": False, "error": "Fecha inválida"}, status_code=400)
+        stmt = sentencias.medicamentos_top(d1, d2, min(max(limit, 1), 200))
+        items = [{"medicamento": nombre, "recetas": n, "pacientes": np} for _, nombre, n, np in session.exec(stmt).all()]
+        return {"ok": True, "desde": desde, "hasta": hasta, "items": items}
+
+    # Pacientes a los que se les ha recetado un medicamento (prefijo, sin acentos)
+    @router.get("/api/medicamentos/pacientes")
+    def pacientes_por_medicamento(q: str, desde: Optional[str] = None, hasta: Optional[str] = None,
+                                  limit: int = 200, session: Session = Depends(get_read_session)):
+        qn = fold(q)
+        if not qn:
+            return JSONResponse({"ok": False, "error": "Indica el medicamento"}, status_code=400)
+        try:
+            d1, d2 = _rango(desde, hasta)
+        except ValueError:
+            return JSONResponse({"ok": False, "error": "Fecha inválida"}, status_code=400)
+        stmt = sentencias.pacientes_por_medicamento(qn, d1, d2, min(max(limit, 1), 1000))
+        items = [{"patient_id": pid, "paciente": nombre, "recetas": n, "ultima": ult.isoformat() if ult else None, "medicamento": med}
+                 for pid, nombre, n, ult, med in session.exec(stmt).all()]
+        return {"ok": True, "q": q, "items": items}
+
+    def _cargar_lote(desde, hasta, ids):
+        stmt = (
+            select(RecetaHistory, Patient.nombre)
+            .join(Patient, Patient.id == RecetaHistory.patient_id, isouter=True)
+            .order_by(RecetaHistory.fecha, RecetaHistory.id)
+        )
+        if ids:
+            try:
+                lista = [int(x) for x in ids.split(",") if x.strip()]
+            except ValueError:
+                return None
+            stmt = stmt.where(RecetaHistory.id.in_(lista))
+        else:
+            try:
+                d1 = datetime.fromisoformat(desde) if desde else datetime.now()
+                d2 = datetime.fromisoformat(hasta) if hasta else d1
+            except ValueError:
+                return None
+            d1 = d1.replace(hour=0, minute=0, second=0, microsecond=0)
+            d2 = d2.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+            stmt = stmt.where((RecetaHistory.fecha >= d1) & (RecetaHistory.fecha < d2))
+        with Session(read_engine) as s:
+            rows = s.exec(stmt.limit(lote_pdf.MAX_RECETAS + 1)).all()
+            return [lote_pdf.receta_para_lote(h, nombre) for h, nombre in rows]
+
+    # Lote de recetas (rango de fechas o lista de ids) en un solo PDF, dibujado en el pool de procesos
+    @router.get("/receta/lote.pdf")
+    async def receta_lote(desde: Optional[str] = None, hasta: Optional[str] = None, ids: Optional[str] = None):
+        recetas = await run_in_threadpool(_cargar_lote, desde, hasta, ids)
+        if recetas is None:
+            return JSONResponse({"ok": False, "error": "Parámetros inválidos (desde/hasta YYYY-MM-DD o ids=1,2,3)"}, status_code=400)
+        if not recetas:
+            return JSONResponse({"ok": False, "error": "No hay recetas en ese rango."}, status_code=404)
+        if len(recetas) > lote_pdf.MAX_RECETAS:
+            return JSONResponse({"ok": False, "error": f"Máximo {lote_pdf.MAX_RECETAS} recetas por lote."}, status_code=413)
+
+        tmp = lote_pdf.directorio_temporal()
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        try:
+            futs = [
+                loop.run_in_executor(lote_pdf.pool(), lote_pdf.dibujar_fragmento, frag, os.path.join(tmp, f"{i:05d}.pdf"))
+                for i, frag in enumerate(lote_pdf.fragmentos(recetas))
+            ]
+            rutas = await asyncio.gather(*futs)
+            destino = await loop.run_in_executor(lote_pdf.pool(), lote_pdf.unir, rutas, os.path.join(tmp, "lote.pdf"))
+            metricas.observar_pdf(time.perf_counter() - t0, "lote")
+        except Exception:
+            lote_pdf.limpiar(tmp)
+            raise
+        headers = {"Content-Disposition": 'inline; filename="recetas_lote.pdf"', "X-Recetas": str(len(recetas))}
+        return FileResponse(destino, media_type="application/pdf", headers=headers,
+                            background=BackgroundTask(lote_pdf.limpiar, tmp))
+
+    @router.on_event("shutdown")
+    def _cerrar_pool_pdf():
+        lote_pdf.cerrar()
+
     return router
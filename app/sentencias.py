@@ -0,0 +1,154 @@
+from datetime import datetime
+from sqlalchemy import and_, distinct, func, or_
+from sqlmodel import select
+
+from app.models import (Appointment, CalendarioDia, Consulta, ConsultaVitales, PacienteFusion, Patient, PatientExtra,
+                        RecetaHistory, RecetaHistoryItem)
+
+# Sentencias de las rutas calientes. Las rutas las arman con estas funciones y
+# `python -m app.migraciones --check` revisa el plan de esas mismas sentencias
+# (más las de SQL escrito a mano de cada módulo, ver calientes()), así que lo
+# que se verifica es exactamente lo que se ejecuta.
+
+
+# --------- Expediente ---------
+def pacientes_pagina(pos, limite: int):
+    # Keyset sobre (created_at, id); pos = (created_at, id) del último de la página anterior
+    stmt = select(Patient).order_by(Patient.created_at.desc(), Patient.id.desc())
+    if pos:
+        ts, pid = pos
+        stmt = stmt.where(or_(Patient.created_at < ts, and_(Patient.created_at == ts, Patient.id < pid)))
+    return stmt.limit(limite)
+
+
+def conteo_consultas(ids):
+    return select(Consulta.patient_id, func.count(Consulta.id)).where(Consulta.patient_id.in_(ids)).group_by(Consulta.patient_id)
+
+
+def citas_rango(inicio, fin, con_paciente_faltante: bool = False):
+    # Citas con su paciente; con_paciente_faltante=True también las de pacientes borrados
+    return (
+        select(Appointment, Patient)
+        .join(Patient, Patient.id == Appointment.patient_id, isouter=con_paciente_faltante)
+        .where((Appointment.fecha >= inicio) & (Appointment.fecha <= fin))
+        .order_by(Appointment.fecha)
+    )
+
+
+# --------- Paciente ---------
+def extra_paciente(pid: int):
+    return select(PatientExtra).where(PatientExtra.patient_id == pid)
+
+
+def ultima_consulta(pid: int):
+    return select(Consulta.id).where(Consulta.patient_id == pid).order_by(Consulta.fecha.desc()).limit(1)
+
+
+def pacientes_por_id(ids):
+    return select(Patient).where(Patient.id.in_(ids))
+
+
+# --------- Recetas ---------
+def consulta_del_dia(pid: int, dia_ini, dia_fin):
+    return (
+        select(Consulta)
+        .where((Consulta.patient_id == pid) & (Consulta.fecha >= dia_ini) & (Consulta.fecha <= dia_fin))
+        .order_by(Consulta.fecha.desc())
+    )
+
+
+def receta_de_consulta(consulta_id: int):
+    return select(RecetaHistory).where(RecetaHistory.consulta_id == consulta_id).order_by(RecetaHistory.fecha.desc())
+
+
+def receta_por_contenido(clave: str, pid: int):
+    return select(RecetaHistory).where((RecetaHistory.contenido_hash == clave) & (RecetaHistory.patient_id == pid))
+
+
+def medicamentos_top(d1, d2, limite: int):
+    I = RecetaHistoryItem
+    stmt = select(I.medicamento_norm, func.min(I.medicamento), func.count(distinct(I.receta_id)), func.count(distinct(I.patient_id)))
+    if d1:
+        stmt = stmt.where(I.fecha >= d1)
+    if d2:
+        stmt = stmt.where(I.fecha < d2)
+    return stmt.group_by(I.medicamento_norm).order_by(func.count(distinct(I.receta_id)).desc()).limit(limite)
+
+
+def pacientes_por_medicamento(qn: str, d1, d2, limite: int):
+    # qn: prefijo ya normalizado (texto.fold)
+    I = RecetaHistoryItem
+    stmt = (
+        select(I.patient_id, Patient.nombre, func.count(distinct(I.receta_id)), func.max(I.fecha), func.min(I.medicamento))
+        .join(Patient, Patient.id == I.patient_id, isouter=True)
+        .where((I.medicamento_norm >= qn) & (I.medicamento_norm < qn + "\uffff"))
+    )
+    if d1:
+        stmt = stmt.where(I.fecha >= d1)
+    if d2:
+        stmt = stmt.where(I.fecha < d2)
+    return stmt.group_by(I.patient_id).order_by(func.max(I.fecha).desc()).limit(limite)
+
+
+# --------- Consultas ---------
+def vitales_paciente(pid: int, d1, d2):
+    stmt = select(ConsultaVitales).where(ConsultaVitales.patient_id == pid)
+    if d1:
+        stmt = stmt.where(ConsultaVitales.fecha >= d1)
+    if d2:
+        stmt = stmt.where(ConsultaVitales.fecha < d2)
+    return stmt.order_by(ConsultaVitales.fecha)
+
+
+# --------- Calendario e importación ---------
+def dias_calendario(d1: str, d2: str):
+    return select(CalendarioDia).where((CalendarioDia.dia >= d1) & (CalendarioDia.dia <= d2))
+
+
+def ids_por_origen(modelo, origenes):
+    return select(modelo.origen_id, modelo.id).where(modelo.origen_id.in_(list(origenes)))
+
+
+def fusionados_por_origen(origenes):
+    return select(PacienteFusion.origen_id, PacienteFusion.conservado_id).where(PacienteFusion.origen_id.in_(list(origenes)))
+
+
+# --------- Verificación ---------
+def calientes() -> dict:
+    # nombre -> sentencia de SQLModel o (SQL, parámetros), con parámetros de ejemplo.
+    # Ninguna debe recorrer una tabla completa (ver migraciones.verificar_planes).
+    from app import agenda, busqueda, cache, duplicados, linea_tiempo, reconciliacion
+
+    dia, fin = datetime(2024, 1, 1), datetime(2024, 1, 1, 23, 59, 59)
+    consultas = {
+        "expediente: pacientes (keyset)": pacientes_pagina((dia, 1), 51),
+        "expediente: conteo de consultas": conteo_consultas([1, 2, 3]),
+        "expediente: citas del día": citas_rango(dia, fin, con_paciente_faltante=True),
+        "agenda: citas del rango": citas_rango(dia, fin),
+        "paciente: extra": extra_paciente(1),
+        "paciente: última consulta": ultima_consulta(1),
+        "búsqueda: pacientes por id": pacientes_por_id([1, 2]),
+        "receta: consulta del mismo día": consulta_del_dia(1, dia, fin),
+        "receta: por consulta": receta_de_consulta(1),
+        "receta: reimpresión": receta_por_contenido("x", 1),
+        "recetas: medicamentos más recetados": medicamentos_top(dia, datetime(2024, 4, 1), 20),
+        "recetas: pacientes por medicamento": pacientes_por_medicamento("para", None, None, 200),
+        "consultas: serie de vitales": vitales_paciente(1, dia, None),
+        "calendario: versiones del rango": dias_calendario("2024-01-01", "2024-01-31"),
+        "importación: pacientes por origen": ids_por_origen(Patient, ["a", "b"]),
+        "importación: citas por origen": ids_por_origen(Appointment, ["a", "b"]),
+        "importación: pacientes fusionados por origen": fusionados_por_origen(["a", "b"]),
+        "caché: versión": (cache.LEER_VERSION_SQL, {"c": "x"}),
+        "agenda: citas del día": (agenda.CITAS_DEL_DIA_SQL, {"a": "2024-01-01", "b": "2024-01-02"}),
+        "búsqueda: pacientes": (busqueda.BUSCAR_SQL, {"m": '"x"*', "lim": 50, "off": 0}),
+        "consultas: diagnóstico": (busqueda.dx_sql(" AND c.fecha >= :desde"), {"m": '"x"*', "desde": "2024-01-01", "lim": 50, "off": 0}),
+        "reconciliación: recetas del día": (reconciliacion.DEL_DIA_SQL, {"cid": 1, "pid": 1, "ini": "2024-01-01", "fin": "2024-01-02"}),
+        "duplicados: bloques de las claves": (duplicados.bloques_sql(2), {"k0": "c:jose|peres", "k1": "t:1779965"}),
+        "duplicados: datos de pacientes": (f"{duplicados.DATOS_SQL} WHERE p.id IN (1, 2)", {}),
+        "duplicados: fusionado": (duplicados.DESTINO_SQL, {"d": 1}),
+    }
+    for tabla, sql in duplicados.REASIGNAR.items():
+        consultas[f"duplicados: fusión de {tabla}"] = (sql, {"k": 1, "d": 2})
+    sql, params = linea_tiempo.sql_pagina(list(linea_tiempo.TIPOS), ("2024-01-01", "receta", 5), linea_tiempo.POR_PAGINA + 1)
+    consultas["paciente: línea de tiempo"] = (sql, {**params, "pid": 1})
+    return consultas
@@ -104,7 +104,20 @@ _savingCita = true;
   if (pid != null) fd.set("patient_id", String(parseInt(pid, 10)));
 
   try{
-    const r = await fetch("/api/appointments", { method:"POST", body: fd });
+    let r = await fetch("/api/appointments", { method:"POST", body: fd });
+    // 409: se empalma con otra cita -> mostrar huecos sugeridos y permitir forzar
+    if (r.status === 409){
+      const e = await r.json().catch(()=> ({}));
+      const sug = (e.sugerencias || []).map(function(s){ return s.replace("T", " "); }).join(", ");
+      if (msg) msg.textContent = "Se empalma con otra cita." + (sug ? " Libres: " + sug : "");
+      if (confirm("La cita se empalma con otra." + (sug ? "\nHuecos libres: " + sug : "") + "\n¿Agendar de todos modos?")){
+        fd.set("forzar", "1");
+        r = await fetch("/api/appointments", { method:"POST", body: fd });
+      } else {
+        if (btn) btn.textContent = "⚠️ Empalme";
+        return;
+      }
+    }
     // Log de respuesta cruda si no es OK (para depurar)
     if (!r.ok) {
       const txt = await r.text().catch(()=> "");
@@ -190,6 +203,34 @@ window.guardarCita = guardarCita;
   // =========================
   // Calendario
   // =========================
+  // Caché por día {etag, items}: revalida con If-None-Match (304 si no cambió)
+  // y precarga los días vecinos con /api/calendar/rango
+  var _calCache = {};
+  function isoDia(d){ return d.getFullYear()+"-"+pad(d.getMonth()+1)+"-"+pad(d.getDate()); }
+  function sumarDias(iso, n){ var d = new Date(iso+"T12:00:00"); d.setDate(d.getDate()+n); return isoDia(d); }
+
+  function pintarCalendario(list, items){
+    list.innerHTML = "";
+    (items || []).forEach(function(ap){
+      var li = document.createElement("li");
+      li.textContent = ap.hora + " — " + ap.paciente + (ap.nota ? " · " + ap.nota : "");
+      list.appendChild(li);
+    });
+  }
+
+  async function precargarVecinos(day){
+    var antes = sumarDias(day, -1), despues = sumarDias(day, 1);
+    if (_calCache[antes] && _calCache[despues]) return;
+    try{
+      var r = await fetch("/api/calendar/rango?desde="+antes+"&hasta="+despues);
+      if (!r.ok) return;
+      var data = await r.json();
+      (data.dias || []).forEach(function(d){
+        if (!_calCache[d.day]) _calCache[d.day] = { etag: d.etag, items: d.items };
+      });
+    } catch(e){ /* no-op */ }
+  }
+
   async function cargarCalendario(dayISO){
     var input = document.getElementById("calendar-day");
     var list  = document.getElementById("calendar-list");
@@ -199,16 +240,18 @@ if (!input && !list) return; // <-- si no hay UI, no pedimos al backend
       var d = new Date(); day = d.toISOString().slice(0,10);
       if (input) input.value = day;
     }
+    var cached = _calCache[day];
+    if (cached && list) pintarCalendario(list, cached.items);
     try{
-      var r = await fetch("/api/calendar?day="+encodeURIComponent(day));
-      var data = await r.json();
-      list.innerHTML = "";
-      (data.items || []).forEach(function(ap){
-        var li = document.createElement("li");
-        li.textContent = ap.hora + " — " + ap.paciente + (ap.nota ? " · " + ap.nota : "");
-        list.appendChild(li);
-      });
+      var headers = cached && cached.etag ? { "If-None-Match": cached.etag } : {};
+      var r = await fetch("/api/calendar?day="+encodeURIComponent(day), { headers: headers, cache: "no-store" });
+      if (r.status !== 304){
+        var data = await r.json();
+        _calCache[day] = { etag: r.headers.get("ETag") || data.etag, items: data.items || [] };
+        if (list) pintarCalendario(list, _calCache[day].items);
+      }
     } catch(e){ /* no-op */ }
+    precargarVecinos(day);
   }
   window.cargarCalendario = cargarCalendario;
 
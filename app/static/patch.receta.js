@@ -50,8 +50,40 @@
       btn.disabled = false;
     }
   }
+  // Autocompletado de medicamentos / dosificaciones (top-k por uso)
+  var SUGERENCIAS = { meds: "/api/catalogo/medicamentos", dosif: "/api/catalogo/dosificaciones" };
+  var _sugTimer = null, _sugSeq = 0;
+  function llenarSugerencias(listId, q){
+    var dl = document.getElementById(listId);
+    if (!dl) return;
+    var seq = ++_sugSeq;
+    fetch(SUGERENCIAS[listId] + "?k=15&q=" + encodeURIComponent(q || ""))
+      .then(function(r){ return r.json(); })
+      .then(function(data){
+        if (seq !== _sugSeq) return; // llegó una respuesta más nueva
+        dl.innerHTML = "";
+        (data.items || []).forEach(function(it){
+          var opt = document.createElement("option");
+          opt.value = it.texto;
+          dl.appendChild(opt);
+        });
+      })
+      .catch(function(){ /* no-op */ });
+  }
+  function onSugerenciaInput(ev){
+    var el = ev.target;
+    var listId = el && el.getAttribute && el.getAttribute("list");
+    if (!listId || !SUGERENCIAS[listId]) return;
+    var q = el.value;
+    clearTimeout(_sugTimer);
+    _sugTimer = setTimeout(function(){ llenarSugerencias(listId, q); }, ev.type === "focusin" ? 0 : 150);
+  }
+
   function ready(fn){ if (document.readyState !== "loading") fn(); else document.addEventListener("DOMContentLoaded", fn); }
   ready(function(){
+    // captura: el oninput del campo de dosificación lo vacía inmediatamente
+    document.addEventListener("input", onSugerenciaInput, true);
+    document.addEventListener("focusin", onSugerenciaInput, true);
     var btn = document.getElementById("btn-guardar-receta");
     if (btn){
       btn.addEventListener("click", guardarRecetaClick);
@@ -0,0 +1,18 @@
+import re
+import unicodedata
+
+_espacios = re.compile(r"\s+")
+_no_digitos = re.compile(r"\D+")
+
+
+def fold(texto: str | None) -> str:
+    # minúsculas, sin acentos y con espacios colapsados ("Rodríguez " -> "rodriguez")
+    if not texto:
+        return ""
+    t = unicodedata.normalize("NFKD", texto)
+    t = "".join(ch for ch in t if not unicodedata.combining(ch))
+    return _espacios.sub(" ", t.casefold()).strip()
+
+
+def solo_digitos(texto: str | None) -> str:
+    return _no_digitos.sub("", texto or "")
@@ -0,0 +1,47 @@
+import re
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.models import ConsultaVitales
+
+# Convierte los signos vitales capturados como texto libre ("120/80",
+# "80 x min", "80 kg", "1.70 m") en columnas numéricas de ConsultaVitales.
+_num = re.compile(r"(\d+(?:[.,]\d+)?)")
+_ta = re.compile(r"(\d{2,3})\s*/\s*(\d{2,3})")
+
+
+def _numero(texto):
+    m = _num.search(str(texto or ""))
+    return float(m.group(1).replace(",", ".")) if m else None
+
+
+def _entero(texto):
+    n = _numero(texto)
+    return int(round(n)) if n is not None else None
+
+
+def parsear(vitales: dict | None) -> dict:
+    v = vitales or {}
+    out = {"ta_sistolica": None, "ta_diastolica": None}
+    m = _ta.search(str(v.get("TA") or ""))
+    if m:
+        out["ta_sistolica"], out["ta_diastolica"] = int(m.group(1)), int(m.group(2))
+    out["fc"] = _entero(v.get("FC"))
+    out["fr"] = _entero(v.get("FR"))
+    out["peso_kg"] = _numero(v.get("Peso"))
+    talla = _numero(v.get("Talla"))
+    if talla is not None and talla > 3:  # capturada en cm
+        talla = talla / 100
+    out["talla_m"] = round(talla, 3) if talla is not None else None
+    if out["peso_kg"] and out["talla_m"]:
+        out["imc"] = round(out["peso_kg"] / (out["talla_m"] ** 2), 1)
+    else:
+        out["imc"] = None
+    return out
+
+
+def guardar(session, consulta, vitales: dict | None):
+    # Inserta o reemplaza la fila de vitales de la consulta (no hace commit)
+    fila = {"consulta_id": consulta.id, "patient_id": consulta.patient_id, "fecha": consulta.fecha, **parsear(vitales)}
+    stmt = sqlite_insert(ConsultaVitales).values(fila)
+    stmt = stmt.on_conflict_do_update(index_elements=["consulta_id"], set_={k: stmt.excluded[k] for k in fila if k != "consulta_id"})
+    session.execute(stmt)
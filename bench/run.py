@@ -0,0 +1,223 @@
+"""Benchmark de las rutas calientes contra una base sintética (bench.seed).
+
+Corre la app en el mismo proceso (ASGI, sin red) y mide por escenario la
+latencia p50/p95/p99, las sentencias SQL por petición (cabecera X-Query-Count
+de app.metricas) y el pico de memoria asignada. Guarda el resultado en JSON y
+puede compararlo con una corrida anterior para detectar regresiones.
+
+    python -m bench.seed --db sqlite:///./bench.db
+    python -m bench.run --db sqlite:///./bench.db -n 200 --salida bench-actual.json
+    python -m bench.run --db sqlite:///./bench.db --comparar bench-anterior.json
+    python -m bench.run --db sqlite:///./bench.db --con-respaldo --comparar bench-actual.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+
+def _percentil(valores, p):
+    if not valores:
+        return None
+    orden = sorted(valores)
+    k = (len(orden) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(orden) - 1)
+    return orden[i] + (orden[j] - orden[i]) * (k - i)
+
+
+def _rangos(ruta_db):
+    con = sqlite3.connect(ruta_db)
+    try:
+        r = {t: con.execute(f"SELECT count(*), min(id), max(id) FROM {t}").fetchone()
+             for t in ("patient", "consulta", "recetahistory", "appointment")}
+        dias = con.execute("SELECT min(fecha), max(fecha) FROM appointment").fetchone()
+    finally:
+        con.close()
+    return r, dias
+
+
+def escenarios(rnd, rangos, dias):
+    from bench.seed import APELLIDOS, DOSIS, MEDICAMENTOS
+
+    pac = rangos["patient"]
+    con = rangos["consulta"]
+    d0 = date.fromisoformat(dias[0][:10]) if dias[0] else date.today()
+    d1 = date.fromisoformat(dias[1][:10]) if dias[1] else date.today()
+
+    def pid():
+        return rnd.randint(pac[1], pac[2])
+
+    def receta_pdf(c):
+        items = [{"nombre": rnd.choice(MEDICAMENTOS), "indicacion": rnd.choice(DOSIS)} for _ in range(rnd.randint(1, 3))]
+        return c.post("/receta/pdf", data={
+            "patient_id": pid(), "fecha": (d0 + timedelta(days=rnd.randrange((d1 - d0).days + 1))).isoformat(),
+            "items_json": json.dumps(items, ensure_ascii=False), "recomendaciones": "Reposo relativo",
+        })
+
+    return {
+        "expediente": lambda c: c.get("/expediente"),
+        "expediente_q": lambda c: c.get("/expediente", params={"q": rnd.choice(APELLIDOS)}),
+        "paciente": lambda c: c.get(f"/paciente/{pid()}"),
+        "linea_tiempo": lambda c: c.get(f"/api/pacientes/{pid()}/linea-tiempo"),
+        "consulta": lambda c: c.get(f"/consulta/{rnd.randint(con[1], con[2])}") if con[0] else c.get("/consulta/1"),
+        "calendar": lambda c: c.get("/api/calendar", params={
+            "day": (d0 + timedelta(days=rnd.randrange((d1 - d0).days + 1))).isoformat()}),
+        "receta_nueva": lambda c: c.get(f"/receta/nueva/{pid()}"),
+        "receta_pdf": receta_pdf,
+    }
+
+
+def medir(client, fn, n, calentamiento, n_memoria):
+    for _ in range(calentamiento):
+        fn(client)
+    tiempos, consultas, errores = [], [], 0
+    for _ in range(n):
+        t0 = time.perf_counter()
+        r = fn(client)
+        tiempos.append((time.perf_counter() - t0) * 1000)
+        if r.status_code >= 400:
+            errores += 1
+        if "x-query-count" in r.headers:
+            consultas.append(int(r.headers["x-query-count"]))
+    # Memoria en una pasada aparte: tracemalloc distorsiona la latencia
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for _ in range(n_memoria):
+        fn(client)
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "n": n,
+        "errores": errores,
+        "p50_ms": round(_percentil(tiempos, 50), 3),
+        "p95_ms": round(_percentil(tiempos, 95), 3),
+        "p99_ms": round(_percentil(tiempos, 99), 3),
+        "media_ms": round(statistics.fmean(tiempos), 3),
+        "consultas_p50": _percentil(consultas, 50),
+        "consultas_max": max(consultas) if consultas else None,
+        "pico_memoria_kb": round(pico / 1024, 1),
+    }
+
+
+def comparar(actual, anterior, tolerancia):
+    # Imprime la tabla de diferencias; devuelve los escenarios con regresión en p95
+    regresiones = []
+    print(f"{'escenario':<14} {'p50 ms':>18} {'p95 ms':>18} {'consultas':>11} {'memoria kb':>20}")
+    for nombre, r in actual["escenarios"].items():
+        a = anterior.get("escenarios", {}).get(nombre)
+        if not a:
+            print(f"{nombre:<14} (nuevo)")
+            continue
+        delta = (r["p95_ms"] - a["p95_ms"]) / a["p95_ms"] * 100 if a["p95_ms"] else 0.0
+        marca = " <-- regresión" if delta > tolerancia else ""
+        if marca:
+            regresiones.append(nombre)
+        print(f"{nombre:<14} {a['p50_ms']:>8.2f} → {r['p50_ms']:<8.2f} {a['p95_ms']:>8.2f} → {r['p95_ms']:<8.2f}"
+              f" {a['consultas_p50'] or 0:>4} → {r['consultas_p50'] or 0:<4} {a['pico_memoria_kb']:>9} → {r['pico_memoria_kb']:<9}"
+              f" ({delta:+.0f}% p95){marca}")
+    return regresiones
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--db", default="sqlite:///./bench.db")
+    ap.add_argument("-n", type=int, default=200, help="peticiones medidas por escenario")
+    ap.add_argument("--calentamiento", type=int, default=10)
+    ap.add_argument("--n-memoria", type=int, default=20, help="peticiones para medir el pico de memoria")
+    ap.add_argument("--escenarios", default="", help="separados por coma (por defecto todos)")
+    ap.add_argument("--semilla", type=int, default=7)
+    ap.add_argument("--salida", default=None, help="archivo JSON con los resultados")
+    ap.add_argument("--comparar", default=None, help="JSON de una corrida anterior")
+    ap.add_argument("--tolerancia", type=float, default=20.0, help="%% de aumento en p95 que cuenta como regresión")
+    ap.add_argument("--con-respaldo", action="store_true", help="respalda la base sin parar mientras se mide (app.respaldos)")
+    args = ap.parse_args(argv)
+
+    ruta_db = args.db.replace("sqlite:///", "", 1)
+    if not os.path.exists(ruta_db):
+        print(f"{ruta_db} no existe; genera los datos con: python -m bench.seed --db {args.db}")
+        return 1
+
+    # Antes de importar la app: base, cabecera de conteo de SQL y caché de PDF vacía
+    os.environ["DATABASE_URL"] = args.db
+    os.environ["METRICS_QUERY_HEADER"] = "1"
+    os.environ["PDF_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench_pdf_")
+    os.environ["RESPALDOS_DIR"] = tempfile.mkdtemp(prefix="bench_respaldos_")
+    os.environ["RESPALDOS_CADA_H"] = "0"
+    from fastapi.testclient import TestClient
+    from app import respaldos
+    from app.main import app
+
+    rangos, dias = _rangos(ruta_db)
+    rnd = random.Random(args.semilla)
+    todos = escenarios(rnd, rangos, dias)
+    elegidos = [e.strip() for e in args.escenarios.split(",") if e.strip()] or list(todos)
+
+    resultado = {
+        "meta": {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "db": args.db,
+            "registros": {t: r[0] for t, r in rangos.items()},
+            "n": args.n,
+        },
+        "escenarios": {},
+    }
+    parar = threading.Event()
+    copias = []
+
+    def respaldar_sin_parar():
+        while not parar.is_set():
+            copias.append(respaldos.respaldar(ruta_db, conservar=1))
+
+    if args.con_respaldo:
+        hilo = threading.Thread(target=respaldar_sin_parar, daemon=True)
+        hilo.start()
+    with TestClient(app) as client:
+        for nombre in elegidos:
+            r = medir(client, todos[nombre], args.n, args.calentamiento, args.n_memoria)
+            resultado["escenarios"][nombre] = r
+            print(f"{nombre:<14} p50 {r['p50_ms']:>8.2f} ms  p95 {r['p95_ms']:>8.2f} ms  p99 {r['p99_ms']:>8.2f} ms"
+                  f"  sql {r['consultas_p50']}  mem {r['pico_memoria_kb']} kb" + (f"  errores {r['errores']}" if r["errores"] else ""))
+    if args.con_respaldo:
+        parar.set()
+        hilo.join()
+        resultado["meta"]["respaldos"] = [{k: c[k] for k in ("duracion_s", "copia_s", "pasos", "reinicios")} for c in copias]
+        if copias:
+            print(f"respaldos durante la medición: {len(copias)}, copia por pasos "
+                  f"{statistics.fmean(c['copia_s'] for c in copias):.2f} s en promedio")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"resultados en {args.salida}")
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            anterior = json.load(f)
+        print(f"\ncomparación con {args.comparar} (commit {anterior.get('meta', {}).get('commit')})")
+        if comparar(resultado, anterior, args.tolerancia):
+            return 1
+    return 1 if any(r["errores"] for r in resultado["escenarios"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""Generador de datos sintéticos a escala realista para los benchmarks.
+
+Llena una base SQLite nueva con pacientes, consultas, recetas, citas y los
+catálogos aprendidos de medicamentos y dosificaciones. Es reproducible: la
+misma semilla produce la misma base. Las tablas derivadas (índices FTS,
+vitales tipados, renglones de receta, hashes) las calculan los rellenos de las
+migraciones, igual que en una base real que se actualiza.
+
+    python -m bench.seed --db sqlite:///./bench.db --escala 1
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+NOMBRES = ["José", "María", "Juan", "Guadalupe", "Francisco", "Ana", "Luis", "Rosa", "Jorge", "Laura",
+           "Carlos", "Patricia", "Miguel", "Sofía", "Alejandro", "Verónica", "Ramón", "Elena", "Héctor", "Lucía"]
+APELLIDOS = ["Hernández", "García", "Martínez", "López", "González", "Rodríguez", "Pérez", "Sánchez", "Ramírez",
+             "Cruz", "Flores", "Gómez", "Morales", "Vázquez", "Reyes", "Jiménez", "Torres", "Díaz", "Gutiérrez",
+             "Ruiz", "Mendoza", "Aguilar", "Ortiz", "Castillo", "Núñez", "Chávez", "Ibarra", "Treviño"]
+DIAGNOSTICOS = ["Lumbalgia mecánica", "Esguince de tobillo grado II", "Gonartrosis bilateral", "Fractura de radio distal",
+                "Tendinitis del manguito rotador", "Hipertensión arterial sistémica", "Diabetes mellitus tipo 2",
+                "Síndrome del túnel carpiano", "Cervicalgia", "Fascitis plantar", "Epicondilitis lateral",
+                "Condromalacia rotuliana", "Bursitis trocantérica", "Contractura muscular paravertebral"]
+MEDICAMENTOS = ["Paracetamol 500 mg", "Ibuprofeno 400 mg", "Naproxeno 250 mg", "Diclofenaco 100 mg", "Ketorolaco 10 mg",
+                "Tramadol 50 mg", "Celecoxib 200 mg", "Metocarbamol 400 mg", "Omeprazol 20 mg", "Complejo B",
+                "Pregabalina 75 mg", "Ciclobenzaprina 10 mg", "Meloxicam 15 mg", "Glucosamina 1500 mg",
+                "Metformina 850 mg", "Losartán 50 mg", "Etoricoxib 90 mg", "Dexketoprofeno 25 mg"]
+DOSIS = ["1 tableta cada 8 horas", "1 tableta cada 12 horas", "1 tableta cada 24 horas", "1 cápsula en ayunas",
+         "1 tableta antes de dormir", "1 sobre disuelto en agua cada 24 horas"]
+DURACIONES = ["por 5 días", "por 7 días", "por 10 días", "por 14 días", "por 30 días", "en caso de dolor"]
+RECOMENDACIONES = ["Compresas tibias 60min cada 8hr por 3 a 5 días mínimo", "No hacer ejercicio o cargar cosas pesadas",
+                   "Faja con soporte lumbar 24hr", "Usar Cabestrillo 24hr", "Rodillera con estabilizador de rótula 24hrs"]
+ALERGIAS = ["", "", "", "", "Penicilina", "Sulfas", "AINEs", "Látex"]
+APP = ["", "", "DM2", "HAS", "DM2,HAS", "Asma", "Hipotiroidismo"]
+
+ESCALA_BASE = {"pacientes": 20000, "consultas": 300000, "recetas": 200000, "citas": 50000}
+LOTE = 5000
+
+
+def _fmt(dt: datetime) -> str:
+    # Mismo formato en que SQLAlchemy guarda los DateTime en SQLite
+    return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _insertar(conn, tabla, filas):
+    if not filas:
+        return
+    cols = list(filas[0].keys())
+    conn.exec_driver_sql(
+        f"INSERT INTO {tabla} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})",
+        [tuple(f[c] for c in cols) for f in filas],
+    )
+
+
+def _usar(usos, clave, fecha):
+    # clave -> (veces, último uso)
+    n, ultimo = usos.get(clave, (0, fecha))
+    usos[clave] = (n + 1, max(ultimo, fecha))
+
+
+def generar(engine, pacientes, consultas, recetas, citas, semilla=42, hoy=None, log=print):
+    rnd = random.Random(semilla)
+    hoy = hoy or datetime(2025, 6, 2, 9, 0)
+    inicio = hoy - timedelta(days=5 * 365)
+    segundos_hist = int((hoy - inicio).total_seconds())
+
+    def fecha_hist():
+        return inicio + timedelta(seconds=rnd.randrange(segundos_hist))
+
+    t0 = time.perf_counter()
+    with engine.begin() as conn:
+        filas, extras = [], []
+        for pid in range(1, pacientes + 1):
+            nombre = f"{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}"
+            nac = datetime(rnd.randint(1940, 2015), rnd.randint(1, 12), rnd.randint(1, 28))
+            filas.append({"id": pid, "nombre": nombre, "edad": None, "sexo": rnd.choice("MF"),
+                          "telefono": f"834-{rnd.randint(100, 999)}-{rnd.randint(1000, 9999)}", "email": None,
+                          "alergias": rnd.choice(ALERGIAS) or None, "created_at": _fmt(fecha_hist())})
+            extras.append({"patient_id": pid, "fecha_nacimiento": nac.date().isoformat(),
+                           "app": rnd.choice(APP) or None, "cirugias_previas": None})
+            if len(filas) >= LOTE:
+                _insertar(conn, "patient", filas); _insertar(conn, "patientextra", extras)
+                filas, extras = [], []
+        _insertar(conn, "patient", filas); _insertar(conn, "patientextra", extras)
+        log(f"pacientes: {pacientes} ({time.perf_counter() - t0:.1f}s)")
+
+        # Consultas: se recuerda (paciente, día) -> id para enlazar parte de las recetas
+        por_dia = {}
+        filas = []
+        for cid in range(1, consultas + 1):
+            pid = rnd.randint(1, pacientes)
+            fecha = fecha_hist()
+            dx = rnd.choice(DIAGNOSTICOS)
+            payload = {
+                "padecimiento_actual": f"Dolor de {rnd.randint(1, 30)} días de evolución",
+                "exploracion_fisica": "Sin datos de compromiso neurovascular",
+                "estudios_complementarios": rnd.choice(["", "Rx AP y lateral", "USG", "RM"]),
+                "diagnosticos": dx,
+                "plan_manejo": "Analgésico, reposo relativo",
+                "vitales": {"TA": f"{rnd.randint(100, 150)}/{rnd.randint(60, 95)}", "FC": f"{rnd.randint(60, 100)} x min",
+                            "FR": f"{rnd.randint(14, 22)} x min", "Peso": f"{rnd.randint(45, 110)} kg",
+                            "Talla": f"1.{rnd.randint(45, 95)} m"},
+                "notas_libres": "",
+            }
+            filas.append({"id": cid, "patient_id": pid, "fecha": _fmt(fecha), "motivo": "—", "dx": dx,
+                          "tratamiento": payload["plan_manejo"], "notas": json.dumps(payload, ensure_ascii=False)})
+            por_dia.setdefault((pid, fecha.date()), cid)
+            if len(filas) >= LOTE:
+                _insertar(conn, "consulta", filas); filas = []
+        _insertar(conn, "consulta", filas)
+        log(f"consultas: {consultas} ({time.perf_counter() - t0:.1f}s)")
+
+        # Recetas (70% ligadas a una consulta existente) y catálogos aprendidos
+        usos_med, usos_dosis = {}, {}
+        claves = list(por_dia.items())
+        filas = []
+        for rid in range(1, recetas + 1):
+            if claves and rnd.random() < 0.7:
+                (pid, dia), cid = rnd.choice(claves)
+                fecha = datetime.combine(dia, datetime.min.time()) + timedelta(hours=rnd.randint(9, 19))
+            else:
+                pid, cid, fecha = rnd.randint(1, pacientes), None, fecha_hist()
+            items = []
+            for _ in range(rnd.randint(1, 4)):
+                med, dosis, dur = rnd.choice(MEDICAMENTOS), rnd.choice(DOSIS), rnd.choice(DURACIONES)
+                items.append({"nombre": med, "indicacion": f"{dosis}\n{dur}"})
+                _usar(usos_med, med, fecha)
+                _usar(usos_dosis, dosis, fecha)
+                _usar(usos_dosis, dur, fecha)
+            filas.append({"id": rid, "patient_id": pid, "consulta_id": cid, "fecha": _fmt(fecha),
+                          "items_json": json.dumps(items, ensure_ascii=False),
+                          "recomendaciones": rnd.choice(RECOMENDACIONES) if rnd.random() < 0.5 else None,
+                          "proxima_cita": None})
+            if len(filas) >= LOTE:
+                _insertar(conn, "recetahistory", filas); filas = []
+        _insertar(conn, "recetahistory", filas)
+        creado = _fmt(inicio)
+        _insertar(conn, "medicine", [{"nombre": m, "created_at": creado, "usos": n, "ultimo_uso": _fmt(u)}
+                                     for m, (n, u) in usos_med.items()])
+        _insertar(conn, "dosificacion", [{"texto": d, "created_at": creado, "usos": n, "ultimo_uso": _fmt(u)}
+                                         for d, (n, u) in usos_dosis.items()])
+        log(f"recetas: {recetas} ({time.perf_counter() - t0:.1f}s)")
+
+        # Citas: últimos 12 meses y próximos 6, en horario de consulta
+        filas = []
+        dia0 = hoy.date() - timedelta(days=365)
+        for aid in range(1, citas + 1):
+            dia = dia0 + timedelta(days=rnd.randrange(365 + 183))
+            fecha = datetime.combine(dia, datetime.min.time()) + timedelta(minutes=rnd.choice(range(9 * 60, 20 * 60, 30)))
+            filas.append({"id": aid, "patient_id": rnd.randint(1, pacientes), "fecha": _fmt(fecha),
+                          "notas": rnd.choice(["", "", "control", "revisión de estudios", "retiro de férula"]),
+                          "duracion_min": 30})
+            if len(filas) >= LOTE:
+                _insertar(conn, "appointment", filas); filas = []
+        _insertar(conn, "appointment", filas)
+        log(f"citas: {citas} ({time.perf_counter() - t0:.1f}s)")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--db", default="sqlite:///./bench.db")
+    ap.add_argument("--escala", type=float, default=1.0, help=f"multiplica {ESCALA_BASE}")
+    for k in ESCALA_BASE:
+        ap.add_argument(f"--{k}", type=int, default=None)
+    ap.add_argument("--semilla", type=int, default=42)
+    ap.add_argument("--forzar", action="store_true", help="borra la base si ya existe")
+    args = ap.parse_args(argv)
+
+    from sqlmodel import SQLModel
+    from app.db import make_engine
+    from app.migraciones import migrar
+    import app.models  # noqa: F401  (registra las tablas)
+
+    ruta = args.db.replace("sqlite:///", "", 1)
+    if os.path.exists(ruta):
+        if not args.forzar:
+            print(f"{ruta} ya existe (usa --forzar para regenerarla)")
+            return 1
+        for sufijo in ("", "-wal", "-shm"):
+            if os.path.exists(ruta + sufijo):
+                os.remove(ruta + sufijo)
+
+    n = {k: getattr(args, k) if getattr(args, k) is not None else int(v * args.escala) for k, v in ESCALA_BASE.items()}
+    engine = make_engine(args.db)
+    SQLModel.metadata.create_all(engine)
+    t0 = time.perf_counter()
+    generar(engine, n["pacientes"], n["consultas"], n["recetas"], n["citas"], args.semilla)
+    # Los rellenos de las migraciones calculan FTS, vitales, hashes y renglones
+    t1 = time.perf_counter()
+    aplicadas = migrar(engine)
+    print(f"{len(aplicadas)} migraciones (rellenos) en {time.perf_counter() - t1:.1f}s")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+    engine.dispose()
+    print(f"listo: {args.db} en {time.perf_counter() - t0:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
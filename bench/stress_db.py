@@ -0,0 +1,116 @@
+"""Prueba de estrés de concurrencia sobre SQLite.
+
+Simula varios workers de uvicorn (procesos) con hilos que leen y escriben a la
+vez sobre el mismo archivo, usando la misma configuración de engine que la app
+(app.db.make_engine). Falla si alguna operación termina en "database is locked".
+
+    python -m bench.stress_db --procesos 4 --hilos 8 --segundos 10
+"""
+import argparse
+import multiprocessing as mp
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+def _worker(url, hilos, segundos, semilla, salida):
+    from sqlalchemy.exc import OperationalError
+    from sqlmodel import Session, select, func
+    from app.db import make_engine
+    from app.models import Appointment, Consulta, Patient
+
+    engine = make_engine(url)
+    reader = make_engine(url, readonly=True)
+    stats = {"lecturas": 0, "escrituras": 0, "bloqueos": 0, "errores": 0}
+    lock = threading.Lock()
+    fin = time.monotonic() + segundos
+
+    def sumar(clave):
+        with lock:
+            stats[clave] += 1
+
+    def escritor(rnd):
+        while time.monotonic() < fin:
+            try:
+                with Session(engine) as s:
+                    pid = rnd.randint(1, 200)
+                    s.add(Consulta(patient_id=pid, fecha=datetime.now(), dx="estrés"))
+                    s.add(Appointment(patient_id=pid, fecha=datetime.now() + timedelta(days=rnd.randint(0, 30))))
+                    s.commit()
+                sumar("escrituras")
+            except OperationalError as e:
+                sumar("bloqueos" if "locked" in str(e) else "errores")
+
+    def lector(rnd):
+        while time.monotonic() < fin:
+            try:
+                with Session(reader) as s:
+                    pid = rnd.randint(1, 200)
+                    s.exec(select(func.count(Consulta.id)).where(Consulta.patient_id == pid)).one()
+                    s.exec(select(Patient).order_by(Patient.created_at.desc()).limit(50)).all()
+                sumar("lecturas")
+            except OperationalError as e:
+                sumar("bloqueos" if "locked" in str(e) else "errores")
+
+    rnd = random.Random(semilla)
+    ths = [threading.Thread(target=(escritor if i % 2 else lector), args=(random.Random(rnd.random()),))
+           for i in range(hilos)]
+    for t in ths:
+        t.start()
+    for t in ths:
+        t.join()
+    salida.put(stats)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--procesos", type=int, default=4)
+    ap.add_argument("--hilos", type=int, default=8)
+    ap.add_argument("--segundos", type=float, default=10)
+    ap.add_argument("--db", default=None, help="URL SQLite (por defecto un archivo temporal)")
+    args = ap.parse_args(argv)
+
+    from sqlmodel import Session, SQLModel
+    from app.db import make_engine
+    from app.migraciones import migrar
+    from app.models import Patient
+
+    tmp = None
+    url = args.db
+    if not url:
+        tmp = tempfile.mkdtemp()
+        url = f"sqlite:///{os.path.join(tmp, 'stress.db')}"
+    engine = make_engine(url)
+    SQLModel.metadata.create_all(engine)
+    migrar(engine)
+    with Session(engine) as s:
+        s.add_all([Patient(nombre=f"Paciente {i}") for i in range(200)])
+        s.commit()
+    engine.dispose()
+
+    cola = mp.Queue()
+    procs = [mp.Process(target=_worker, args=(url, args.hilos, args.segundos, i, cola)) for i in range(args.procesos)]
+    t0 = time.perf_counter()
+    for p in procs:
+        p.start()
+    total = {"lecturas": 0, "escrituras": 0, "bloqueos": 0, "errores": 0}
+    for _ in procs:
+        for k, v in cola.get().items():
+            total[k] += v
+    for p in procs:
+        p.join()
+    dur = time.perf_counter() - t0
+
+    print(f"{args.procesos} procesos x {args.hilos} hilos durante {dur:.1f}s")
+    print(f"lecturas: {total['lecturas']} ({total['lecturas'] / dur:.0f}/s)")
+    print(f"escrituras: {total['escrituras']} ({total['escrituras'] / dur:.0f}/s)")
+    print(f"database is locked: {total['bloqueos']}  otros errores: {total['errores']}")
+    return 1 if (total["bloqueos"] or total["errores"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())